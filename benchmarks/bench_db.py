@@ -0,0 +1,73 @@
+"""
+Benchmark of the bulk DB writes (apply_vlan_changes) against the per-row functions (add_vlan, update_vlan,
+delete_vlan), on a copy of the bundled vlan_sync.sqlite
+Run from the repository root: python -m benchmarks.bench_db [-n 4000]
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from etc.db_ops import init_db, add_vlan, update_vlan, delete_vlan, apply_vlan_changes
+from etc.diff import VlanOperation, TARGET_DB, OP_ADD, OP_REMOVE, OP_RENAME
+
+BUNDLED_DB = "vlan_sync.sqlite"
+logger = logging.getLogger("bench")
+
+
+def new_db(workdir, name):
+    filename = os.path.join(workdir, name)
+    shutil.copy(BUNDLED_DB, filename)
+    return init_db(f"sqlite:///{filename}", echo=False)
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f}s")
+    return elapsed
+
+
+def per_row_delete(session_obj, vlan_ids):
+    for vlan_id in vlan_ids:
+        delete_vlan(session_obj, logger, vlan_id)
+    # delete_vlan() only flushes
+    session_obj().commit()
+
+
+def per_row(session_obj, vlan_ids):
+    timed("per-row add", lambda: [add_vlan(session_obj, logger, v, f"vlan-{v}") for v in vlan_ids])
+    timed("per-row update", lambda: [update_vlan(session_obj, logger, v, f"new-{v}") for v in vlan_ids])
+    timed("per-row delete", per_row_delete, session_obj, vlan_ids)
+
+
+def bulk(session_obj, vlan_ids, chunk_size):
+    label = f"(chunk {chunk_size})" if chunk_size else "(one transaction)"
+    adds = [VlanOperation(TARGET_DB, "bench", OP_ADD, v, f"vlan-{v}") for v in vlan_ids]
+    renames = [VlanOperation(TARGET_DB, "bench", OP_RENAME, v, f"new-{v}") for v in vlan_ids]
+    removes = [VlanOperation(TARGET_DB, "bench", OP_REMOVE, v, "") for v in vlan_ids]
+    timed(f"bulk add {label}", apply_vlan_changes, session_obj, logger, adds, chunk_size)
+    timed(f"bulk update {label}", apply_vlan_changes, session_obj, logger, renames, chunk_size)
+    timed(f"bulk delete {label}", apply_vlan_changes, session_obj, logger, removes, chunk_size)
+
+
+def main(args):
+    vlan_ids = [str(vlan_id) for vlan_id in range(2, args.number + 2)]
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"VLAN changes: {len(vlan_ids)}")
+        per_row(new_db(workdir, "per_row.sqlite"), vlan_ids)
+        bulk(new_db(workdir, "bulk.sqlite"), vlan_ids, 0)
+        bulk(new_db(workdir, "bulk_chunk.sqlite"), vlan_ids, args.chunk)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk DB writes benchmark")
+    parser.add_argument("-n", "--number", type=int, default=4000, help="VLAN changes per operation")
+    parser.add_argument("-c", "--chunk", type=int, default=500, help="Operations per transaction")
+    main(parser.parse_args())
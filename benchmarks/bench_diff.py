@@ -0,0 +1,46 @@
+"""
+Micro-benchmark of the VLAN diff engine (etc/diff.py)
+Run from the repository root: python -m benchmarks.bench_diff [-v 4094] [-d 10000]
+"""
+import argparse
+import random
+import time
+
+from etc.diff import diff_vlans
+
+
+def build_fleet(vlan_count, device_count, variants=64, seed=1):
+    """
+    DB VLANs plus previous/current VLANs per device, with a few changes per device.
+    Devices share a pool of VLAN tables to keep the benchmark memory bounded.
+    """
+    rnd = random.Random(seed)
+    db = {str(vlan_id): f"vlan-{vlan_id}" for vlan_id in range(1, vlan_count + 1)}
+    previous = dict(db)
+    pool = []
+    for _ in range(variants):
+        current = dict(db)
+        for vlan_id in rnd.sample(range(2, vlan_count + 1), 3):
+            current.pop(str(vlan_id), None)
+        current[str(rnd.randint(2, vlan_count))] = "renamed"
+        pool.append(current)
+    devices = [(f"sw{index}", pool[index % variants], previous) for index in range(device_count)]
+    return db, devices
+
+
+def main(args):
+    db, devices = build_fleet(args.vlans, args.devices)
+    operations = 0
+    start = time.perf_counter()
+    for dev_name, current, previous in devices:
+        operations += len(diff_vlans(dev_name, db, current, previous))
+    elapsed = time.perf_counter() - start
+    print(f"VLANs: {args.vlans} Devices: {args.devices} Operations: {operations}")
+    print(f"Total: {elapsed:.3f}s Per device: {elapsed / args.devices * 1e6:.1f}us")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VLAN diff engine benchmark")
+    parser.add_argument("-v", "--vlans", type=int, default=4094, help="VLANs per device")
+    parser.add_argument("-d", "--devices", type=int, default=10000, help="Number of devices")
+    main(parser.parse_args())
@@ -0,0 +1,284 @@
+"""
+End-to-end benchmark of a poll cycle against a simulated fleet: main() -> sync_vlans() -> sync_device() with
+ConnectHandler replaced by fake devices with configurable latency, VLAN count, output size and failure rates.
+Every fleet size runs in its own process, so the peak RSS is per size. Results are saved as JSON to compare
+between changes. With -p, the extra commands of the collection plan run in the same sessions.
+Run from the repository root: python -m benchmarks.bench_fleet [-s 10 1000 10000] [-o bench_fleet.json]
+    [-p "show interfaces trunk" "show ip interface brief"]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import yaml
+
+import etc.device_ops
+import etc.session_pool
+import vlan_sync_tool
+from etc.logger_svc import PIPELINE
+from etc.metrics import METRICS, STAGE_DB_WRITE, STAGE_DEVICE
+from netmiko import NetmikoAuthenticationException, NetmikoTimeoutException
+
+DEFAULT_SIZES = (10, 1000, 10000)
+# Devices share a pool of VLAN tables (DB VLANs with a few changes each) to keep the fleet memory bounded
+VARIANTS = 64
+SECOND_TABLE_ROW = "{:<4} enet  {:<10} 1500  -      -      -        -    -        0      0\n"
+# Output of the collection plan commands, other than the VLAN command
+EXTRA_OUTPUT = """
+Port        Vlans allowed on trunk
+Gi0/1       1-4094
+
+Interface              IP-Address      OK? Method Status                Protocol
+Vlan1                  10.0.0.1        YES NVRAM  up                    up
+"""
+
+
+def show_vlan_output(vlan_ids, renamed, output_bytes):
+    """
+    Cisco "show vlan" output with the VLANs, padded with the second table up to output_bytes
+    """
+    lines = ["\nVLAN Name                             Status    Ports\n",
+             "---- -------------------------------- --------- -------------------------------\n"]
+    for vlan_id in vlan_ids:
+        name = "renamed" if vlan_id == renamed else f"VLAN-{vlan_id}"
+        lines.append(f"{vlan_id:<4} {name:<32} active    Gi0/{vlan_id % 48}\n")
+    lines.append("\nVLAN Type  SAID       MTU   Parent RingNo BridgeNo Stp  BrdgMode Trans1 Trans2\n")
+    lines.append("---- ----- ---------- ----- ------ ------ -------- ---- -------- ------ ------\n")
+    size = sum(len(line) for line in lines)
+    index = 0
+    while size < output_bytes:
+        vlan_id = vlan_ids[index % len(vlan_ids)]
+        line = SECOND_TABLE_ROW.format(vlan_id, 100000 + vlan_id)
+        lines.append(line)
+        size += len(line)
+        index += 1
+    return "".join(lines)
+
+
+class SimulatedFleet:
+    """
+    ConnectHandler stand-in. Each login and command sleeps its latency (+/- jitter) and the login fails with the
+    configured timeout and authentication rates
+    """
+    def __init__(self, vlans=300, output_bytes=0, connect_latency=0.02, command_latency=0.01, jitter=0.5,
+                 timeout_rate=0.0, auth_rate=0.0, seed=1):
+        self.connect_latency = connect_latency
+        self.command_latency = command_latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.auth_rate = auth_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.commands = 0
+        self.failures = 0
+        rnd = random.Random(seed)
+        vlan_ids = list(range(1, vlans + 1))
+        self.outputs = []
+        for _ in range(VARIANTS):
+            removed = set(rnd.sample(vlan_ids[1:], min(3, vlans - 1)))
+            current = [vlan_id for vlan_id in vlan_ids if vlan_id not in removed]
+            self.outputs.append(show_vlan_output(current, rnd.choice(current), output_bytes))
+
+    def __repr__(self):
+        return f"<SimulatedFleet(Logins={self.logins}, Commands={self.commands}, Failures={self.failures}>"
+
+    def delay(self, latency):
+        if latency:
+            with self.lock:
+                factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(latency * factor)
+
+    def __call__(self, **params):
+        with self.lock:
+            self.logins += 1
+            draw = self.random.random()
+        self.delay(self.connect_latency)
+        if draw < self.timeout_rate:
+            with self.lock:
+                self.failures += 1
+            raise NetmikoTimeoutException(f"TCP connection to device failed {params['host']}")
+        if draw < self.timeout_rate + self.auth_rate:
+            with self.lock:
+                self.failures += 1
+            raise NetmikoAuthenticationException(f"Authentication to device failed {params['host']}")
+        return SimulatedSession(self, self.outputs[zlib.crc32(params["host"].encode()) % VARIANTS])
+
+
+class SimulatedSession:
+    def __init__(self, fleet, output):
+        self.fleet = fleet
+        self.output = output
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send_command(self, command, **kwargs):
+        with self.fleet.lock:
+            self.fleet.commands += 1
+        self.fleet.delay(self.fleet.command_latency)
+        return self.output if command == "show vlan" else EXTRA_OUTPUT
+
+    def is_alive(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+
+def write_files(workdir, args):
+    """
+    Tool configuration and inventory of the fleet, like vlan_sync_cfg.yml and inventory.yml
+    """
+    os.makedirs(os.path.join(workdir, "logs"))
+    inventory_file = os.path.join(workdir, "inventory.yml")
+    hosts = [{"name": f"sim-{index}", "host": f"10.{index // 65536}.{index // 256 % 256}.{index % 256}",
+              "device_type": "cisco_ios", "site": f"site-{index % 16}"} for index in range(args.devices)]
+    with open(inventory_file, "w") as file:
+        yaml.safe_dump({"hosts": hosts}, file)
+    config = {
+        "poller": {"logging_level": args.log_level, "logging_file": "logs/poller.log", "log_max_size": 10000000,
+                   "backup_count": 1, "workers": args.workers, "transport": "thread",
+                   "change_cache": True, "metrics_file": "logs/metrics.json",
+                   "collection_plan": {"cisco_ios": args.plan}},
+        "db_orm": {"logging_level": args.log_level, "logging_file": "logs/orm.log", "log_max_size": 10000000,
+                   "backup_count": 1, "write_chunk_size": 0},
+        "inventory_sources": {"file_list": [{"filename": inventory_file}]},
+    }
+    config_file = os.path.join(workdir, "vlan_sync_cfg.yml")
+    with open(config_file, "w") as file:
+        yaml.safe_dump(config, file)
+    return config_file
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_cycle(config_file, fleet):
+    """
+    One main() run (one poll cycle)
+    """
+    METRICS.reset()
+    logins, commands, failures = fleet.logins, fleet.commands, fleet.failures
+    start = time.perf_counter()
+    vlan_sync_tool.main(["poll", "-f", config_file])
+    elapsed = time.perf_counter() - start
+    summary = METRICS.summary()
+    latencies = [seconds for (_, stage), seconds in METRICS.devices.items() if stage == STAGE_DEVICE]
+    gauges = {gauge["name"]: gauge["value"] for gauge in summary["gauges"] if not gauge["labels"]}
+    cycle = gauges.get("cycle_duration_seconds", elapsed)
+    return {
+        "main_seconds": round(elapsed, 4),
+        "cycle_seconds": round(cycle, 4),
+        "devices_per_second": round(len(latencies) / cycle, 2) if cycle else 0.0,
+        "device_p50_seconds": round(percentile(latencies, 0.50), 6),
+        "device_p99_seconds": round(percentile(latencies, 0.99), 6),
+        "db_write_seconds": summary["stages"].get(STAGE_DB_WRITE, {}).get("sum", 0.0),
+        "logins": fleet.logins - logins,
+        "commands": fleet.commands - commands,
+        "failures": fleet.failures - failures,
+        "stages": summary["stages"],
+    }
+
+
+def run_size(args):
+    """
+    Child process: one fleet size, all its cycles
+    """
+    fleet = SimulatedFleet(args.vlans, args.output_bytes, args.connect_latency, args.command_latency, args.jitter,
+                           args.timeout_rate, args.auth_rate)
+    etc.device_ops.ConnectHandler = fleet
+    etc.session_pool.ConnectHandler = fleet
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        config_file = write_files(workdir, args)
+        # The tool DB and logs are relative paths, and the tool output is discarded
+        os.chdir(workdir)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            cycles = [run_cycle(config_file, fleet) for _ in range(args.cycles)]
+            PIPELINE.stop()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return {"devices": args.devices, "cycles": cycles,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def child_arguments(args, devices):
+    names = ("vlans", "output_bytes", "connect_latency", "command_latency", "jitter", "timeout_rate", "auth_rate",
+             "workers", "cycles", "log_level")
+    arguments = [sys.executable, "-m", "benchmarks.bench_fleet", "--child", "--devices", str(devices)]
+    for name in names:
+        arguments += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    return arguments + ["--plan"] + args.plan
+
+
+def main(args):
+    if args.child:
+        print(json.dumps(run_size(args)))
+        return
+    results = []
+    for devices in args.sizes:
+        output = subprocess.run(child_arguments(args, devices), capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        for number, cycle in enumerate(result["cycles"], 1):
+            print(f"Devices {devices:>6} cycle {number}: {cycle['devices_per_second']:9.1f} devices/s "
+                  f"p50 {cycle['device_p50_seconds'] * 1000:7.1f}ms p99 {cycle['device_p99_seconds'] * 1000:7.1f}ms "
+                  f"DB write {cycle['db_write_seconds']:6.3f}s cycle {cycle['cycle_seconds']:7.2f}s "
+                  f"logins {cycle['logins']} commands {cycle['commands']} failures {cycle['failures']}")
+        print(f"Devices {devices:>6} peak RSS {result['peak_rss_mb']:.1f}MB")
+    report = {"commit": git_commit(), "python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "parameters": {name: value for name, value in vars(args).items() if name not in ("child", "output")},
+              "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved in {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated fleet end-to-end benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Fleet sizes")
+    parser.add_argument("-v", "--vlans", type=int, default=300, help="VLANs per device")
+    parser.add_argument("-b", "--output-bytes", type=int, default=0, help="Minimum output size per device")
+    parser.add_argument("--connect-latency", type=float, default=0.02, help="Seconds per login")
+    parser.add_argument("--command-latency", type=float, default=0.01, help="Seconds per command")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Random +/- fraction of the latencies")
+    parser.add_argument("--timeout-rate", type=float, default=0.01, help="Fraction of logins timing out")
+    parser.add_argument("--auth-rate", type=float, default=0.001, help="Fraction of logins failing authentication")
+    parser.add_argument("-w", "--workers", type=int, default=64, help="poller.workers")
+    parser.add_argument("-c", "--cycles", type=int, default=2, help="Cycles (main() runs) per fleet size")
+    parser.add_argument("-l", "--log-level", default="INFO", help="poller and db_orm logging_level")
+    parser.add_argument("-o", "--output", default="bench_fleet.json", help="JSON results file")
+    parser.add_argument("-p", "--plan", nargs="*", default=[], help="Collection plan commands besides show vlan")
+    parser.add_argument("--devices", type=int, default=10, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    main(parser.parse_args())
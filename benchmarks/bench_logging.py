@@ -0,0 +1,75 @@
+"""
+Logging overhead per poll cycle at DEBUG and INFO: the simulated fleet cycle (benchmarks/bench_fleet.py, no
+device latency) with each logging level, against the same cycle with logging off (CRITICAL).
+Plus the cost of one call to a disabled and to an enabled level with a VLAN table as argument
+Run from the repository root: python -m benchmarks.bench_logging [-d 1000]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from benchmarks.bench_fleet import child_arguments
+from etc.logger_svc import CustomLogger, PIPELINE
+
+LEVELS = ("CRITICAL", "INFO", "DEBUG")
+
+
+def cycle_seconds(args, level):
+    """
+    Fastest cycle time of the fleet with the logging level
+    """
+    fleet_args = argparse.Namespace(vlans=args.vlans, output_bytes=0, connect_latency=0, command_latency=0,
+                                    jitter=0, timeout_rate=0, auth_rate=0, workers=args.workers,
+                                    cycles=args.cycles, log_level=level)
+    output = subprocess.run(child_arguments(fleet_args, args.devices), capture_output=True, text=True,
+                            check=True).stdout
+    cycles = json.loads(output.strip().splitlines()[-1])["cycles"]
+    # First cycle adds the VLANs to the DB, the next ones are the steady state
+    return [cycle["cycle_seconds"] for cycle in cycles]
+
+
+def call_cost(level, calls, vlans):
+    """
+    Microseconds per logger.debug() call with a VLAN table, with the logger at level
+    """
+    workdir = tempfile.mkdtemp()
+    logger = CustomLogger(f"bench_{level.lower()}", {"logging_level": level,
+                                                      "logging_file": os.path.join(workdir, "bench.log"),
+                                                      "log_max_size": 0})
+    table = [{"vlan_id": str(vlan_id), "vlan_name": f"VLAN-{vlan_id}"} for vlan_id in range(vlans)]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(calls):
+            logger.debug("%s", table)
+        elapsed = time.perf_counter() - start
+        PIPELINE.stop()
+    shutil.rmtree(workdir)
+    return elapsed / calls * 1e6
+
+
+def main(args):
+    print(f"Devices: {args.devices} VLANs: {args.vlans} Workers: {args.workers}")
+    results = {level: cycle_seconds(args, level) for level in LEVELS}
+    off = results["CRITICAL"]
+    for level in LEVELS:
+        cycles = results[level]
+        overhead = [cycle - base for cycle, base in zip(cycles, off)]
+        print(f"{level:<8} cycles " + " ".join(f"{cycle:7.3f}s" for cycle in cycles) +
+              "  overhead " + " ".join(f"{extra:+7.3f}s" for extra in overhead))
+    for level in ("INFO", "DEBUG"):
+        print(f"logger.debug(VLAN table) at {level:<5} {call_cost(level, args.calls, args.vlans):9.2f}us per call")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+    parser.add_argument("-d", "--devices", type=int, default=1000, help="Simulated devices")
+    parser.add_argument("-v", "--vlans", type=int, default=300, help="VLANs per device")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="poller.workers")
+    parser.add_argument("-c", "--cycles", type=int, default=2, help="Cycles per level")
+    parser.add_argument("-n", "--calls", type=int, default=2000, help="Calls for the per call cost")
+    main(parser.parse_args())
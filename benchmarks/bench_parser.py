@@ -0,0 +1,75 @@
+"""
+Parser throughput on 4094-VLAN outputs with long port lists (etc/parsers.py), compared with the previous
+split() + re.search() parser
+Run from the repository root: python -m benchmarks.bench_parser [-v 4094] [-p 48] [-r 20]
+"""
+import argparse
+import re
+import time
+
+from etc.parsers import get_parser
+
+
+def legacy_parser(output):
+    """
+    Previous custom_parser() for cisco_ios "show vlan"
+    """
+    parsed_output = []
+    pattern = r"^(\d+)\s+(\S+)\s+\S+.*$"
+    for line in output.split("\n"):
+        match = re.search(pattern, line)
+        if match:
+            parsed_output.append({"vlan_id": match.group(1), "vlan_name": match.group(2)})
+    return parsed_output
+
+
+def cisco_output(vlan_count, ports, width=6):
+    """
+    "show vlan" with the port list wrapped in lines of width ports, plus the VLAN Type table
+    """
+    port_list = [f"Gi1/0/{port}" for port in range(1, ports + 1)]
+    wrapped = [", ".join(port_list[i:i + width]) for i in range(0, len(port_list), width)] or [""]
+    lines = ["", "VLAN Name                             Status    Ports",
+             "---- -------------------------------- --------- -------------------------------"]
+    for vlan_id in range(1, vlan_count + 1):
+        lines.append(f"{vlan_id:<4} {'VLAN' + str(vlan_id):<32} active    {wrapped[0]}")
+        lines.extend(f"{'':<48}{chunk}" for chunk in wrapped[1:])
+    lines.extend(["", "VLAN Type  SAID       MTU   Parent RingNo BridgeNo Stp  BrdgMode Trans1 Trans2",
+                  "---- ----- ---------- ----- ------ ------ -------- ---- -------- ------ ------"])
+    lines.extend(f"{vlan_id:<4} enet  {100000 + vlan_id:<10} 1500  -      -      -        -    -        0      0"
+                 for vlan_id in range(1, vlan_count + 1))
+    return "\n".join(lines) + "\n"
+
+
+def junos_output(vlan_count, ports):
+    lines = ["", "Routing instance        VLAN name             Tag          Interfaces"]
+    for vlan_id in range(1, vlan_count + 1):
+        lines.append(f"{'default-switch':<24}{'v' + str(vlan_id):<22}{vlan_id}")
+        lines.extend(f"{'':<59}ge-0/0/{port}.0*" for port in range(ports))
+    return "\n".join(lines) + "\n"
+
+
+def measure(label, function, output, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parsed = function(output)
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{label:<26} {len(output) / 1e6:6.2f}MB {len(parsed):6} rows {elapsed * 1e3:8.2f}ms "
+          f"{len(output) / elapsed / 1e6:8.1f}MB/s")
+
+
+def main(args):
+    output = cisco_output(args.vlans, args.ports)
+    measure("legacy cisco_ios", legacy_parser, output, args.rounds)
+    for device_type in ("cisco_ios", "cisco_nxos", "arista_eos"):
+        measure(device_type, get_parser(device_type, "show vlan"), output, args.rounds)
+    measure("juniper_junos", get_parser("juniper_junos", "show vlans"), junos_output(args.vlans, args.ports),
+            args.rounds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VLAN parsers benchmark")
+    parser.add_argument("-v", "--vlans", type=int, default=4094, help="VLANs in the output")
+    parser.add_argument("-p", "--ports", type=int, default=48, help="Ports per VLAN")
+    parser.add_argument("-r", "--rounds", type=int, default=20, help="Rounds per parser")
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""
+Fleet report times at 1k and 10k devices: fleet matrix build (one update per device, like the poller), save and
+load of the matrix file, each report, the matrix from the DB device VLANs, and the whole report command (process
+start included) as CSV and JSON
+Run from the repository root: python -m benchmarks.bench_report [-s 1000 10000] [-v 200]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from etc.db_ops import init_db, add_vlan, save_device_vlans, query_fleet_vlans
+from etc.fleet_matrix import FleetMatrix, REPORTS
+from etc.vlanset import VlanSet
+
+logger = logging.getLogger("bench")
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def make_fleet(devices, vlans, seed=1):
+    """
+    DB VLANs, and devices with most of them, a few renamed and a few local VLANs
+    """
+    generator = random.Random(seed)
+    vlans_db = VlanSet.from_items((vlan_id, f"VLAN{vlan_id}") for vlan_id in generator.sample(range(2, 4094), vlans))
+    fleet = {}
+    for index in range(devices):
+        items = [(vlan_id, name if generator.random() > 0.01 else f"{name}-old") for vlan_id, name in vlans_db.items()
+                 if generator.random() > 0.02]
+        items.extend((vlan_id, f"local{vlan_id}") for vlan_id in generator.sample(range(2, 4094), 2))
+        fleet[f"sw{index}"] = VlanSet.from_items(items)
+    return vlans_db, fleet
+
+
+def main(args):
+    print(f"{'devices':>8} {'build':>8} {'save':>8} {'load':>8} " + " ".join(f"{kind:>8}" for kind in REPORTS) +
+          f" {'from DB':>8} {'CLI csv':>8} {'CLI json':>8}")
+    for devices in args.sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            vlans_db, fleet = make_fleet(devices, args.vlans)
+            build, matrix = timed(lambda: FleetMatrix.from_vlan_sets(fleet))
+            matrix_file = os.path.join(workdir, "fleet_matrix.npz")
+            save = timed(lambda: matrix.save(matrix_file))[0]
+            load = timed(lambda: FleetMatrix.load(matrix_file))[0]
+            vlan_id = vlans_db.ids()[0]
+            reports = [timed(lambda: matrix.report(kind, vlans_db, vlan_id))[0] for kind in REPORTS]
+
+            db_url = f"sqlite:///{os.path.join(workdir, 'vlan_sync.sqlite')}"
+            session_obj = init_db(db_url)
+            for db_vlan_id, name in vlans_db.items():
+                add_vlan(session_obj, logger, str(db_vlan_id), name)
+            save_device_vlans(session_obj, logger, {device: vlans.items() for device, vlans in fleet.items()})
+            from_db = timed(lambda: FleetMatrix.from_db_rows(query_fleet_vlans(session_obj, logger)))[0]
+
+            config_file = os.path.join(workdir, "vlan_sync_cfg.yml")
+            logging_config = {"logging_level": "ERROR", "logging_file": os.path.join(workdir, "tool.log")}
+            with open(config_file, "w") as file:
+                yaml.safe_dump({"poller": dict(logging_config, matrix_file=matrix_file),
+                                "db_orm": dict(logging_config, db_url=db_url),
+                                "inventory_sources": {"file_list": [{"filename": "inventory.yml"}]}}, file)
+            cli = [timed(lambda: subprocess.run([sys.executable, "vlan_sync_tool.py", "report", "drift", "--format",
+                                                 report_format, "-f", config_file, "-o",
+                                                 os.path.join(workdir, f"drift.{report_format}")], check=True))[0]
+                   for report_format in ("csv", "json")]
+            print(f"{devices:>8} " + " ".join(f"{seconds:>7.3f}s" for seconds in
+                                               [build, save, load] + reports + [from_db] + cli))
+        finally:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fleet matrix and report command benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000, 10000], help="Devices")
+    parser.add_argument("-v", "--vlans", type=int, default=200, help="DB VLANs, most of them on every device")
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""
+Fleet queries on the devices/device_vlans schema: per-VLAN (which devices carry VLAN x), per-device and VLAN
+counts, at 10k devices x 500 VLANs. The per-VLAN query is compared with the same query without the index
+(+vlan_id disables the index: a full table scan, like with vlans_per_device)
+Run from the repository root: python -m benchmarks.bench_schema [-d 10000] [-v 500] [-q 200]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from etc.db_ops import init_db, save_device_vlans, query_vlan_devices, query_device_vlans, query_vlan_device_counts
+
+logger = logging.getLogger("bench")
+# Devices per save_device_vlans() call while filling the DB
+FILL_DEVICES = 500
+
+
+def fill(session_obj, devices, vlans, rnd):
+    """
+    Each device has vlans VLANs out of a range of twice that, so every VLAN is on about half of the devices
+    """
+    vlan_range = range(1, vlans * 2 + 1)
+    for start in range(0, devices, FILL_DEVICES):
+        save_device_vlans(session_obj, logger, {
+            f"sw{index}": [(vlan_id, f"VLAN-{vlan_id}") for vlan_id in sorted(rnd.sample(vlan_range, vlans))]
+            for index in range(start, min(devices, start + FILL_DEVICES))})
+
+
+def timed(label, function, arguments):
+    start = time.perf_counter()
+    rows = 0
+    for argument in arguments:
+        rows += len(function(argument))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed / len(arguments) * 1000:9.3f}ms per query ({rows // len(arguments)} rows)")
+
+
+def main(args):
+    rnd = random.Random(1)
+    workdir = tempfile.mkdtemp()
+    try:
+        session_obj = init_db(f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}", echo=False)
+        start = time.perf_counter()
+        fill(session_obj, args.devices, args.vlans, rnd)
+        print(f"Devices: {args.devices} VLANs per device: {args.vlans} Rows: {args.devices * args.vlans}")
+        print(f"{'fill (save_device_vlans)':<34} {time.perf_counter() - start:9.3f}s")
+        session_obj().execute(text("ANALYZE"))
+        vlan_ids = [rnd.randint(1, args.vlans * 2) for _ in range(args.queries)]
+        device_names = [f"sw{rnd.randrange(args.devices)}" for _ in range(args.queries)]
+        timed("per-VLAN devices", lambda vlan_id: query_vlan_devices(session_obj, logger, vlan_id), vlan_ids)
+        for label, condition in (("index", "vlan_id"), ("full scan", "+vlan_id")):
+            statement = text(f"SELECT device_id FROM device_vlans WHERE {condition} = :vlan_id")
+            timed(f"per-VLAN device ids ({label})",
+                  lambda vlan_id: session_obj().execute(statement, {"vlan_id": vlan_id}).fetchall(),
+                  vlan_ids if label == "index" else vlan_ids[:5])
+        timed("per-device VLANs (primary key)", lambda name: query_device_vlans(session_obj, logger, name),
+              device_names)
+        timed("devices per VLAN (index only)", lambda _: query_vlan_device_counts(session_obj, logger), [None] * 3)
+        replace = {f"sw{index}": [(vlan_id, "renamed") for vlan_id in range(1, args.vlans + 1)]
+                   for index in range(0, args.devices, max(1, args.devices // 100))}
+        start = time.perf_counter()
+        save_device_vlans(session_obj, logger, replace)
+        print(f"{'replace ' + str(len(replace)) + ' devices':<34} {(time.perf_counter() - start) * 1000:9.3f}ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Device VLANs schema query benchmark")
+    parser.add_argument("-d", "--devices", type=int, default=10000, help="Devices")
+    parser.add_argument("-v", "--vlans", type=int, default=500, help="VLANs per device")
+    parser.add_argument("-q", "--queries", type=int, default=200, help="Queries per lookup type")
+    main(parser.parse_args())
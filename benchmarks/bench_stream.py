@@ -0,0 +1,104 @@
+"""
+Per-device latency and peak memory of one large "show vlan" (chassis switch: 4094 VLANs, long port lists), read
+from a simulated channel at a fixed rate: buffered (send_command() read loop, then parse) and streamed
+(etc/device_ops.py stream_parse(), parsed as it arrives and stopped after the VLAN table)
+Run from the repository root: python -m benchmarks.bench_stream [-v 4094] [-p 48] [-r 2000000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.bench_parser import cisco_output
+from etc.device_ops import stream_parse
+from etc.parsers import get_parser, get_stream_parser
+
+PROMPT = "chassis-1#"
+# send_command() read loop delay
+SEND_COMMAND_DELAY = 0.2
+
+
+class SimulatedChannel:
+    """
+    Netmiko connection stand-in: the output arrives at rate bytes per second after the command is sent
+    """
+    timeout = 600
+
+    def __init__(self, output, rate):
+        self.output = output + PROMPT
+        self.rate = rate
+        self.sent = 0
+        self.start = None
+
+    def find_prompt(self):
+        return PROMPT
+
+    def clear_buffer(self):
+        pass
+
+    def normalize_cmd(self, command):
+        return f"{command}\n"
+
+    def normalize_linefeeds(self, data):
+        return data
+
+    def write_channel(self, data):
+        self.command = data.strip()
+        self.start = time.perf_counter()
+        self.sent = 0
+
+    def read_until_pattern(self, pattern):
+        return f"{PROMPT}{self.command}\n"
+
+    def read_channel(self):
+        arrived = min(len(self.output), int((time.perf_counter() - self.start) * self.rate))
+        data = self.output[self.sent:arrived]
+        self.sent = arrived
+        return data
+
+    def send_command(self, command):
+        """
+        Netmiko read loop: all the output, read every SEND_COMMAND_DELAY seconds up to the prompt
+        """
+        self.write_channel(command)
+        output = ""
+        while not output.endswith(PROMPT):
+            time.sleep(SEND_COMMAND_DELAY)
+            output += self.read_channel()
+        return output
+
+
+def buffered(channel):
+    return get_parser("cisco_ios", "show vlan")(channel.send_command("show vlan"))
+
+
+def streamed(channel):
+    parser = get_stream_parser("cisco_ios", "show vlan")()
+    stream_parse(channel, "show vlan", parser, channel.timeout)
+    return parser.close()
+
+
+def measure(label, function, channel):
+    tracemalloc.start()
+    start = time.perf_counter()
+    parsed = function(channel)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<10} {len(parsed):6} rows {elapsed * 1e3:9.1f}ms peak {peak / 1e6:7.2f}MB "
+          f"read {channel.sent / 1e6:6.2f}MB")
+    return parsed
+
+
+def main(args):
+    output = cisco_output(args.vlans, args.ports)
+    print(f"Output {len(output) / 1e6:.2f}MB at {args.rate / 1e6:.1f}MB/s")
+    expected = measure("buffered", buffered, SimulatedChannel(output, args.rate))
+    assert measure("streamed", streamed, SimulatedChannel(output, args.rate)) == expected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Streamed and buffered device output benchmark")
+    parser.add_argument("-v", "--vlans", type=int, default=4094, help="VLANs in the output")
+    parser.add_argument("-p", "--ports", type=int, default=48, help="Ports per VLAN")
+    parser.add_argument("-r", "--rate", type=float, default=2e6, help="Channel bytes per second")
+    main(parser.parse_args())
@@ -0,0 +1,85 @@
+"""
+Memory and diff time of the per-device VLAN state: parser output (list of dicts) and {vlan_id: vlan_name} dicts
+against VlanSet (etc/vlanset.py)
+Run from the repository root: python -m benchmarks.bench_vlanset [-v 300] [-d 2000]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from etc.diff import diff_vlans, diff_vlan_sets, index_device_vlans
+from etc.vlanset import VlanSet
+
+
+def parsed_output(vlan_ids, rnd):
+    """
+    Parser output of one device: the DB VLANs with a few differences. New strings per device, like the parser
+    """
+    vlan_ids = [vlan_id for vlan_id in vlan_ids if rnd.random() > 0.01]
+    parsed = [{"vlan_id": str(vlan_id), "vlan_name": "".join(["VLAN-", str(vlan_id)])} for vlan_id in vlan_ids]
+    parsed[rnd.randrange(len(parsed))]["vlan_name"] = "renamed"
+    return parsed
+
+
+def measure_memory(label, build, vlan_ids, device_count):
+    """
+    Memory kept by the per-device state, after the parser output is released
+    """
+    rnd = random.Random(1)
+    gc.collect()
+    tracemalloc.start()
+    state = [build(parsed_output(vlan_ids, rnd)) for _ in range(device_count)]
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<34} {size / 1e6:8.1f}MB {size / device_count / 1e3:8.1f}KB/device")
+    return state
+
+
+def measure_time(label, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{label:<34} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def fleet_union(sets):
+    bits = 0
+    for vlan_set in sets:
+        bits |= vlan_set.bits
+    return bits
+
+
+def main(args):
+    vlan_ids = random.Random(0).sample(range(2, 4000), args.vlans)
+    db_index = {str(vlan_id): f"VLAN-{vlan_id}" for vlan_id in vlan_ids}
+    db_set = VlanSet.from_items(db_index.items())
+    print(f"VLANs per device: {args.vlans} Devices: {args.devices}")
+
+    measure_memory("list of dicts (parser output)", lambda parsed: parsed, vlan_ids, args.devices)
+    measure_memory("list of [k, v] (get_device_vlans)",
+                   lambda parsed: [[k, v] for x in parsed for k, v in x.items()], vlan_ids, args.devices)
+    dicts = measure_memory("dict {vlan_id: vlan_name}", index_device_vlans, vlan_ids, args.devices)
+    sets = measure_memory("VlanSet", VlanSet.from_parsed, vlan_ids, args.devices)
+
+    operations = measure_time("diff dicts", lambda: sum(len(diff_vlans("sw", db_index, d, d)) for d in dicts))
+    measure_time("diff VlanSet", lambda: sum(len(diff_vlan_sets("sw", db_set, s, s)) for s in sets))
+    print(f"Operations: {operations}")
+    in_sync_index = dict(db_index, **{"1": "default"})
+    in_sync_set = VlanSet.from_items(in_sync_index.items())
+    measure_time("diff dicts, in sync", lambda: [diff_vlans("sw", db_index, in_sync_index, in_sync_index)
+                                                 for _ in range(args.devices)])
+    measure_time("diff VlanSet, in sync", lambda: [diff_vlan_sets("sw", db_set, in_sync_set, in_sync_set)
+                                                   for _ in range(args.devices)])
+    measure_time("fleet union dicts", lambda: set().union(*dicts))
+    union_bits = measure_time("fleet union VlanSet", lambda: fleet_union(sets))
+    print(f"VLANs in the fleet: {bin(union_bits).count('1')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VlanSet memory and diff benchmark")
+    parser.add_argument("-v", "--vlans", type=int, default=300, help="VLANs per device")
+    parser.add_argument("-d", "--devices", type=int, default=2000, help="Number of devices")
+    main(parser.parse_args())
@@ -0,0 +1,71 @@
+"""
+Inventory startup time at 1k, 10k and 100k hosts: Inventory() of one inventory file, with the previous loader
+(yaml.safe_load, pure Python), the whole document with the libyaml loader, the streamed hosts (iter_hosts) and
+the binary cache (load_hosts, second run)
+Run from the repository root: python -m benchmarks.bench_yaml [-s 1000 10000 100000]
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from etc import ops
+from etc.inventory import Inventory
+
+logger = logging.getLogger("bench")
+
+
+def write_inventory(filename, hosts):
+    with open(filename, "w") as file:
+        file.write("hosts:\n")
+        for index in range(hosts):
+            file.write(f"  - name: sw{index}\n    host: 10.{index >> 16}.{index >> 8 & 255}.{index & 255}\n"
+                       f"    device_type: cisco_ios\n    group: default\n    site: site{index % 50}\n")
+
+
+def best(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(args):
+    print(f"libyaml: {yaml.__with_libyaml__}")
+    print(f"{'hosts':>8} {'safe_load':>10} {'C loader':>10} {'streamed':>10} {'Inventory':>10} {'cached':>10}")
+    for hosts in args.sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, "inventory.yml")
+            write_inventory(filename, hosts)
+            repeat = 1 if hosts >= 100000 else args.repeat
+
+            def pure_python():
+                with open(filename) as file:
+                    return yaml.safe_load(file.read())
+
+            cache_dir = os.path.join(workdir, "cache")
+            sources = {"file_list": [{"filename": filename}]}
+            results = [best(pure_python, repeat),
+                       best(lambda: ops.load_yaml(filename), repeat),
+                       best(lambda: list(ops.iter_hosts(filename)), repeat),
+                       # Cold: parse and write the cache
+                       best(lambda: (shutil.rmtree(cache_dir, ignore_errors=True),
+                                     Inventory(sources, logger, cache_dir)), repeat),
+                       best(lambda: Inventory(sources, logger, cache_dir), repeat)]
+            print(f"{hosts:>8} " + " ".join(f"{seconds:>9.3f}s" for seconds in results))
+        finally:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inventory file loading benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Hosts")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per measure, the best one is shown")
+    main(parser.parse_args())
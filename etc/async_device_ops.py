@@ -0,0 +1,134 @@
+import asyncio
+from etc.device_ops import DeviceError, parse_output
+from etc.metrics import METRICS, STAGE_COMMAND, STAGE_CONNECT
+from etc.parsers import get_stream_parser
+
+try:
+    import asyncssh
+except ImportError:
+    # Optional dependency, only needed with poller transport "asyncio": pip install asyncssh
+    asyncssh = None
+
+DEFAULT_TIMEOUT = 60
+# Bytes per read of the exec channel while streaming
+STREAM_CHUNK = 8192
+
+
+async def send_command_async(conn, command: str, timeout: int = DEFAULT_TIMEOUT) -> str:
+    """
+    Run one command in an exec channel. Exec channels are not paged, so no "terminal length 0" is needed
+    :param conn: asyncssh connection
+    :param command: to execute on device
+    :param timeout: seconds to wait for the whole output
+    :return: command output
+    """
+    result = await asyncio.wait_for(conn.run(command, check=False), timeout)
+    return result.stdout
+
+
+async def fetch_output_async(device: dict, command: str, logger_poller, semaphore: asyncio.Semaphore,
+                             limiter=None):
+    """
+    Asyncio version of fetch_output(): get device output according to the command, without parsing it
+    :param device: device info (Netmiko format)
+    :param command: to execute on device
+    :param logger_poller: logging object
+    :param semaphore: limit of concurrent sessions
+    :param limiter: LoginLimiter, waited before taking a session slot
+    :return: command output
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    return (await fetch_outputs_async(device, (command,), logger_poller, semaphore, limiter))[command]
+
+
+async def fetch_outputs_async(device: dict, commands, logger_poller, semaphore: asyncio.Semaphore,
+                              limiter=None) -> dict:
+    """
+    Asyncio version of fetch_outputs(): the commands back to back in one connection, one exec channel each
+    (one at a time, every channel takes a VTY line in the device)
+    :return: {command: output}, in commands order
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    async def session(conn, timeout):
+        return {command: await send_command_async(conn, command, timeout) for command in commands}
+    return await in_session(device, logger_poller, semaphore, limiter, session)
+
+
+async def stream_outputs_async(device: dict, commands, logger_poller, semaphore: asyncio.Semaphore,
+                               limiter=None) -> tuple:
+    """
+    Asyncio version of stream_outputs(): the other commands first, then the VLAN command (the first) parsed
+    while it is read, and its channel closed as soon as the VLAN table is complete
+    :return: parsed VLAN command output, and {command: output} of the other commands
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    command, *extra = commands
+    parser = get_stream_parser(device["device_type"], command)()
+
+    async def session(conn, timeout):
+        outputs = {extra_command: await send_command_async(conn, extra_command, timeout) for extra_command in extra}
+        await asyncio.wait_for(stream_command_async(conn, command, parser), timeout)
+        METRICS.inc("stream_sessions", end="table" if parser.done else "output")
+        return parser.close(), outputs
+    return await in_session(device, logger_poller, semaphore, limiter, session)
+
+
+async def stream_command_async(conn, command: str, parser):
+    """
+    Feed the parser with the exec channel output as it arrives, until the table is complete or the output ends
+    """
+    async with conn.create_process(command) as process:
+        while not parser.done:
+            chunk = await process.stdout.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            parser.feed(chunk)
+
+
+async def in_session(device: dict, logger_poller, semaphore: asyncio.Semaphore, limiter, function):
+    """
+    Connect to the device, and await function(conn, timeout) in the session
+    :param semaphore: limit of concurrent sessions
+    :param limiter: LoginLimiter, waited before taking a session slot
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    if asyncssh is None:
+        raise RuntimeError("Transport asyncio needs asyncssh installed: pip install asyncssh")
+    name = device["name"]
+    timeout = device.get("timeout", DEFAULT_TIMEOUT)
+    if limiter is not None:
+        await limiter.acquire_async(device)
+    async with semaphore:
+        # Open sessions only, not the devices waiting for the limiter or a session slot
+        with METRICS.in_flight():
+            try:
+                start = METRICS.clock()
+                async with asyncssh.connect(device["host"], port=device.get("port", 22),
+                                            username=device.get("username"), password=device.get("password"),
+                                            known_hosts=None, connect_timeout=timeout) as conn:
+                    METRICS.observe(STAGE_CONNECT, METRICS.clock() - start, name)
+                    with METRICS.timer(STAGE_COMMAND, name):
+                        return await function(conn, timeout)
+            except asyncssh.PermissionDenied as e:
+                logger_poller.debug("%r", e)
+                raise DeviceError(name, "Authentication failed", auth=True) from e
+            except (asyncssh.Error, OSError, asyncio.TimeoutError) as e:
+                logger_poller.debug("%r", e)
+                raise DeviceError(name, f"Connection error {type(e).__name__}") from e
+
+
+async def run_cmd_async(device: dict, command: str, logger_poller, semaphore: asyncio.Semaphore) -> list:
+    """
+    Asyncio version of run_cmd(). Same contract: get device output according to the command, and parse it
+    :param device: device info (Netmiko format)
+    :param command: to execute on device
+    :param logger_poller: logging object
+    :param semaphore: limit of concurrent sessions
+    :return: parsed response in dictionary format
+    """
+    try:
+        response = await fetch_output_async(device, command, logger_poller, semaphore)
+    except DeviceError as e:
+        logger_poller.error("%s", e)
+        return []
+    return parse_output(device, command, response, logger_poller)
@@ -0,0 +1,134 @@
+import json
+import time
+
+from etc.metrics import METRICS
+from etc.parsers import vlan_command
+
+# Trunk allowed VLANs command of the device types (etc/parsers.py parse_trunk_allowed_vlans)
+TRUNK_COMMANDS = ("show interfaces trunk", "show interface trunk")
+REPORT_TRUNKS = "trunks"
+MAX_VLAN_ID = 4094
+
+
+class CollectionPlan:
+    """
+    Commands to run back to back in one device session, by device type: the VLAN command first, then the extra
+    commands of the device type (poller.collection_plan). One login per device and cycle for all the data
+    """
+    def __init__(self, extra_commands=None):
+        """
+        :param extra_commands: {device_type: [command]}
+        """
+        self.extra_commands = extra_commands or {}
+
+    def __repr__(self):
+        return f"<CollectionPlan(Device_types={sorted(self.extra_commands)})>"
+
+    @classmethod
+    def from_config(cls, poller_config: dict) -> "CollectionPlan":
+        return cls(poller_config.get("collection_plan"))
+
+    def commands(self, device_type: str, command: str = None) -> tuple:
+        """
+        :param command: VLAN command, None for the command of the device type (etc/parsers.py)
+        :return: commands of the device, the VLAN command first and without repeated commands
+        """
+        command = command or vlan_command(device_type)
+        return (command,) + tuple(dict.fromkeys(extra for extra in self.extra_commands.get(device_type, ())
+                                                if extra != command))
+
+
+class DeviceRecord:
+    """
+    Data collected from one device in one session, besides its VLANs (PollerState.snapshots): the parsed output
+    of each extra command of the collection plan
+    """
+    def __init__(self, name: str, data: dict, collected: float = None):
+        self.name = name
+        # {command: parsed output}
+        self.data = data
+        self.collected = collected if collected is not None else time.time()
+        # Written to the device_records table
+        self.saved = False
+
+    def __repr__(self):
+        return f"<DeviceRecord(Name={self.name}, Commands={list(self.data)}, Saved={self.saved})>"
+
+    def get(self, command: str, default=None):
+        return self.data.get(command, default)
+
+    def rows(self) -> list:
+        """
+        :return: device_records rows (db_ops.save_device_records()), one per command
+        """
+        return [{"device": self.name, "command": command, "collected": self.collected,
+                 "data": json.dumps(parsed, default=str)} for command, parsed in self.data.items()]
+
+
+def unsaved_rows(records: dict, names) -> list:
+    """
+    device_records rows of the records not saved yet
+    :param records: {device name: DeviceRecord}, PollerState.records
+    :param names: devices of the cycle
+    """
+    return [row for name in names if name in records and not records[name].saved for row in records[name].rows()]
+
+
+def mark_saved(records: dict, rows: list):
+    """
+    The rows of unsaved_rows() were written
+    """
+    for name in {row["device"] for row in rows}:
+        if name in records:
+            records[name].saved = True
+
+
+def parse_record(device: dict, outputs: dict, logger_poller) -> DeviceRecord:
+    """
+    Parse the extra command outputs of one device
+    :param outputs: {command: output} of the extra commands
+    """
+    # Netmiko only to poll, not for the reports
+    from etc.device_ops import parse_output
+
+    data = {}
+    for command, output in outputs.items():
+        data[command] = parse_output(device, command, output, logger_poller)
+        METRICS.inc("collected_commands", command=command)
+    return DeviceRecord(device["name"], data)
+
+
+def allowed_vlan_ids(allowed: str) -> set:
+    """
+    :param allowed: trunk allowed VLANs, "1-10,20", "All" (EOS) or "none"
+    :return: VLAN ids
+    """
+    allowed = allowed.strip().lower()
+    if allowed == "all":
+        return set(range(1, MAX_VLAN_ID + 1))
+    vlan_ids = set()
+    for item in allowed.split(","):
+        first, _, last = item.partition("-")
+        if first.isdigit() and (not last or last.isdigit()):
+            vlan_ids.update(range(int(first), int(last or first) + 1))
+    return vlan_ids
+
+
+def trunk_report(trunk_records: list, device_vlans) -> list:
+    """
+    Device VLANs not allowed on any trunk of the device, from the trunk records of the last poll
+    :param trunk_records: [(device, parsed trunk command output)]
+    :param device_vlans: function(device) returning the device VLANs [(vlan_id, vlan_name)]
+    :return: [{"device", "vlan_id", "vlan_name"}]
+    """
+    rows = []
+    for device, trunks in trunk_records:
+        if not trunks:
+            # Access switch or no trunks up, nothing to compare
+            continue
+        allowed = set()
+        for trunk in trunks:
+            allowed |= allowed_vlan_ids(trunk["allowed_vlans"])
+        rows.extend({"device": device, "vlan_id": int(vlan_id), "vlan_name": vlan_name}
+                    for vlan_id, vlan_name in device_vlans(device) if int(vlan_id) not in allowed)
+    return rows
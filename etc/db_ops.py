@@ -1,7 +1,22 @@
-from sqlalchemy import create_engine, Column, String, Sequence
+from sqlalchemy import create_engine, Column, Float, ForeignKey, Index, Integer, LargeBinary, String, Sequence, \
+    Text, delete, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from sqlalchemy.exc import IntegrityError
+from etc.diff import OP_ADD, OP_REMOVE, OP_RENAME
+from etc.metrics import METRICS, STAGE_DB_QUERY, STAGE_DB_WRITE, timed
+from etc.vlanset import VlanSet
+
+DEFAULT_DB_URL = "sqlite:///vlan_sync.sqlite"
+# PRAGMA user_version of the DB. 0: one vlans_per_device row per device, 1: devices and device_vlans tables,
+# 2: journal snapshots by shard
+SCHEMA_VERSION = 2
+DEFAULT_DESCRIPTION = "change_me"
+# Rows per INSERT/DELETE statement, below the SQLite limit of bound parameters per statement
+STATEMENT_ROWS = 300
+# Journal snapshots kept per shard, the older ones are deleted (the journal is never deleted)
+SNAPSHOTS_KEPT = 2
 
 Base = declarative_base()
 
@@ -19,18 +34,101 @@ class VlanDb(Base):
         return f"<Table(vlan_id={self.id}, vlan_name={self.name}, vlan_description={self.description}>"
 
 
-class VlanPerDevice(Base):
+class Device(Base):
     """
-    ORM object/table
+    ORM object/table. Polled devices, referenced by device_vlans with the integer id
     """
-    __tablename__ = "vlans_per_device"
-    device = Column(String(10), Sequence('user_id_seq'), primary_key=True)
-    id = Column(String(10))
-    name = Column(String(20))
-    description = Column(String(50))
+    __tablename__ = "devices"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"<Table(Device_id={self.id}, Device={self.name}>"
+
+
+class DeviceVlan(Base):
+    """
+    ORM object/table. VLANs of each device in the last poll: one row per device and VLAN.
+    The primary key (device_id, vlan_id) is the table order (WITHOUT ROWID), so the VLANs of a device are one range,
+    and ix_device_vlans_vlan (vlan_id, device_id) gives the devices of a VLAN without reading the table
+    """
+    __tablename__ = "device_vlans"
+    __table_args__ = (Index("ix_device_vlans_vlan", "vlan_id", "device_id"), {"sqlite_with_rowid": False})
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    # Integer, not the String of vlans.id: smaller keys and numeric order
+    vlan_id = Column(Integer, primary_key=True)
+    name = Column(String(32))
+
+    def __repr__(self):
+        return f"<Table(Device_id={self.device_id}, vlan_id={self.vlan_id}, vlan_name={self.name}>"
+
+
+class DeviceFingerprint(Base):
+    """
+    ORM object/table. Fingerprint of the last device output found in sync with the DB (etc/fingerprint.py)
+    """
+    __tablename__ = "device_fingerprints"
+    device = Column(String(50), primary_key=True)
+    output_digest = Column(String(32))
+    db_digest = Column(String(32))
+
+    def __repr__(self):
+        return f"<Table(Device={self.device}, output_digest={self.output_digest}, db_digest={self.db_digest}>"
+
+
+class DeviceRecordDb(Base):
+    """
+    ORM object/table. Parsed output of each collection plan command of a device in its last poll (etc/collection.py),
+    as JSON
+    """
+    __tablename__ = "device_records"
+    device = Column(String(50), primary_key=True)
+    command = Column(String(64), primary_key=True)
+    # Epoch seconds
+    collected = Column(Float, nullable=False)
+    data = Column(Text, nullable=False)
+
+    def __repr__(self):
+        return f"<Table(Device={self.device}, command={self.command}, collected={self.collected}>"
+
+
+class VlanJournal(Base):
+    """
+    ORM object/table. Append-only journal: one row per VLAN change seen on a device (target "device") or applied
+    to the DB (target "db", device is the device that reported it). The id is the order of the changes
+    """
+    __tablename__ = "vlan_journal"
+    __table_args__ = (Index("ix_vlan_journal_device_vlan", "device", "vlan_id", "id"),)
+    id = Column(Integer, primary_key=True)
+    # Epoch seconds
+    timestamp = Column(Float, nullable=False)
+    target = Column(String(6), nullable=False)
+    device = Column(String(50))
+    operation = Column(String(6), nullable=False)
+    vlan_id = Column(Integer, nullable=False)
+    name = Column(String(32))
+
+    def __repr__(self):
+        return f"<Table(Journal_id={self.id}, timestamp={self.timestamp}, target={self.target}, " \
+               f"Device={self.device}, operation={self.operation}, vlan_id={self.vlan_id}, vlan_name={self.name}>"
+
+
+class JournalSnapshot(Base):
+    """
+    ORM object/table. VLANs of each device (VlanSet.to_bytes()) of one shard up to the journal row journal_id.
+    The device VLANs at restart are their last snapshot plus the journal rows after it
+    """
+    __tablename__ = "journal_snapshots"
+    # Member of sharding.members (--shard), "" without it
+    shard = Column(String(50), primary_key=True)
+    journal_id = Column(Integer, primary_key=True)
+    device = Column(String(50), primary_key=True)
+    timestamp = Column(Float, nullable=False)
+    vlans = Column(LargeBinary, nullable=False)
 
     def __repr__(self):
-        return f"<Table(Device={self.device}, vlan_id={self.id}, vlan_name={self.name}, vlan_description={self.description}>"
+        return f"<Table(Shard={self.shard}, Journal_id={self.journal_id}, Device={self.device}, " \
+               f"timestamp={self.timestamp}>"
 
 
 def add_vlan(session_obj, logger_orm, vlan_id, vlan_name, vlan_description="change_me"):
@@ -43,10 +141,10 @@ def add_vlan(session_obj, logger_orm, vlan_id, vlan_name, vlan_description="chan
     try:
         session.commit()
     except IntegrityError:
-        logger_orm.debug(f"ADD VLAN {vlan_id} {vlan_name} {vlan_description} CAN NOT ADD ALREADY EXISTS")
+        logger_orm.debug("ADD VLAN %s %s %s CAN NOT ADD ALREADY EXISTS", vlan_id, vlan_name, vlan_description)
     else:
 
-        logger_orm.info(f"ADD VLAN {vlan_id} {vlan_name} {vlan_description} ADDED")
+        logger_orm.info("ADD VLAN %s %s %s ADDED", vlan_id, vlan_name, vlan_description)
 
 
 def delete_vlan(session_obj, logger_orm, vlan_id):
@@ -58,10 +156,10 @@ def delete_vlan(session_obj, logger_orm, vlan_id):
     try:
         session.delete(vlan)
     except UnmappedInstanceError:
-        logger_orm.debug(f"DELETE VLAN {vlan_id} CAN NOT DELETE")
+        logger_orm.debug("DELETE VLAN %s CAN NOT DELETE", vlan_id)
     else:
         session.flush()
-        logger_orm.info(f"DELETE VLAN {vlan.id} {vlan.name} {vlan.description} DELETED")
+        logger_orm.info("DELETE VLAN %s %s %s DELETED", vlan.id, vlan.name, vlan.description)
 
 
 def update_vlan(session_obj, logger_orm, vlan_id, vlan_name, vlan_description="change_me"):
@@ -75,9 +173,9 @@ def update_vlan(session_obj, logger_orm, vlan_id, vlan_name, vlan_description="c
         vlan.name = vlan_name
         vlan.description = vlan_description
         session.commit()
-        logger_orm.info(f"UPDATE VLAN {vlan} UPDATED ")
+        logger_orm.info("UPDATE VLAN %s UPDATED ", vlan)
     else:
-        logger_orm.debug(f"UPDATE VLAN {vlan_id} UPDATE VLAN NOT FOUND")
+        logger_orm.debug("UPDATE VLAN %s UPDATE VLAN NOT FOUND", vlan_id)
 
 
 def query_vlan(session_obj, logger_orm, vlan_id):
@@ -87,12 +185,13 @@ def query_vlan(session_obj, logger_orm, vlan_id):
     session = session_obj()
     vlan = session.query(VlanDb).filter_by(id=vlan_id).first()
     if vlan:
-        logger_orm.debug(f"QUERY VLAN {vlan.id} {vlan.name} {vlan.description} FOUND")
+        logger_orm.debug("QUERY VLAN %s %s %s FOUND", vlan.id, vlan.name, vlan.description)
     else:
-        logger_orm.debug(f"QUERY VLAN {vlan_id} NOT FOUND")
+        logger_orm.debug("QUERY VLAN %s NOT FOUND", vlan_id)
     return vlan
 
 
+@timed(STAGE_DB_QUERY)
 def query_all_vlan(session_obj, logger_orm):
     """
     Query all the VLANs in the DB
@@ -100,21 +199,392 @@ def query_all_vlan(session_obj, logger_orm):
     session = session_obj()
     vlans = session.query(VlanDb).all()
     if len(vlans) == 0:
-        logger_orm.info(f"Database empty")
+        logger_orm.info("Database empty")
     else:
-        logger_orm.info(f"Database loaded. {len(vlans)} records")
-        logger_orm.debug(f"{vlans}")
+        logger_orm.info("Database loaded. %s records", len(vlans))
+        logger_orm.debug("%s", vlans)
     return vlans
 
 
-def init_db():
+@timed(STAGE_DB_WRITE)
+def apply_vlan_changes(session_obj, logger_orm, operations, chunk_size=0) -> dict:
+    """
+    Apply a whole diff result to the DB with bulk statements: INSERT ... ON CONFLICT DO UPDATE for add/rename,
+    and DELETE ... WHERE id IN (...) for remove.
+    If the same vlan_id has several operations (i.e. reported by several devices) the last one wins.
+    :param session_obj: session factory from init_db()
+    :param logger_orm: logging object
+    :param operations: VlanOperation list with target "db" (etc/diff.py)
+    :param chunk_size: operations per transaction. 0 means one transaction for all of them
+    :return: applied counts {"upserted": x, "deleted": y}
+    """
+    latest = {}
+    for operation in operations:
+        latest[operation.vlan_id] = operation
+    upserts = [{"id": op.vlan_id, "name": op.vlan_name, "description": DEFAULT_DESCRIPTION}
+               for op in latest.values() if op.operation_type in (OP_ADD, OP_RENAME)]
+    deletes = [op.vlan_id for op in latest.values() if op.operation_type == OP_REMOVE]
+    counts = {"upserted": 0, "deleted": 0}
+    if not upserts and not deletes:
+        return counts
+
+    chunk_size = chunk_size or max(len(upserts), len(deletes))
+    session = session_obj()
+    try:
+        for start in range(0, max(len(upserts), len(deletes)), chunk_size):
+            counts["upserted"] += _bulk_upsert(session, upserts[start:start + chunk_size])
+            counts["deleted"] += _bulk_delete(session, deletes[start:start + chunk_size])
+            session.commit()
+    except Exception:
+        session.rollback()
+        METRICS.inc("errors", stage=STAGE_DB_WRITE)
+        logger_orm.error("BULK VLAN CHANGES FAILED, ROLLED BACK. Applied before the failure %s", counts)
+        raise
+    logger_orm.info("BULK VLAN CHANGES %s UPSERTED %s DELETED", counts['upserted'], counts['deleted'])
+    for kind, count in counts.items():
+        METRICS.inc("db_changes", count, kind=kind)
+    return counts
+
+
+def _bulk_upsert(session, rows):
+    for start in range(0, len(rows), STATEMENT_ROWS):
+        statement = sqlite_insert(VlanDb).values(rows[start:start + STATEMENT_ROWS])
+        statement = statement.on_conflict_do_update(index_elements=[VlanDb.id],
+                                                    set_={"name": statement.excluded.name})
+        session.execute(statement)
+    return len(rows)
+
+
+def _bulk_delete(session, vlan_ids):
+    deleted = 0
+    for start in range(0, len(vlan_ids), STATEMENT_ROWS):
+        statement = delete(VlanDb).where(VlanDb.id.in_(vlan_ids[start:start + STATEMENT_ROWS]))
+        deleted += session.execute(statement, execution_options={"synchronize_session": False}).rowcount
+    return deleted
+
+
+@timed(STAGE_DB_QUERY)
+def load_fingerprints(session_obj, logger_orm) -> dict:
+    """
+    Load all the device fingerprints
+    :return: {device: (output_digest, db_digest)}
+    """
+    session = session_obj()
+    fingerprints = {row.device: (row.output_digest, row.db_digest) for row in session.query(DeviceFingerprint)}
+    logger_orm.info("Fingerprints loaded. %s records", len(fingerprints))
+    return fingerprints
+
+
+@timed(STAGE_DB_WRITE)
+def save_fingerprints(session_obj, logger_orm, fingerprints: dict):
+    """
+    Bulk upsert/delete of device fingerprints, in one transaction
+    :param fingerprints: {device: (output_digest, db_digest)}, or {device: None} to delete it
+    """
+    rows = [{"device": device, "output_digest": value[0], "db_digest": value[1]}
+            for device, value in fingerprints.items() if value is not None]
+    deletes = [device for device, value in fingerprints.items() if value is None]
+    session = session_obj()
+    try:
+        for start in range(0, len(rows), STATEMENT_ROWS):
+            statement = sqlite_insert(DeviceFingerprint).values(rows[start:start + STATEMENT_ROWS])
+            statement = statement.on_conflict_do_update(
+                index_elements=[DeviceFingerprint.device],
+                set_={"output_digest": statement.excluded.output_digest, "db_digest": statement.excluded.db_digest})
+            session.execute(statement)
+        for start in range(0, len(deletes), STATEMENT_ROWS):
+            statement = delete(DeviceFingerprint).where(
+                DeviceFingerprint.device.in_(deletes[start:start + STATEMENT_ROWS]))
+            session.execute(statement, execution_options={"synchronize_session": False})
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger_orm.debug("Fingerprints saved. %s updated %s deleted", len(rows), len(deletes))
+
+
+@timed(STAGE_DB_WRITE)
+def save_device_vlans(session_obj, logger_orm, device_vlans: dict) -> int:
+    """
+    Replace the VLANs of the devices, in one transaction
+    :param device_vlans: {device name: iterable of (vlan_id, vlan_name)}, i.e. {device name: VlanSet.items()}
+    :return: rows written
+    """
+    if not device_vlans:
+        return 0
+    names = list(device_vlans)
+    session = session_obj()
+    try:
+        for start in range(0, len(names), STATEMENT_ROWS):
+            statement = sqlite_insert(Device).values([{"name": name} for name in names[start:start + STATEMENT_ROWS]])
+            session.execute(statement.on_conflict_do_nothing(index_elements=[Device.name]))
+        device_ids = _device_ids(session, names)
+        ids = list(device_ids.values())
+        for start in range(0, len(ids), STATEMENT_ROWS):
+            session.execute(delete(DeviceVlan).where(DeviceVlan.device_id.in_(ids[start:start + STATEMENT_ROWS])),
+                            execution_options={"synchronize_session": False})
+        rows = [{"device_id": device_ids[name], "vlan_id": int(vlan_id), "name": vlan_name}
+                for name, vlans in device_vlans.items() for vlan_id, vlan_name in vlans]
+        if rows:
+            # executemany of one prepared statement
+            session.execute(DeviceVlan.__table__.insert(), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger_orm.debug("Device VLANs saved. %s devices %s rows", len(names), len(rows))
+    return len(rows)
+
+
+@timed(STAGE_DB_WRITE)
+def save_device_records(session_obj, logger_orm, rows: list) -> int:
+    """
+    Bulk upsert of the device records, in one transaction
+    :param rows: [{"device", "command", "collected", "data"}], data is the parsed output as JSON
+    :return: rows written
+    """
+    if not rows:
+        return 0
+    session = session_obj()
+    try:
+        for start in range(0, len(rows), STATEMENT_ROWS):
+            statement = sqlite_insert(DeviceRecordDb).values(rows[start:start + STATEMENT_ROWS])
+            statement = statement.on_conflict_do_update(
+                index_elements=[DeviceRecordDb.device, DeviceRecordDb.command],
+                set_={"collected": statement.excluded.collected, "data": statement.excluded.data})
+            session.execute(statement)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger_orm.debug("Device records saved. %s rows", len(rows))
+    return len(rows)
+
+
+@timed(STAGE_DB_QUERY)
+def query_device_records(session_obj, logger_orm, commands) -> list:
+    """
+    Last records of the commands, all the devices
+    :param commands: command names, e.g. the trunk command of every device type
+    :return: DeviceRecordDb list, device order
+    """
+    session = session_obj()
+    rows = session.execute(select(DeviceRecordDb).where(DeviceRecordDb.command.in_(list(commands)))
+                           .order_by(DeviceRecordDb.device)).scalars().all()
+    logger_orm.debug("QUERY DEVICE RECORDS %s FOUND", len(rows))
+    return rows
+
+
+def _device_ids(session, names) -> dict:
+    device_ids = {}
+    for start in range(0, len(names), STATEMENT_ROWS):
+        chunk = names[start:start + STATEMENT_ROWS]
+        device_ids.update(session.query(Device.name, Device.id).filter(Device.name.in_(chunk)))
+    return device_ids
+
+
+@timed(STAGE_DB_QUERY)
+def query_vlan_devices(session_obj, logger_orm, vlan_id) -> list:
+    """
+    Devices with the VLAN, by index ix_device_vlans_vlan
+    :return: device names
+    """
+    session = session_obj()
+    statement = select(Device.name).join(DeviceVlan, DeviceVlan.device_id == Device.id) \
+        .where(DeviceVlan.vlan_id == int(vlan_id))
+    names = sorted(session.execute(statement).scalars())
+    logger_orm.debug("QUERY VLAN %s DEVICES %s FOUND", vlan_id, len(names))
+    return names
+
+
+@timed(STAGE_DB_QUERY)
+def query_device_vlans(session_obj, logger_orm, device: str) -> list:
+    """
+    VLANs of the device, by primary key range
+    :return: [(vlan_id, vlan_name)] in vlan_id order, VlanSet.from_items() ready
+    """
+    session = session_obj()
+    statement = select(DeviceVlan.vlan_id, DeviceVlan.name).join(Device, Device.id == DeviceVlan.device_id) \
+        .where(Device.name == device).order_by(DeviceVlan.vlan_id)
+    rows = [tuple(row) for row in session.execute(statement)]
+    logger_orm.debug("QUERY DEVICE %s VLANS %s FOUND", device, len(rows))
+    return rows
+
+
+@timed(STAGE_DB_QUERY)
+def query_vlan_device_counts(session_obj, logger_orm) -> dict:
+    """
+    Number of devices per VLAN, only reading the index ix_device_vlans_vlan
+    :return: {vlan_id: devices}
+    """
+    session = session_obj()
+    counts = dict(session.execute(select(DeviceVlan.vlan_id, func.count()).group_by(DeviceVlan.vlan_id)).all())
+    logger_orm.debug("QUERY VLAN DEVICE COUNTS %s VLANS", len(counts))
+    return counts
+
+
+@timed(STAGE_DB_QUERY)
+def query_fleet_vlans(session_obj, logger_orm, name_separator="\x01") -> list:
+    """
+    VLANs of all the devices, one row per device (FleetMatrix.from_db_rows()): SQLite concatenates them in the
+    primary key order, so there is no Python work per VLAN
+    :return: [(device, "vlan_id,vlan_id,...", names joined by name_separator)]
+    """
+    session = session_obj()
+    statement = select(Device.name, func.group_concat(DeviceVlan.vlan_id),
+                       func.group_concat(func.coalesce(DeviceVlan.name, ""), name_separator)) \
+        .join(Device, Device.id == DeviceVlan.device_id).group_by(DeviceVlan.device_id)
+    rows = session.execute(statement).all()
+    logger_orm.debug("QUERY FLEET VLANS %s DEVICES FOUND", len(rows))
+    return rows
+
+
+@timed(STAGE_DB_WRITE)
+def append_journal(session_obj, logger_orm, rows: list, snapshot: dict = None, timestamp: float = None,
+                   shard: str = "") -> int:
+    """
+    Append rows to the journal and optionally take a snapshot after them, in one transaction
+    :param rows: [{"timestamp", "target", "device", "operation", "vlan_id", "name"}]
+    :param snapshot: {device name: VlanSet} VLANs of every device of the shard, None for no snapshot
+    :param timestamp: of the snapshot
+    :param shard: of the snapshot, the older snapshots of the shard are deleted
+    :return: journal id of the snapshot, 0 if there is no snapshot
+    """
+    session = session_obj()
+    journal_id = 0
+    try:
+        if rows:
+            session.execute(VlanJournal.__table__.insert(), rows)
+        if snapshot is not None:
+            journal_id = session.execute(select(func.max(VlanJournal.id))).scalar() or 0
+            if snapshot:
+                session.execute(JournalSnapshot.__table__.insert(),
+                                [{"shard": shard, "journal_id": journal_id, "device": device, "timestamp": timestamp,
+                                  "vlans": vlans.to_bytes()} for device, vlans in snapshot.items()])
+            kept = select(JournalSnapshot.journal_id).where(JournalSnapshot.shard == shard).distinct() \
+                .order_by(JournalSnapshot.journal_id.desc()).limit(SNAPSHOTS_KEPT)
+            session.execute(delete(JournalSnapshot).where(JournalSnapshot.shard == shard,
+                                                          JournalSnapshot.journal_id.not_in(kept)),
+                            execution_options={"synchronize_session": False})
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger_orm.debug("Journal %s rows appended, snapshot %s", len(rows), journal_id or None)
+    return journal_id
+
+
+@timed(STAGE_DB_QUERY)
+def load_journal_state(session_obj, logger_orm, shard: str = "") -> tuple:
+    """
+    VLANs of every device from its last snapshot (of any shard, so a device that moved between shards keeps its
+    VLANs) and the device changes journaled after it
+    :param shard: its last snapshot gives the timestamp
+    :return: ({device name: VlanSet}, snapshot timestamp of the shard or None, journal rows replayed)
+    """
+    session = session_obj()
+    shards = dict(session.execute(select(JournalSnapshot.shard, func.max(JournalSnapshot.journal_id))
+                                  .group_by(JournalSnapshot.shard)).fetchall())
+    timestamp = None
+    if shard in shards:
+        timestamp = session.execute(select(JournalSnapshot.timestamp).where(
+            JournalSnapshot.shard == shard, JournalSnapshot.journal_id == shards[shard]).limit(1)).scalar()
+    # The devices journaled before the last snapshot of their shard are in it. Without a snapshot of this shard
+    # its devices are replayed from the start
+    start = min(shards.values()) if shard in shards else 0
+    latest = select(JournalSnapshot.device, func.max(JournalSnapshot.journal_id).label("journal_id")) \
+        .group_by(JournalSnapshot.device).subquery()
+    statement = select(JournalSnapshot.device, JournalSnapshot.journal_id, JournalSnapshot.vlans).join(
+        latest, (JournalSnapshot.device == latest.c.device) & (JournalSnapshot.journal_id == latest.c.journal_id))
+    devices, bases = {}, {}
+    for row in session.execute(statement):
+        devices[row.device] = dict(VlanSet.from_bytes(row.vlans).items())
+        bases[row.device] = row.journal_id
+    replayed = 0
+    statement = select(VlanJournal.id, VlanJournal.device, VlanJournal.operation, VlanJournal.vlan_id,
+                       VlanJournal.name).where(VlanJournal.id > start, VlanJournal.target == "device") \
+        .order_by(VlanJournal.id)
+    for journal_id, device, operation, vlan_id, vlan_name in session.execute(statement):
+        if journal_id <= bases.get(device, 0):
+            continue
+        vlans = devices.setdefault(device, {})
+        if operation == OP_REMOVE:
+            vlans.pop(vlan_id, None)
+        else:
+            vlans[vlan_id] = vlan_name
+        replayed += 1
+    logger_orm.info("Journal loaded. %s devices, %s rows after the snapshot", len(devices), replayed)
+    return {device: VlanSet.from_items(vlans.items()) for device, vlans in devices.items()}, timestamp, replayed
+
+
+@timed(STAGE_DB_QUERY)
+def query_vlan_history(session_obj, logger_orm, vlan_id, device: str = None, target: str = None) -> list:
+    """
+    Journal of one VLAN, oldest first
+    :param device: only the changes of (or reported by) this device
+    :param target: only "device" or "db" changes
+    :return: VlanJournal list
+    """
+    session = session_obj()
+    statement = select(VlanJournal).where(VlanJournal.vlan_id == int(vlan_id))
+    if device is not None:
+        statement = statement.where(VlanJournal.device == device)
+    if target is not None:
+        statement = statement.where(VlanJournal.target == target)
+    rows = session.execute(statement.order_by(VlanJournal.id)).scalars().all()
+    logger_orm.debug("QUERY VLAN %s HISTORY %s CHANGES FOUND", vlan_id, len(rows))
+    return rows
+
+
+def query_vlan_removed(session_obj, logger_orm, vlan_id, device: str):
+    """
+    When the VLAN disappeared from the device
+    :return: timestamp of the last removal, None if the VLAN is on the device (or was never seen)
+    """
+    history = query_vlan_history(session_obj, logger_orm, vlan_id, device, "device")
+    if history and history[-1].operation == OP_REMOVE:
+        return history[-1].timestamp
+    return None
+
+
+def migrate_db(engine, logger_orm=None):
+    """
+    Upgrade the DB schema to SCHEMA_VERSION, in one transaction.
+    Version 0 to 1: the rows of vlans_per_device (primary key device, so one VLAN per device) are copied to
+    devices/device_vlans, and vlans_per_device is dropped.
+    Version 1 to 2: journal_snapshots is created again with the shard column. The first restart replays the whole
+    journal, until the next snapshot
+    """
+    with engine.begin() as conn:
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        if version >= SCHEMA_VERSION:
+            return
+        if "shard" not in {column["name"] for column in inspect(conn).get_columns(JournalSnapshot.__tablename__)}:
+            JournalSnapshot.__table__.drop(conn)
+            JournalSnapshot.__table__.create(conn)
+        if inspect(conn).has_table("vlans_per_device"):
+            legacy = conn.execute(text("SELECT device, id, name FROM vlans_per_device")).fetchall()
+            if legacy:
+                conn.execute(text("INSERT OR IGNORE INTO devices (name) VALUES (:name)"),
+                             [{"name": row.device} for row in legacy])
+                device_ids = dict(conn.execute(text("SELECT name, id FROM devices")).fetchall())
+                conn.execute(text("INSERT OR REPLACE INTO device_vlans (device_id, vlan_id, name) "
+                                  "VALUES (:device_id, :vlan_id, :name)"),
+                             [{"device_id": device_ids[row.device], "vlan_id": int(row.id), "name": row.name}
+                              for row in legacy if str(row.id).isdigit()])
+            conn.execute(text("DROP TABLE vlans_per_device"))
+            if logger_orm is not None:
+                logger_orm.info("DB MIGRATED TO SCHEMA %s. %s device VLANs copied", SCHEMA_VERSION, len(legacy))
+        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+
+def init_db(db_url=DEFAULT_DB_URL, echo=False, logger_orm=None):
     """
     Start SQLite DB in memory for testing the tool
     """
-    vlan_table = VlanDb()
-    device_table = VlanPerDevice()
-    engine = create_engine('sqlite:///vlan_sync.sqlite', echo=True, logging_name="orm")
+    engine = create_engine(db_url, echo=echo, logging_name="orm")
     Base.metadata.create_all(engine)
+    migrate_db(engine, logger_orm)
     session_factory = sessionmaker(bind=engine)
     session_obj = scoped_session(session_factory)
     return session_obj
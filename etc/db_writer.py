@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool, StaticPool
+from etc.db_ops import DEFAULT_DB_URL, Base, migrate_db
+from etc.metrics import METRICS, STAGE_DB_LOCK
+
+# PRAGMA cache_size, KiB of page cache per connection
+DEFAULT_CACHE_KB = 65536
+# Write operations per transaction
+DEFAULT_WRITE_BATCH = 100
+# Seconds to wait for the write lock held by another process, before "database is locked"
+DEFAULT_BUSY_TIMEOUT = 30
+MEMORY_URLS = ("sqlite://", "sqlite:///:memory:")
+
+
+def tune_engine(engine, cache_kb=DEFAULT_CACHE_KB, busy_timeout=DEFAULT_BUSY_TIMEOUT):
+    """
+    SQLite settings of every new connection: WAL (readers do not wait for the writer, and the other way around),
+    synchronous NORMAL (no fsync per commit, only at checkpoints, still safe in WAL), page cache and busy timeout
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_kb)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        cursor.close()
+    return engine
+
+
+class DbWriter:
+    """
+    Single writer of the DB: the poller threads queue their write operations, and the writer thread applies
+    them with its own connection, grouped in transactions of up to batch_size operations (one commit for all).
+    Reads use the connections of session_obj, which with WAL do not wait for the writer.
+    A write operation is any db_ops write function, function(session_obj, logger_orm, *args)
+    """
+    def __init__(self, logger_orm, db_url=DEFAULT_DB_URL, cache_kb=DEFAULT_CACHE_KB, batch_size=DEFAULT_WRITE_BATCH,
+                 busy_timeout=DEFAULT_BUSY_TIMEOUT, echo=False):
+        self.logger_orm = logger_orm
+        self.batch_size = max(1, batch_size)
+        connect_args = {"check_same_thread": False}
+        if db_url in MEMORY_URLS:
+            # Testing: one connection, for the reads and the writer
+            self.engine = create_engine(db_url, echo=echo, logging_name="orm", poolclass=StaticPool,
+                                        connect_args=connect_args)
+            read_engine = self.engine
+        else:
+            self.engine = tune_engine(create_engine(db_url, echo=echo, logging_name="orm", poolclass=StaticPool,
+                                                    connect_args=connect_args), cache_kb, busy_timeout)
+            read_engine = tune_engine(create_engine(db_url, echo=echo, logging_name="orm", poolclass=QueuePool,
+                                                    connect_args=connect_args), cache_kb, busy_timeout)
+        Base.metadata.create_all(self.engine)
+        migrate_db(self.engine, logger_orm)
+        self.session_obj = scoped_session(sessionmaker(bind=read_engine))
+        # Seconds waiting for the write lock, operations and transactions, since the start
+        self.lock_wait = 0.0
+        self.operations = 0
+        self.transactions = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return f"<DbWriter(Queue={self.queue_depth()}, Operations={self.operations}, " \
+               f"Transactions={self.transactions}, Lock_wait={self.lock_wait:.3f}>"
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """
+        Queue a write operation
+        :return: Future with the result of the function, or its exception
+        """
+        future = Future()
+        self.queue.put((future, function, args, kwargs))
+        METRICS.set_gauge("db_write_queue", self.queue.qsize())
+        return future
+
+    def write(self, function, *args, **kwargs):
+        """
+        Queue a write operation and wait for it
+        """
+        return self.submit(function, *args, **kwargs).result()
+
+    def stop(self):
+        """
+        Apply the queued operations and stop the writer thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.session_obj.remove()
+
+    def _run(self):
+        with self.engine.connect() as conn:
+            stopping = False
+            while not stopping:
+                item = self.queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                METRICS.set_gauge("db_write_queue", self.queue.qsize())
+                self._apply(conn, batch)
+
+    def _apply(self, conn, batch):
+        """
+        One transaction for the batch. If an operation fails, the batch is rolled back and applied again one
+        operation per transaction, so only the failed operation is lost
+        """
+        try:
+            results = self._transaction(conn, batch)
+        except Exception as e:
+            if len(batch) == 1:
+                METRICS.inc("errors", stage="db_writer")
+                self.logger_orm.error("DB WRITE %s FAILED %r", batch[0][1].__name__, e)
+                batch[0][0].set_exception(e)
+                return
+            self.logger_orm.error("DB WRITE OF %s OPERATIONS FAILED, APPLYING THEM ONE BY ONE", len(batch))
+            for item in batch:
+                self._apply(conn, [item])
+            return
+        for (future, *_), result in zip(batch, results):
+            future.set_result(result)
+
+    def _transaction(self, conn, batch) -> list:
+        transaction = conn.begin()
+        try:
+            start = time.perf_counter()
+            # Take the write lock now, to measure the wait (other processes writing the same DB)
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - start
+            self.lock_wait += waited
+            METRICS.observe(STAGE_DB_LOCK, waited)
+            # The session joins the transaction of the connection: the commits of the functions do not end it
+            session = Session(bind=conn)
+            try:
+                results = [function(lambda: session, self.logger_orm, *args, **kwargs)
+                           for _, function, args, kwargs in batch]
+            finally:
+                session.close()
+            transaction.commit()
+        except Exception:
+            if transaction.is_active:
+                transaction.rollback()
+            raise
+        self.operations += len(batch)
+        self.transactions += 1
+        METRICS.inc("db_write_operations", len(batch))
+        METRICS.inc("db_write_transactions")
+        self.logger_orm.debug("DB WRITE %s OPERATIONS IN ONE TRANSACTION, LOCK WAIT %.3f", len(batch), waited)
+        return results
@@ -1,54 +1,201 @@
 import re
+import time
+from contextlib import contextmanager
 from netmiko import ConnectHandler, NetmikoTimeoutException, NetmikoAuthenticationException
+from paramiko.ssh_exception import SSHException
+from etc.metrics import METRICS, STAGE_COMMAND, STAGE_CONNECT, STAGE_PARSE
+from etc.parsers import get_parser, get_stream_parser
 
+# Inventory keys that are not Netmiko connection parameters
+INVENTORY_ONLY_KEYS = ("name", "group", "site")
+# Seconds between channel reads while streaming (send_command() waits 0.2 seconds)
+STREAM_READ_INTERVAL = 0.01
 
-def run_cmd(device: dict, command: str, logger_poller) -> list:
+
+class DeviceError(Exception):
+    """
+    The device could not be polled or configured: not reachable, timeout or authentication failure
+    """
+    def __init__(self, name: str, reason: str, auth=False):
+        super().__init__(f"Device {name} - {reason}")
+        self.name = name
+        self.reason = reason
+        self.auth = auth
+
+
+def netmiko_params(device: dict) -> dict:
+    """
+    ConnectHandler parameters from the inventory device, without modifying it
+    """
+    return {k: v for k, v in device.items() if k not in INVENTORY_ONLY_KEYS}
+
+
+@contextmanager
+def device_errors(name: str, logger_poller):
+    """
+    Raise the Netmiko and SSH errors of the device session as DeviceError
+    """
+    try:
+        yield
+    except NetmikoAuthenticationException as e:
+        logger_poller.debug("%r", e)
+        raise DeviceError(name, "Authentication failed", auth=True) from e
+    except (NetmikoTimeoutException, SSHException, OSError, EOFError) as e:
+        logger_poller.debug("%r", e)
+        raise DeviceError(name, f"Connection error {type(e).__name__}") from e
+
+
+def fetch_output(device: dict, command: str, logger_poller, pool=None, limiter=None):
+    """
+    Get device output according to the command, without parsing it
+    :param device: device info
+    :param command: to execute on device
+    :param logger_poller: logging object
+    :param pool: SessionPool to reuse the sessions between cycles (daemon mode). None for a new session
+    :param limiter: LoginLimiter for the new sessions (the pool has its own)
+    :return: command output
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    return fetch_outputs(device, (command,), logger_poller, pool, limiter)[command]
+
+
+def fetch_outputs(device: dict, commands, logger_poller, pool=None, limiter=None) -> dict:
+    """
+    Get the outputs of the commands back to back in one device session (one login), without parsing them
+    :param commands: to execute on device, in order
+    :return: {command: output}, in commands order
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    name = device["name"]
+    with device_errors(name, logger_poller):
+        if pool is not None:
+            # Includes the reconnections, timed also as connect by the pool
+            with METRICS.in_flight(), METRICS.timer(STAGE_COMMAND, name):
+                return pool.send_commands(device, commands)
+        if limiter is not None:
+            limiter.acquire(device)
+        # Open sessions only, not the devices waiting for the limiter
+        with METRICS.in_flight():
+            with METRICS.timer(STAGE_CONNECT, name):
+                conn = ConnectHandler(**netmiko_params(device))
+            with conn, METRICS.timer(STAGE_COMMAND, name):
+                # When pyATS and Genie installed add use_genie=True
+                return {command: conn.send_command(command) for command in commands}
+
+
+def stream_outputs(device: dict, commands, logger_poller, pool=None, limiter=None) -> tuple:
+    """
+    Streaming version of fetch_outputs(): the VLAN command (the first) is parsed while it is read, with the
+    StreamParser of the device type. The other commands are sent before it, so a new session is closed as soon
+    as the VLAN table is complete. A pooled session reads (and drops) the rest of the output, to be used again
+    :param commands: to execute on device, the VLAN command first
+    :return: parsed VLAN command output, and {command: output} of the other commands
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    name = device["name"]
+    command, *extra = commands
+    parser_class = get_stream_parser(device["device_type"], command)
+
+    def session(conn, stop_early):
+        outputs = {extra_command: conn.send_command(extra_command) for extra_command in extra}
+        parser = parser_class()
+        closed = stream_parse(conn, command, parser, conn.timeout, stop_early)
+        METRICS.inc("stream_sessions", end="table" if closed else "output")
+        return parser.close(), outputs
+
+    with device_errors(name, logger_poller):
+        if pool is not None:
+            with METRICS.in_flight(), METRICS.timer(STAGE_COMMAND, name):
+                return pool.run(device, lambda conn: session(conn, False))
+        if limiter is not None:
+            limiter.acquire(device)
+        with METRICS.in_flight():
+            with METRICS.timer(STAGE_CONNECT, name):
+                conn = ConnectHandler(**netmiko_params(device))
+            with conn, METRICS.timer(STAGE_COMMAND, name):
+                return session(conn, True)
+
+
+def stream_parse(conn, command: str, parser, timeout: float, stop_early=True) -> bool:
+    """
+    Send the command and feed the parser with the output chunks as they arrive, so parse time overlaps the
+    device output time and the whole output is never kept
+    :param conn: Netmiko connection
+    :param parser: StreamParser
+    :param timeout: seconds without the prompt at the end of the output
+    :param stop_early: return as soon as the parser has the whole table, without reading the rest of the
+        output (the session can not be used again). Otherwise the rest is read, not parsed, up to the prompt
+    :return: True if it returned before the prompt
+    :raise OSError: if the prompt is not found in timeout seconds, like send_command()
+    """
+    prompt = conn.find_prompt().strip()
+    command = command.strip()
+    conn.clear_buffer()
+    conn.write_channel(conn.normalize_cmd(command))
+    # Up to the echo of the command, so the prompt before it is not the end of the output
+    data = conn.read_until_pattern(pattern=re.escape(command)).split(command, 1)[-1]
+    tail = ""
+    deadline = time.monotonic() + timeout
+    while True:
+        if data:
+            data = conn.normalize_linefeeds(data)
+            if parser.feed(data) and stop_early:
+                return True
+            window = tail + data
+            if prompt in window:
+                return False
+            tail = window[-len(prompt):]
+        elif time.monotonic() > deadline:
+            raise OSError(f"Prompt {prompt} not found in the output of {command}")
+        else:
+            time.sleep(STREAM_READ_INTERVAL)
+        data = conn.read_channel()
+
+
+def run_cmd(device: dict, command: str, logger_poller, pool=None) -> list:
     """
     Get device output according to the command
     :param device: device info
     :param command: to execute on device
     :param logger_poller: logging object
+    :param pool: SessionPool to reuse the sessions between cycles (daemon mode). None for a new session
     :return: parsed response in dictionary format
     """
-    name = device.pop("name")
     try:
-        with ConnectHandler(**device) as conn:
-            # When pyATS and Genie installed add use_genie=True
-            response = conn.send_command(command)
-    except (NetmikoTimeoutException, NetmikoAuthenticationException) as e:
-        logger_poller.error(e)
-        logger_poller.error(f"Connection error to device {device}")
+        response = fetch_output(device, command, logger_poller, pool)
+    except DeviceError as e:
+        logger_poller.error("%s", e)
         return []
-    device['name'] = name
     # When pyATS and Genie installed change return to response
-    parsed = custom_parser(response, command, device['device_type'], logger_poller)
-    logger_poller.info(f"Device {device} - Vlans Parsed")
-    logger_poller.debug(f"{parsed}")
+    return parse_output(device, command, response, logger_poller)
+
+
+def parse_output(device: dict, command: str, response: str, logger_poller) -> list:
+    """
+    Parse the device output, common to all the transports
+    """
+    with METRICS.timer(STAGE_PARSE, device['name']):
+        parsed = custom_parser(response, command, device['device_type'], logger_poller)
+    logger_poller.info("Device %s - %s Parsed", device['name'], command)
+    logger_poller.debug("%s", parsed)
     return parsed
-    # return response
 
 
 def custom_parser(output: str, command: str, device_type: str, logger_poller) -> list:
     # Install pip install pyATS and genie to use the parser in Netmiko. Now is not necessary for 1 command to parse
     """
-    Command output parse to structured data
+    Command output parse to structured data, with the parsers registered in etc/parsers.py
     :param output: string
     :param command: executed command
     :param device_type: device type supported by Netmiko
     :param logger_poller: logging object
     :return:
     """
-    parsed_output = []
-    if command == "show vlan" and device_type == "cisco_ios":
-        output = output.split("\n")
-        pattern = r"^(\d+)\s+(\S+)\s+\S+.*$"
-        for line in output:
-            match = re.search(pattern, line)
-            if match:
-                parsed_output.append({"vlan_id": match.group(1), "vlan_name": match.group(2)})
-    else:
-        logger_poller.info(f"Parsed not implemented for command {command} on device_type {device_type}")
-    return parsed_output
+    parser = get_parser(device_type, command)
+    if parser is None:
+        logger_poller.info("Parsed not implemented for command %s on device_type %s", command, device_type)
+        return []
+    return parser(output)
 
 
 # ar-mun-cd-11-dc-01#show vlan
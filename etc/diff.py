@@ -0,0 +1,146 @@
+from itertools import compress, count
+from operator import is_not
+from typing import NamedTuple, Optional
+from etc.vlanset import VlanSet, bit_ids, select_bit, SELECT_LIMIT
+
+# Default VLANs present in every Cisco switch, they can not be added, renamed or deleted
+RESERVED_VLANS = frozenset({"1", "1002", "1003", "1004", "1005"})
+
+OP_ADD = "add"
+OP_REMOVE = "remove"
+OP_RENAME = "rename"
+
+TARGET_DEVICE = "device"
+TARGET_DB = "db"
+
+RESERVED_VLAN_BITS = VlanSet.from_ids(RESERVED_VLANS).bits
+
+
+class VlanOperation(NamedTuple):
+    """
+    One change to apply, on a device or in the DB
+    """
+    target: str
+    dev_name: str
+    operation_type: str
+    vlan_id: str
+    vlan_name: str
+
+
+def index_db_vlans(vlans_db) -> dict:
+    """
+    Build the vlan_id index of the DB VLANs
+    :param vlans_db: VlanDb objects from query_all_vlan()
+    :return: {vlan_id: vlan_name}
+    """
+    return {vlan.id: vlan.name for vlan in vlans_db}
+
+
+def index_device_vlans(vlans_device) -> dict:
+    """
+    Build the vlan_id index of the device VLANs. If a vlan_id is repeated the first one wins
+    :param vlans_device: parsed output, list of {"vlan_id": x, "vlan_name": y}
+    :return: {vlan_id: vlan_name}
+    """
+    index = {}
+    for vlan in vlans_device:
+        index.setdefault(vlan["vlan_id"], vlan["vlan_name"])
+    return index
+
+
+def diff_vlans(dev_name: str, db: dict, current: dict, previous: Optional[dict] = None) -> list:
+    """
+    Three-way comparison between the DB, the current device VLANs and the previous device VLANs.
+    The previous snapshot tells which side changed since the last poll:
+    - VLAN only in the device: new in the device (add to DB), or deleted from the DB (remove from device)
+    - VLAN only in the DB: new in the DB (add to device), or deleted from the device (remove from DB)
+    - Different names: renamed in the device (rename in DB), or renamed in the DB (rename in device)
+    Without previous snapshot (first poll) nothing is removed and the DB name wins.
+    All the lookups are against dicts, so it is O(n) per device.
+    :param dev_name: device name
+    :param db: {vlan_id: vlan_name} from index_db_vlans()
+    :param current: {vlan_id: vlan_name} from index_device_vlans()
+    :param previous: {vlan_id: vlan_name} of the last poll, or None
+    :return: list of VlanOperation
+    """
+    operations = []
+    first_poll = previous is None
+    if first_poll:
+        previous = {}
+
+    for vlan_id, vlan_name in current.items():
+        if vlan_id in RESERVED_VLANS:
+            continue
+        if vlan_id not in db:
+            if vlan_id in previous:
+                operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_REMOVE, vlan_id, vlan_name))
+            else:
+                operations.append(VlanOperation(TARGET_DB, dev_name, OP_ADD, vlan_id, vlan_name))
+            continue
+        db_name = db[vlan_id]
+        if db_name == vlan_name:
+            continue
+        if first_poll or previous.get(vlan_id) == vlan_name:
+            operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_RENAME, vlan_id, db_name))
+        else:
+            operations.append(VlanOperation(TARGET_DB, dev_name, OP_RENAME, vlan_id, vlan_name))
+
+    for vlan_id, db_name in db.items():
+        if vlan_id in current or vlan_id in RESERVED_VLANS:
+            continue
+        if vlan_id in previous:
+            operations.append(VlanOperation(TARGET_DB, dev_name, OP_REMOVE, vlan_id, db_name))
+        else:
+            operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_ADD, vlan_id, db_name))
+
+    return operations
+
+
+def diff_vlan_sets(dev_name: str, db: VlanSet, current: VlanSet, previous: Optional[VlanSet] = None) -> list:
+    """
+    Same three-way comparison as diff_vlans(), with VlanSet. Adds and removes come from bit operations.
+    The names of the VLANs in both the DB and the device are compared by identity (interned strings), and only
+    the different ones are checked one by one
+    :param dev_name: device name
+    :param db: DB VLANs
+    :param current: device VLANs
+    :param previous: device VLANs of the last poll, or None
+    :return: list of VlanOperation, grouped by operation with ascending vlan_id
+    """
+    operations = []
+    first_poll = previous is None
+    previous_bits = 0 if first_poll else previous.bits
+    allowed = ~RESERVED_VLAN_BITS
+
+    only_device = current.bits & ~db.bits & allowed
+    for vlan_id in bit_ids(only_device & ~previous_bits):
+        operations.append(VlanOperation(TARGET_DB, dev_name, OP_ADD, str(vlan_id), current.name(vlan_id)))
+    for vlan_id in bit_ids(only_device & previous_bits):
+        operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_REMOVE, str(vlan_id), current.name(vlan_id)))
+
+    only_db = db.bits & ~current.bits & allowed
+    for vlan_id in bit_ids(only_db & ~previous_bits):
+        operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_ADD, str(vlan_id), db.name(vlan_id)))
+    for vlan_id in bit_ids(only_db & previous_bits):
+        operations.append(VlanOperation(TARGET_DB, dev_name, OP_REMOVE, str(vlan_id), db.name(vlan_id)))
+
+    common = current.bits & db.bits & allowed
+    current_names = current.project(common)
+    db_names = db.project(common)
+    # Interned names: an identity check finds the candidates, without a Python loop over all the VLANs
+    candidates = list(compress(count(), map(is_not, current_names, db_names)))
+    if not candidates:
+        return operations
+    common_ids = bit_ids(common) if len(candidates) > SELECT_LIMIT else None
+    for position in candidates:
+        vlan_name = current_names[position]
+        db_name = db_names[position]
+        if db_name == vlan_name:
+            continue
+        vlan_id = common_ids[position] if common_ids else select_bit(common, position)
+        if first_poll or previous.name(vlan_id) == vlan_name:
+            operations.append(VlanOperation(TARGET_DEVICE, dev_name, OP_RENAME, str(vlan_id), db_name))
+        else:
+            operations.append(VlanOperation(TARGET_DB, dev_name, OP_RENAME, str(vlan_id), vlan_name))
+
+    return operations
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from etc.db_ops import load_fingerprints, save_fingerprints
+from etc.parsers import vlan_section
+
+
+def output_fingerprint(output: str, device_type: str, command: str) -> str:
+    """
+    Hash of the VLAN section of the device output
+    """
+    return hashlib.blake2b(vlan_section(output, device_type, command).encode(), digest_size=16).hexdigest()
+
+
+def parsed_fingerprint(parsed: list) -> str:
+    """
+    Hash of the parsed VLANs, for the streaming mode: the output is parsed as it is read and not kept
+    """
+    rows = "\n".join(f"{vlan['vlan_id']} {vlan['vlan_name']}" for vlan in parsed)
+    return hashlib.blake2b(rows.encode(), digest_size=16).hexdigest()
+
+
+class FingerprintCache:
+    """
+    Per-device fingerprint of the last output found in sync with the DB. If the device output and the DB are the
+    same as then, parse, diff and DB work are skipped. Persisted in the device_fingerprints table
+    """
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}
+        self.changed = {}
+        self.db_digest = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<FingerprintCache(Devices={len(self.entries)}, Hits={self.hits}, Misses={self.misses}>"
+
+    @classmethod
+    def load(cls, session_obj, logger_orm) -> "FingerprintCache":
+        return cls(load_fingerprints(session_obj, logger_orm))
+
+    def begin_cycle(self, db_digest: str):
+        """
+        :param db_digest: VlanSet.digest() of the DB VLANs in this cycle
+        """
+        self.db_digest = db_digest
+
+    def unchanged(self, device: str, output_digest: str) -> bool:
+        """
+        True if this output was already found in sync with the current DB
+        """
+        hit = self.entries.get(device) == (output_digest, self.db_digest)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit
+
+    def store(self, device: str, output_digest: str):
+        """
+        The device output is in sync with the current DB
+        """
+        value = (output_digest, self.db_digest)
+        with self.lock:
+            if self.entries.get(device) != value:
+                self.entries[device] = value
+                self.changed[device] = value
+
+    def invalidate(self, device: str):
+        """
+        The device is not in sync, it has to be checked again in the next cycle
+        """
+        with self.lock:
+            if self.entries.pop(device, None) is not None:
+                self.changed[device] = None
+
+    def pending(self) -> dict:
+        """
+        Entries changed since the last save, to write with save_fingerprints(). They stay pending until saved()
+        :return: {device: (output_digest, db_digest) or None}
+        """
+        with self.lock:
+            return dict(self.changed)
+
+    def saved(self, changed: dict):
+        """
+        The pending() entries were written to the DB. The entries changed again meanwhile stay pending
+        """
+        with self.lock:
+            for device, value in changed.items():
+                if device in self.changed and self.changed[device] == value:
+                    del self.changed[device]
+
+    def save(self, session_obj, logger_orm):
+        """
+        Persist the entries changed since the last save, from the calling thread
+        """
+        changed = self.pending()
+        if changed:
+            save_fingerprints(session_obj, logger_orm, changed)
+            self.saved(changed)
@@ -0,0 +1,290 @@
+import io
+import threading
+
+from etc import ops
+from etc.vlanset import VlanSet, VLAN_ID_BITS
+
+try:
+    import numpy
+except ImportError:
+    # Optional dependency, only needed for the fleet matrix and the report command: pip install numpy
+    numpy = None
+
+DEFAULT_ROWS = 1024
+DEFAULT_COLUMNS = 256
+# Name id of the cells without VLAN
+ABSENT = 0
+# Separator of the names in the rows of db_ops.query_fleet_vlans()
+NAME_SEPARATOR = "\x01"
+REPORT_DRIFT = "drift"
+REPORT_COVERAGE = "coverage"
+REPORT_NAMES = "names"
+REPORT_MISSING = "missing"
+REPORTS = (REPORT_DRIFT, REPORT_COVERAGE, REPORT_NAMES, REPORT_MISSING)
+
+
+def nonzero(mask) -> tuple:
+    """
+    numpy.nonzero() of a 2D mask, several times faster on large masks
+    :return: rows and columns of the True cells, in row order
+    """
+    return numpy.divmod(numpy.flatnonzero(mask), mask.shape[1])
+
+
+class FleetMatrix:
+    """
+    VLANs of the whole fleet in one NumPy matrix, for fleet-wide questions with vectorized operations: one row per
+    device, one column per VLAN id seen in the fleet, and in each cell the name id of the VLAN on the device
+    (ABSENT if the device does not have it). Names are interned in a table, so comparing names is comparing ints.
+    Updated one device at a time as the devices are polled
+    """
+    def __init__(self, rows=DEFAULT_ROWS, columns=DEFAULT_COLUMNS):
+        if numpy is None:
+            raise ImportError("FleetMatrix needs NumPy: pip install numpy")
+        # uint16 name ids, uint32 after 65535 names
+        self.cells = numpy.zeros((rows, columns), dtype=numpy.uint16)
+        # {device: row} and row -> device
+        self.rows = {}
+        self.devices = []
+        # VLAN id -> column (-1: no column), column -> VLAN id, and columns used
+        self.columns = numpy.full(VLAN_ID_BITS, -1, dtype=numpy.int32)
+        self.vlan_ids = numpy.zeros(columns, dtype=numpy.int32)
+        self.width = 0
+        # {name: name id} and name id -> name
+        self.name_ids = {}
+        self.names = [None]
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<FleetMatrix(Devices={len(self.devices)}, Vlans={self.width}, Names={len(self.names) - 1}>"
+
+    @classmethod
+    def from_vlan_sets(cls, vlan_sets: dict) -> "FleetMatrix":
+        """
+        :param vlan_sets: {device: VlanSet}, like PollerState.snapshots
+        """
+        matrix = cls(max(DEFAULT_ROWS, len(vlan_sets)))
+        for device, vlans in vlan_sets.items():
+            matrix.update(device, vlans)
+        return matrix
+
+    @classmethod
+    def from_db_rows(cls, rows) -> "FleetMatrix":
+        """
+        :param rows: (device, comma separated VLAN ids, NAME_SEPARATOR separated names) from db_ops.query_fleet_vlans()
+        """
+        matrix = cls()
+        lengths, vlan_ids, names = [], [], []
+        with matrix.lock:
+            for device, device_ids, device_names in rows:
+                matrix._row(device)
+                device_names = device_names.split(NAME_SEPARATOR)
+                lengths.append(len(device_names))
+                vlan_ids.append(device_ids)
+                names.extend(device_names)
+            if not names:
+                return matrix
+            name_ids = numpy.fromiter(map(matrix._name_id, names), dtype=numpy.uint32, count=len(names))
+            # Parsed in C, much faster than int() per id
+            vlan_ids = numpy.fromstring(",".join(vlan_ids), dtype=numpy.int32, sep=",")
+            matrix._add_columns(numpy.unique(vlan_ids))
+            matrix.cells[numpy.repeat(numpy.arange(len(lengths)), lengths), matrix.columns[vlan_ids]] = name_ids
+        return matrix
+
+    def _name_id(self, name: str) -> int:
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            if name_id > numpy.iinfo(self.cells.dtype).max:
+                self.cells = self.cells.astype(numpy.uint32)
+        return name_id
+
+    def _row(self, device: str) -> int:
+        row = self.rows.get(device)
+        if row is None:
+            row = self.rows[device] = len(self.devices)
+            self.devices.append(device)
+        return row
+
+    def _grow(self, rows: int, columns: int):
+        """
+        Room for rows x columns, doubling the matrix
+        """
+        height, width = self.cells.shape
+        if rows <= height and columns <= width:
+            return
+        cells = numpy.zeros((height if rows <= height else max(rows, 2 * height),
+                             width if columns <= width else max(columns, 2 * width)), dtype=self.cells.dtype)
+        cells[:height, :width] = self.cells
+        self.cells = cells
+        vlan_ids = numpy.zeros(cells.shape[1], dtype=numpy.int32)
+        vlan_ids[:len(self.vlan_ids)] = self.vlan_ids
+        self.vlan_ids = vlan_ids
+
+    def _add_columns(self, vlan_ids) -> "numpy.ndarray":
+        """
+        :param vlan_ids: array of VLAN ids
+        :return: their columns, new columns (and room for all the devices) for the ids not seen before
+        """
+        new = vlan_ids[self.columns[vlan_ids] < 0]
+        if len(new):
+            self._grow(len(self.devices), self.width + len(new))
+            self.columns[new] = numpy.arange(self.width, self.width + len(new), dtype=numpy.int32)
+            self.vlan_ids[self.width:self.width + len(new)] = new
+            self.width += len(new)
+        else:
+            self._grow(len(self.devices), self.width)
+        return self.columns[vlan_ids]
+
+    def _vector(self, vlans: VlanSet) -> tuple:
+        """
+        :return: columns and name ids of the VLANs
+        """
+        name_ids = [self._name_id(name) for name in vlans.names]
+        return self._add_columns(numpy.array(vlans.ids(), dtype=numpy.int32)), name_ids
+
+    def update(self, device: str, vlans: VlanSet):
+        """
+        New VLANs of one device, thread safe
+        """
+        with self.lock:
+            row = self._row(device)
+            columns, name_ids = self._vector(vlans)
+            self.cells[row] = ABSENT
+            self.cells[row, columns] = name_ids
+
+    def view(self) -> "numpy.ndarray":
+        """
+        Cells of the devices and VLAN ids seen, without the spare room
+        """
+        return self.cells[:len(self.devices), :self.width]
+
+    def _db_row(self, vlans_db: VlanSet) -> "numpy.ndarray":
+        """
+        :return: name id of each column in the DB VLANs (ABSENT: not in the DB)
+        """
+        columns, name_ids = self._vector(vlans_db)
+        db = numpy.zeros(self.width, dtype=self.cells.dtype)
+        db[columns] = name_ids
+        return db
+
+    def _entries(self, vlans_db: VlanSet) -> tuple:
+        """
+        One pass over the matrix, the reports work on the cells with VLAN only
+        :return: row, column, name id and DB name id of the cells with VLAN
+        """
+        db = self._db_row(vlans_db)
+        cells = self.view()
+        rows, columns = nonzero(cells != ABSENT)
+        return rows, columns, cells[rows, columns], db[columns]
+
+    def _by_row(self, rows, vlan_ids) -> tuple:
+        """
+        :return: VLAN ids of each row (lists, in ascending id) and the count per row
+        """
+        order = numpy.lexsort((vlan_ids, rows))
+        counts = numpy.bincount(rows, minlength=len(self.devices))
+        bounds = numpy.concatenate(([0], numpy.cumsum(counts))).tolist()
+        ids = vlan_ids[order].tolist()
+        return [ids[bounds[row]:bounds[row + 1]] for row in range(len(self.devices))], counts
+
+    def coverage(self, vlans_db: VlanSet) -> list:
+        """
+        :return: per VLAN id (fleet and DB), in ascending id: devices with it, and the DB name (None: not in the DB)
+        """
+        with self.lock:
+            db = self._db_row(vlans_db)
+            counts = numpy.count_nonzero(self.view(), axis=0)
+            order = numpy.argsort(self.vlan_ids[:self.width])
+            return [{"vlan_id": vlan_id, "db_name": self.names[name_id], "devices": devices}
+                    for vlan_id, name_id, devices in zip(self.vlan_ids[order].tolist(), db[order].tolist(),
+                                                         counts[order].tolist())]
+
+    def drift(self, vlans_db: VlanSet) -> list:
+        """
+        :return: devices not in sync with the DB: VLANs not in the DB (extra), DB VLANs not on the device
+            (missing) and VLANs with another name (renamed), in ascending id
+        """
+        with self.lock:
+            rows, columns, name_ids, db_name_ids = self._entries(vlans_db)
+            extra = db_name_ids == ABSENT
+            renamed = ~extra & (name_ids != db_name_ids)
+            # DB VLANs only, already in ascending id
+            db_ids = numpy.array(vlans_db.ids(), dtype=numpy.int32)
+            missing_rows, missing_columns = nonzero(self.view()[:, self.columns[db_ids]] == ABSENT)
+            per_row = [self._by_row(rows[extra], self.vlan_ids[columns[extra]]),
+                       self._by_row(missing_rows, db_ids[missing_columns]),
+                       self._by_row(rows[renamed], self.vlan_ids[columns[renamed]])]
+        (extra, extra_counts), (missing, missing_counts), (renamed, renamed_counts) = per_row
+        return [{"device": self.devices[row], "extra": extra[row], "missing": missing[row], "renamed": renamed[row]}
+                for row in numpy.flatnonzero(extra_counts + missing_counts + renamed_counts).tolist()]
+
+    def name_mismatches(self, vlans_db: VlanSet) -> list:
+        """
+        :return: VLANs with a name on the device other than the DB name, per device in ascending id
+        """
+        with self.lock:
+            rows, columns, name_ids, db_name_ids = self._entries(vlans_db)
+            renamed = (db_name_ids != ABSENT) & (name_ids != db_name_ids)
+            rows, vlan_ids = rows[renamed], self.vlan_ids[columns[renamed]]
+            name_ids, db_name_ids = name_ids[renamed], db_name_ids[renamed]
+            order = numpy.lexsort((vlan_ids, rows))
+        return [{"device": self.devices[row], "vlan_id": vlan_id, "device_name": self.names[name_id],
+                 "db_name": self.names[db_name_id]}
+                for row, vlan_id, name_id, db_name_id in zip(rows[order].tolist(), vlan_ids[order].tolist(),
+                                                             name_ids[order].tolist(), db_name_ids[order].tolist())]
+
+    def missing(self, vlan_id: int) -> list:
+        """
+        :return: devices without the VLAN
+        """
+        column = self.columns[vlan_id] if 0 <= vlan_id < VLAN_ID_BITS else -1
+        if column < 0:
+            return list(self.devices)
+        return [self.devices[row] for row in numpy.flatnonzero(self.view()[:, column] == ABSENT).tolist()]
+
+    def report(self, kind: str, vlans_db: VlanSet, vlan_id: int = None) -> list:
+        """
+        :param kind: one of REPORTS. REPORT_MISSING needs vlan_id
+        :return: report rows, dicts
+        """
+        if kind == REPORT_DRIFT:
+            return self.drift(vlans_db)
+        if kind == REPORT_COVERAGE:
+            return self.coverage(vlans_db)
+        if kind == REPORT_NAMES:
+            return self.name_mismatches(vlans_db)
+        if kind == REPORT_MISSING:
+            return [{"device": device, "vlan_id": vlan_id} for device in self.missing(vlan_id)]
+        raise ValueError(f"Unknown report {kind}")
+
+    def save(self, filename):
+        """
+        Save the cells with VLAN (NumPy .npz), replacing the file at once
+        """
+        with self.lock:
+            cells = self.view()
+            rows, columns = nonzero(cells != ABSENT)
+            data = io.BytesIO()
+            numpy.savez(data, rows=rows.astype(numpy.int32), columns=columns.astype(numpy.int32),
+                        name_ids=cells[rows, columns], vlan_ids=self.vlan_ids[:self.width],
+                        devices=numpy.array(self.devices, dtype=str), names=numpy.array(self.names[1:], dtype=str))
+        ops.write_atomic(filename, data.getvalue())
+
+    @classmethod
+    def load(cls, filename) -> "FleetMatrix":
+        with numpy.load(filename) as data:
+            devices, vlan_ids = data["devices"].tolist(), data["vlan_ids"]
+            matrix = cls(max(DEFAULT_ROWS, len(devices)), max(DEFAULT_COLUMNS, len(vlan_ids)))
+            name_ids = data["name_ids"]
+            matrix.cells = matrix.cells.astype(name_ids.dtype, copy=False)
+            matrix.cells[data["rows"], data["columns"]] = name_ids
+            matrix.names.extend(data["names"].tolist())
+        matrix.devices = devices
+        matrix.rows = {device: row for row, device in enumerate(devices)}
+        matrix.name_ids = {name: name_id for name_id, name in enumerate(matrix.names) if name_id}
+        matrix.width = len(vlan_ids)
+        matrix.vlan_ids[:matrix.width] = vlan_ids
+        matrix.columns[vlan_ids] = numpy.arange(matrix.width, dtype=numpy.int32)
+        return matrix
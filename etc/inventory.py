@@ -1,63 +1,182 @@
+import concurrent.futures
+import hashlib
+import json
 import os
+import urllib.error
+import urllib.request
 from etc import ops
+from etc.metrics import METRICS
+
+# Cache of the sources: last body, ETag and Last-Modified per URL, and the hosts of the files (etc/ops.py)
+DEFAULT_CACHE_DIR = ".inventory_cache"
+DEFAULT_TIMEOUT = 10
+# Sources (files and URLs) loaded at the same time
+MAX_WORKERS = 8
 
 
 class Inventory:
     """
-    Load Inventory from different sources (check vlan_sync_cfg.yml)
+    Load Inventory from different sources (check vlan_sync_cfg.yml).
+    All the files and URLs are loaded at the same time, and the devices merged in the order of the config:
+    if several sources have the same host or the same name, the first one wins
     """
-    def __init__(self, sources, logger):
+    def __init__(self, sources, logger, cache_dir=DEFAULT_CACHE_DIR):
         self.sources = sources
-        self.devices = self.load_inventory()
         self.logger = logger
+        self.cache_dir = cache_dir
         self.userid = os.getenv("USERNAME")
         self.passwd = os.getenv("PASSWORD")
+        self.devices = self.load_inventory()
 
     def __repr__(self):
-        return f"<Inventory(Sources={self.sources}, Devices={self.devices}>"
-
-    def load_inventory(self):
-        inv = {}
-        for source in self.sources:
-            inv = self.get_source(source)
-        return inv
-
-    def get_source(self, source_type):
-        devices_full_list = []
+        return f"<Inventory(Sources={self.sources}, Devices={len(self.devices)}>"
+
+    def load_inventory(self) -> list:
+        """
+        :return: devices of all the sources, without duplicated hosts or names
+        """
+        items = []
+        for source_type in self.sources:
+            if source_type not in ("remote_api_urls", "file_list"):
+                self.logger.info("SKIPPING Not valid inventory source %s", source_type)
+                continue
+            items.extend((source_type, item) for item in self.sources[source_type] or [])
+        if not items:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(items))) as executor:
+            # map() keeps the config order, for the merge
+            device_lists = list(executor.map(lambda source: self.get_source(*source), items))
+        return self.merge_devices(device_lists)
+
+    def get_source(self, source_type, item) -> list:
+        """
+        Devices of one file or URL
+        """
         if source_type == "remote_api_urls":
-            # NOT implemented yet
-            pass
-        elif source_type == "file_list":
-            for item in self.sources[source_type]:
-                devices = ops.load_yaml(item["filename"])
-                if len(devices) != 0:
-                    devices_full_list.extend(self.add_devices_per_source(devices))
+            devices = self.fetch_remote(item)
         else:
-            self.logger.info(f"SKIPPING Not valid inventory source {source_type}")
-
-        return devices_full_list
+            devices = {"hosts": ops.load_hosts(item["filename"], self.logger, self.cache_dir)}
+        if len(devices.get("hosts") or []) == 0:
+            return []
+        return self.add_devices_per_source(devices)
+
+    def fetch_remote(self, item) -> dict:
+        """
+        Inventory API, JSON {"hosts": [...]} like the inventory files. Conditional request (If-None-Match,
+        If-Modified-Since) with the cached ETag and Last-Modified: if the inventory did not change (304) or the API
+        is not reachable, the cached body is used
+        :param item: {"url": x, "timeout": seconds}
+        :return: inventory dict, {} if there is no inventory
+        """
+        url = item["url"] if "://" in item["url"] else f"https://{item['url']}"
+        cache_file = os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest())
+        meta = self._cache_meta(cache_file)
+        request = urllib.request.Request(url, headers={"Accept": "application/json"})
+        if meta.get("etag"):
+            request.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            request.add_header("If-Modified-Since", meta["last_modified"])
+        try:
+            with urllib.request.urlopen(request, timeout=item.get("timeout", DEFAULT_TIMEOUT)) as response:
+                body = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                METRICS.inc("inventory_requests", result="not_modified")
+                self.logger.info("Inventory %s not modified", url)
+                return self._load_body(cache_file + ".body", url)
+            return self._fetch_failed(url, cache_file, e)
+        except (urllib.error.URLError, OSError) as e:
+            return self._fetch_failed(url, cache_file, e)
+        METRICS.inc("inventory_requests", result="fetched")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            ops.write_atomic(cache_file + ".body", body)
+            ops.write_atomic(cache_file + ".json", json.dumps(
+                {"url": url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}).encode())
+        except OSError as e:
+            self.logger.error("Inventory cache %s not saved: %s", cache_file, e)
+        self.logger.info("Inventory %s fetched, %s bytes", url, len(body))
+        return self._parse_body(body, url)
+
+    def _fetch_failed(self, url, cache_file, error) -> dict:
+        METRICS.inc("inventory_requests", result="error")
+        self.logger.error("Inventory %s failed: %s. Using the cached inventory", url, error)
+        return self._load_body(cache_file + ".body", url)
+
+    def _cache_meta(self, cache_file) -> dict:
+        # Without the body there is nothing to revalidate
+        if not os.path.exists(cache_file + ".body"):
+            return {}
+        try:
+            with open(cache_file + ".json") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_body(self, filename, url) -> dict:
+        try:
+            with open(filename, "rb") as file:
+                return self._parse_body(file.read(), url)
+        except OSError:
+            self.logger.error("Inventory %s not cached", url)
+            return {}
+
+    def _parse_body(self, body, url) -> dict:
+        try:
+            content = json.loads(body)
+        except ValueError as e:
+            self.logger.error("Inventory %s is not valid JSON: %s", url, e)
+            return {}
+        # A bare list of hosts is accepted too
+        if isinstance(content, list):
+            return {"hosts": content}
+        return content if isinstance(content, dict) else {}
 
     def add_devices_per_source(self, devices):
         device_list_per_source = []
-        for device in devices["hosts"]:
+        for device in devices.get("hosts") or []:
             if self.validate_device(device):
+                device.setdefault("name", device["host"])
                 device["username"] = self.userid
                 device["password"] = self.passwd
                 device_list_per_source.append(device)
             else:
-                self.logger.info(f"SKIPPING Invalid device {device}")
+                self.logger.info("SKIPPING Invalid device %s", device)
 
         return device_list_per_source
 
-    def validate_device(self, device):
-        # Not implemented yet. Check duplicate, host, ip address, and device type
-        return device
-
-
-
-
-
-
-
-
-
+    def validate_device(self, device) -> bool:
+        """
+        Device with host and device type. Duplicated hosts and names are removed by merge_devices()
+        """
+        return isinstance(device, dict) and bool(device.get("host")) and bool(device.get("device_type"))
+
+    def merge_devices(self, device_lists) -> list:
+        """
+        One device per host and per name, the first one seen. The state of the poller (schedule, fingerprints,
+        previous VLANs, shards) is per device name, so a second device with the same name would share it.
+        One pass with a set of hosts and a set of names
+        """
+        hosts = set()
+        names = set()
+        devices = []
+        duplicates = 0
+        for device_list in device_lists:
+            for device in device_list:
+                host, name = device["host"], device["name"]
+                if host in hosts:
+                    duplicates += 1
+                    self.logger.debug("SKIPPING Duplicated host %s, device %s", host, name)
+                    continue
+                if name in names:
+                    duplicates += 1
+                    self.logger.error("SKIPPING Duplicated device name %s, host %s", name, host)
+                    continue
+                hosts.add(host)
+                names.add(name)
+                devices.append(device)
+        if duplicates:
+            self.logger.info("Inventory %s duplicated hosts or names skipped", duplicates)
+        self.logger.info("Inventory loaded. %s devices", len(devices))
+        return devices
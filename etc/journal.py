@@ -0,0 +1,153 @@
+import threading
+import time
+from etc.db_ops import append_journal, load_journal_state
+from etc.diff import OP_ADD, OP_REMOVE, OP_RENAME, TARGET_DB, TARGET_DEVICE
+from etc.vlanset import VlanSet, bit_ids
+
+# Take a snapshot after this many seconds or journal rows, whatever comes first. The restart replays the rows
+# after the last snapshot, so snapshot_rows bounds the restart time
+DEFAULT_SNAPSHOT_INTERVAL = 3600
+DEFAULT_SNAPSHOT_ROWS = 50000
+
+
+def vlan_set_changes(previous: VlanSet, current: VlanSet) -> list:
+    """
+    :param previous: VLANs before, None if the device was never seen
+    :return: [(operation, vlan_id, vlan_name)] from previous to current, ascending vlan_id per operation
+    """
+    previous = previous or VlanSet()
+    changes = [(OP_ADD, vlan_id, current.name(vlan_id)) for vlan_id in bit_ids(current.bits & ~previous.bits)]
+    changes.extend((OP_REMOVE, vlan_id, previous.name(vlan_id)) for vlan_id in bit_ids(previous.bits & ~current.bits))
+    if previous.project(current.bits) != current.project(previous.bits):
+        changes.extend((OP_RENAME, vlan_id, current.name(vlan_id)) for vlan_id in bit_ids(current.bits & previous.bits)
+                       if current.name(vlan_id) != previous.name(vlan_id))
+    return changes
+
+
+class ChangeJournal:
+    """
+    Journal of the VLAN changes seen on the devices and applied to the DB, appended to the vlan_journal table, and
+    periodic snapshots of the VLANs of every device. At startup the last snapshot plus the journal after it give the
+    VLANs of every device in the last poll, the "previous" of the three-way diff, without polling the fleet first
+    """
+    def __init__(self, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, snapshot_rows=DEFAULT_SNAPSHOT_ROWS,
+                 clock=time.time, shard=""):
+        """
+        :param shard: member of sharding.members (--shard), its snapshots only have its devices
+        """
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_rows = snapshot_rows
+        self.clock = clock
+        self.shard = shard
+        # Rows not saved yet
+        self.pending = []
+        # Index in pending of the first row of the cycle
+        self.cycle_start = 0
+        # Timestamp of the last snapshot (None: no snapshot) and rows journaled after it
+        self.last_snapshot = None
+        self.rows_since_snapshot = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<ChangeJournal(Pending={len(self.pending)}, Rows_since_snapshot={self.rows_since_snapshot}>"
+
+    def restore(self, session_obj, logger_orm, devices=None) -> dict:
+        """
+        :param devices: only these device names (the devices of the shard), None for all
+        :return: {device name: VlanSet} VLANs of every device, from the last snapshot and the journal after it
+        """
+        snapshots, self.last_snapshot, self.rows_since_snapshot = load_journal_state(session_obj, logger_orm,
+                                                                                       self.shard)
+        if devices is not None:
+            snapshots = {name: vlans for name, vlans in snapshots.items() if name in devices}
+        return snapshots
+
+    def device_changes(self, device: str, previous: VlanSet, current: VlanSet) -> int:
+        """
+        Journal the changes of the device VLANs between two polls
+        :return: rows journaled
+        """
+        now = self.clock()
+        rows = [{"timestamp": now, "target": TARGET_DEVICE, "device": device, "operation": operation,
+                 "vlan_id": vlan_id, "name": vlan_name} for operation, vlan_id, vlan_name in
+                vlan_set_changes(previous, current)]
+        with self.lock:
+            self.pending.extend(rows)
+        return len(rows)
+
+    def db_changes(self, operations: list) -> int:
+        """
+        Journal the DB changes applied, the last operation of each VLAN like apply_vlan_changes()
+        :param operations: VlanOperation list with target "db"
+        """
+        latest = {}
+        for operation in operations:
+            latest[operation.vlan_id] = operation
+        now = self.clock()
+        rows = [{"timestamp": now, "target": TARGET_DB, "device": op.dev_name, "operation": op.operation_type,
+                 "vlan_id": int(op.vlan_id), "name": op.vlan_name} for op in latest.values()]
+        with self.lock:
+            self.pending.extend(rows)
+        return len(rows)
+
+    def begin_cycle(self):
+        """
+        The rows journaled from now on are the rows of the cycle, for discard()
+        """
+        with self.lock:
+            self.cycle_start = len(self.pending)
+
+    def discard(self, devices):
+        """
+        Drop the device changes of the cycle of the devices, polled again in the next cycle
+        """
+        with self.lock:
+            self.pending[self.cycle_start:] = [row for row in self.pending[self.cycle_start:]
+                                               if row["target"] != TARGET_DEVICE or row["device"] not in devices]
+
+    def snapshot_due(self, rows=0) -> bool:
+        rows += self.rows_since_snapshot
+        if rows == 0:
+            return False
+        return (self.last_snapshot is None or rows >= self.snapshot_rows or
+                self.clock() - self.last_snapshot >= self.snapshot_interval)
+
+    def batch(self, snapshots: dict = None):
+        """
+        Rows and snapshot to save with append_journal(). The rows stay pending until saved(), so a failed or
+        replayed write (DbWriter) saves them again
+        :param snapshots: {device name: VlanSet} current VLANs of every device, None to not take a snapshot
+        :return: (rows, snapshot or None, timestamp), None if there is nothing to save
+        """
+        with self.lock:
+            rows = list(self.pending)
+        snapshot = snapshots if snapshots is not None and self.snapshot_due(len(rows)) else None
+        if not rows and snapshot is None:
+            return None
+        return rows, snapshot, self.clock()
+
+    def saved(self, rows: list, snapshot: dict, timestamp: float, logger_orm):
+        """
+        The batch() was written to the DB
+        """
+        with self.lock:
+            del self.pending[:len(rows)]
+            self.cycle_start = max(0, self.cycle_start - len(rows))
+        if snapshot is None:
+            self.rows_since_snapshot += len(rows)
+        else:
+            self.last_snapshot, self.rows_since_snapshot = timestamp, 0
+            logger_orm.info("Journal snapshot of %s devices", len(snapshot))
+
+    def save(self, session_obj, logger_orm, snapshots: dict = None) -> int:
+        """
+        Append the pending rows, and take a snapshot if it is due, from the calling thread
+        :param snapshots: {device name: VlanSet} current VLANs of every device, None to not take a snapshot
+        :return: rows appended
+        """
+        batch = self.batch(snapshots)
+        if batch is None:
+            return 0
+        append_journal(session_obj, logger_orm, *batch, self.shard)
+        self.saved(*batch, logger_orm)
+        return len(batch[0])
@@ -1,40 +1,236 @@
+import atexit
+import json
+import queue
 import sys
+import threading
 import logging
 from logging.handlers import RotatingFileHandler
-import queue
 from logging.handlers import QueueListener, QueueHandler
 
 DEFAULT_LOGGING_FILE = "logs/logger.txt"
+DEFAULT_LOGGING_LEVEL = "DEBUG"
+# Records kept in memory before writing them to the file. Errors are written at once
+DEFAULT_BUFFER_RECORDS = 100
+# Seconds to write the buffered records when the tool is idle
+DEFAULT_FLUSH_INTERVAL = 1.0
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler writing the records in batches: one write per buffer_records records, per error record,
+    or when the listener is idle for flush_interval seconds
+    """
+    def __init__(self, filename, max_bytes=0, backup_count=0, buffer_records=DEFAULT_BUFFER_RECORDS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.buffer_records = buffer_records
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return
+        self.buffer.append(message)
+        self.buffered_bytes += len(message)
+        if len(self.buffer) >= self.buffer_records or record.levelno >= logging.ERROR:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.buffer:
+                return
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes and self.stream.tell() + self.buffered_bytes >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write("".join(self.buffer))
+            self.stream.flush()
+            self.buffer = []
+            self.buffered_bytes = 0
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """
+    StreamHandler to the current sys.stdout, also when it is replaced after the handler is created
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, logger, level, message
+    """
+    def format(self, record):
+        return json.dumps({"time": record.created, "logger": record.name, "level": record.levelname,
+                           "message": record.getMessage()})
+
+
+class LoggerNamesFilter(logging.Filter):
+    """
+    Records of the named loggers and of their child loggers. One filter per handler: a handler emits a record only
+    if all its filters pass it
+    """
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def filter(self, record):
+        name = record.name
+        while name not in self.names:
+            if "." not in name:
+                return False
+            name = name.rsplit(".", 1)[0]
+        return True
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    QueueListener that flushes the buffered handlers when there are no records for flush_interval seconds
+    """
+    def __init__(self, log_queue, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+    def add_handler(self, handler):
+        # The listener thread reads the tuple, replaced at once
+        self.handlers = self.handlers + (handler,)
+
+    def stop(self):
+        super().stop()
+        self.flush()
+
+
+class LoggingPipeline:
+    """
+    One queue and one listener thread for all the loggers of the tool. The callers create a record only if the level
+    is enabled, and QueueHandler.prepare() merges its message and arguments in the calling thread. The output
+    format (LOG_FORMAT, JSON) and the file writes are done in the listener thread
+    """
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.queue = queue.Queue(-1)
+        self.queue_handler = QueueHandler(self.queue)
+        self.listener = BatchingQueueListener(self.queue, flush_interval)
+        self.console_handler = None
+        self.file_handlers = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.exit_registered = False
+
+    def __repr__(self):
+        return f"<LoggingPipeline(Handlers={len(self.listener.handlers)}, Started={self.started}>"
+
+    def add_logger(self, logger, config):
+        """
+        Connect the logger to the queue, and its file handlers to the listener
+        """
+        with self.lock:
+            if self.queue_handler not in logger.handlers:
+                logger.addHandler(self.queue_handler)
+            # The root logger would print it again
+            logger.propagate = False
+            if self.console_handler is None:
+                self.console_handler = ConsoleHandler()
+                self.console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+                self.listener.add_handler(self.console_handler)
+            buffer_records = config.get("log_buffer_records", DEFAULT_BUFFER_RECORDS)
+            self.add_file_handler(logger.name, config.get("logging_file", DEFAULT_LOGGING_FILE),
+                                  logging.Formatter(LOG_FORMAT), config, buffer_records)
+            if config.get("logging_json_file"):
+                self.add_file_handler(logger.name, config["logging_json_file"], JsonFormatter(), config,
+                                      buffer_records)
+            if not self.started:
+                self.listener.start()
+                self.started = True
+                if not self.exit_registered:
+                    atexit.register(self.stop)
+                    self.exit_registered = True
+
+    def add_file_handler(self, name, filename, formatter, config, buffer_records):
+        handler = self.file_handlers.get(filename)
+        if handler is None:
+            handler = BufferedRotatingFileHandler(filename, config.get("log_max_size", 4096),
+                                                  config.get("backup_count", 2), buffer_records)
+            handler.setFormatter(formatter)
+            handler.addFilter(LoggerNamesFilter())
+            self.file_handlers[filename] = handler
+            self.listener.add_handler(handler)
+        # Only the records of the loggers configured with this file
+        handler.filters[0].names.add(name)
+
+    def stop(self):
+        """
+        Write the pending records and stop the listener thread
+        """
+        with self.lock:
+            if self.started:
+                self.listener.stop()
+                self.started = False
+
+    def flush(self):
+        """
+        Write the queued records
+        """
+        with self.lock:
+            if self.started:
+                self.listener.stop()
+                self.listener.start()
+
+
+PIPELINE = LoggingPipeline()
 
 
 class CustomLogger:
+    """
+    Logger of a module of the tool. Messages are %-style with arguments, formatted only if the level is enabled:
+    logger.debug("Device %s VLANs %s", name, vlans)
+    """
     def __init__(self, module, config):
-        self.que = queue.Queue(-1)
-        self.queue_handler = QueueHandler(self.que)
         self.log_filename = config.get("logging_file", DEFAULT_LOGGING_FILE)
-        self.log_level = config.get("logging_level".upper(), "DEBUG")
+        self.log_level = str(config.get("logging_level", DEFAULT_LOGGING_LEVEL)).upper()
 
         self.logger = logging.getLogger(module)
         self.logger.setLevel(self.log_level)
-        self.formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s " "- %(message)s"
-        )
-        self.console_handler = logging.StreamHandler(sys.stdout)
-        self.file_handler = RotatingFileHandler(self.log_filename,
-                                                maxBytes=config.get("log_max_size", 4096),
-                                                backupCount=config.get("backup_count", 2))
-        self.console_handler.setFormatter(self.formatter)
-        self.file_handler.setFormatter(self.formatter)
-        self.listener = QueueListener(self.que, self.console_handler, self.file_handler)
-
-        self.logger.addHandler(self.queue_handler)
-        self.listener.start()
-
-    def debug(self, message):
-        self.logger.debug(message)
-
-    def info(self, message):
-        self.logger.info(message)
-
-    def error(self, message):
-        self.logger.error(message)
\ No newline at end of file
+        PIPELINE.add_logger(self.logger, config)
+
+    def __repr__(self):
+        return f"<CustomLogger(Module={self.logger.name}, Level={self.log_level}, File={self.log_filename}>"
+
+    def is_enabled(self, level) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, message, *args):
+        self.logger.debug(message, *args)
+
+    def info(self, message, *args):
+        self.logger.info(message, *args)
+
+    def error(self, message, *args):
+        self.logger.error(message, *args)
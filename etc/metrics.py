@@ -0,0 +1,262 @@
+import functools
+import http.server
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram upper bounds, seconds. From a parsed table (ms) to a slow SSH login (tens of seconds)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "vlan_sync"
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# Stages of a device poll and of the cycle, label "stage" of the latency metrics
+STAGE_CONNECT = "connect"
+STAGE_COMMAND = "command"
+STAGE_PARSE = "parse"
+STAGE_DIFF = "diff"
+STAGE_DEVICE_UPDATE = "device_update"
+STAGE_DEVICE = "device"
+STAGE_DB_QUERY = "db_query"
+STAGE_DB_WRITE = "db_write"
+# Wait for the SQLite write lock (etc/db_writer.py)
+STAGE_DB_LOCK = "db_lock"
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count, as the Prometheus histogram type
+    """
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def __repr__(self):
+        return f"<Histogram(Count={self.count}, Sum={self.total:.3f}>"
+
+    def observe(self, value: float):
+        index = 0
+        for bound in LATENCY_BUCKETS:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimation from the buckets, linear inside the bucket (same as PromQL histogram_quantile)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (LATENCY_BUCKETS[-1],), self.counts):
+            if seen + bucket_count >= rank:
+                if bucket_count == 0:
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = bound
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    """
+    Latency histograms per stage, last latency per device and stage, counters and gauges.
+    Exported in Prometheus text format (render) and as a JSON summary (summary)
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        return f"<Metrics(Stages={list(self.stages)}, Devices={len(self.devices)}, Counters={len(self.counters)}>"
+
+    def reset(self):
+        with self.lock:
+            # {stage: Histogram}
+            self.stages = {}
+            # {(device, stage): seconds} last latency of the device stage
+            self.devices = {}
+            # {(name, ((label, value), ...)): value}
+            self.counters = {}
+            self.gauges = {}
+
+    def observe(self, stage: str, seconds: float, device=None):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+            if device is not None:
+                self.devices[(device, stage)] = seconds
+
+    @contextmanager
+    def timer(self, stage: str, device=None):
+        """
+        Time the block as a stage latency
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(stage, self.clock() - start, device)
+
+    def inc(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_gauge(self, name: str, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    @contextmanager
+    def in_flight(self, name="devices_in_flight"):
+        """
+        Gauge of the blocks running at the same time
+        """
+        self.add_gauge(name, 1)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1)
+
+    def counter(self, name: str, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            stages = sorted(self.stages.items())
+            devices = sorted(self.devices.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            bucket_counts = {stage: list(histogram.counts) for stage, histogram in stages}
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} Latency of the poll stages")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in stages:
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, bucket_counts[stage]):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        name = f"{METRIC_PREFIX}_device_stage_seconds"
+        lines.append(f"# HELP {name} Last latency of the stage per device")
+        lines.append(f"# TYPE {name} gauge")
+        for (device, stage), seconds in devices:
+            lines.append(f'{name}{{device="{_escape(device)}",stage="{stage}"}} {seconds}')
+        lines.extend(_render_samples(counters, "counter", "_total"))
+        lines.extend(_render_samples(gauges, "gauge", ""))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """
+        JSON friendly summary: stage latencies (count, sum, mean, p50, p99), counters and gauges
+        """
+        with self.lock:
+            stages = {stage: {"count": histogram.count, "sum": round(histogram.total, 6),
+                              "mean": round(histogram.total / histogram.count, 6) if histogram.count else 0.0,
+                              "p50": round(histogram.quantile(0.5), 6), "p99": round(histogram.quantile(0.99), 6)}
+                      for stage, histogram in sorted(self.stages.items())}
+            counters = [_sample_dict(key, value) for key, value in sorted(self.counters.items())]
+            gauges = [_sample_dict(key, value) for key, value in sorted(self.gauges.items())]
+            slowest = sorted(((seconds, device) for (device, stage), seconds in self.devices.items()
+                              if stage == STAGE_DEVICE), reverse=True)[:10]
+        return {"stages": stages, "counters": counters, "gauges": gauges,
+                "slowest_devices": [{"device": device, "seconds": round(seconds, 6)} for seconds, device in slowest]}
+
+    def write_summary(self, filename: str):
+        with open(filename, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_samples(samples, metric_type, suffix):
+    lines = []
+    last_name = None
+    for (name, labels), value in samples:
+        full_name = f"{METRIC_PREFIX}_{name}{suffix}"
+        if name != last_name:
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            last_name = name
+        label_text = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+        lines.append(f"{full_name}{{{label_text}}} {value}" if label_text else f"{full_name} {value}")
+    return lines
+
+
+def _sample_dict(key, value):
+    name, labels = key
+    return {"name": name, "labels": dict(labels), "value": value}
+
+
+# Registry of the tool, like the parsers registry. Tests can use their own Metrics()
+METRICS = Metrics()
+
+
+def timed(stage: str):
+    """
+    Decorator to time a function as a stage latency in METRICS
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Scrapes are not logged
+        pass
+
+
+def start_metrics_server(port: int, host=DEFAULT_METRICS_HOST, metrics=None):
+    """
+    Serve /metrics in Prometheus text format from a daemon thread
+    :param port: TCP port, 0 for a random free port
+    :param host: listen address, local only by default
+    :param metrics: Metrics to export, METRICS by default
+    :return: the server, server.server_address has the port and server.shutdown() stops it
+    """
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"metrics": metrics or METRICS})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,5 +1,21 @@
+import hashlib
+import marshal
+import os
 import yaml
 import sys
+from yaml.events import AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent, SequenceEndEvent, \
+    SequenceStartEvent
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+try:
+    # libyaml C parser, about 10 times faster than the pure Python one
+    SafeLoader = yaml.CSafeLoader
+except AttributeError:
+    # PyYAML without libyaml
+    SafeLoader = yaml.SafeLoader
+
+# Bumped when the format of the cached content changes. 2: marshal, was pickle
+CACHE_VERSION = 2
 
 
 def load_yaml(filename) -> dict:
@@ -10,8 +26,8 @@ def load_yaml(filename) -> dict:
     """
     content = {}
     try:
-        with open(filename) as file:
-            content = yaml.safe_load(file.read())
+        with open(filename, "rb") as file:
+            content = yaml.load(file, Loader=SafeLoader)
     except Exception as e:
         print(e)
         print(f"Error loading file {filename}")
@@ -23,4 +39,120 @@ def load_yaml(filename) -> dict:
         return {}
 
 
-load_yaml("../vlan_sync_cfg.yml")
\ No newline at end of file
+def iter_hosts(filename, key="hosts"):
+    """
+    Hosts of an inventory file, one at a time: each host is built from the parser events (libyaml if available),
+    without building the whole document first
+    :param key: top-level key of the hosts list
+    :return: generator of host dicts
+    """
+    with open(filename, "rb") as file:
+        parser = SafeLoader(file)
+        try:
+            # StreamStart, DocumentStart
+            parser.get_event()
+            parser.get_event()
+            if not parser.check_event(MappingStartEvent):
+                return
+            parser.get_event()
+            composer = _EventComposer(parser)
+            while parser.check_event(ScalarEvent):
+                name = parser.get_event().value
+                if name == key and parser.check_event(SequenceStartEvent):
+                    parser.get_event()
+                    while not parser.check_event(SequenceEndEvent):
+                        yield composer.construct(composer.compose())
+                    parser.get_event()
+                else:
+                    composer.compose()
+        finally:
+            parser.dispose()
+
+
+def load_hosts(filename, logger, cache_dir=None) -> list:
+    """
+    Hosts of an inventory file, with a binary cache (marshal: only data, a cache file can not run code) in
+    cache_dir, valid while the file has the same path, mtime and size
+    :param logger: logging object
+    :param cache_dir: None for no cache
+    :return: list of host dicts, empty if the file is not valid
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError as e:
+        logger.error("Error loading file %s %r", filename, e)
+        return []
+    key = (CACHE_VERSION, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, hashlib.sha1(key[1].encode()).hexdigest() + ".hosts")
+        try:
+            with open(cache_file, "rb") as file:
+                cached_key, hosts = marshal.load(file)
+            if cached_key == key:
+                return hosts
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    try:
+        hosts = [host for host in iter_hosts(filename) if host is not None]
+    except Exception as e:
+        logger.error("Error loading file %s %r", filename, e)
+        return []
+    if cache_file is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_atomic(cache_file, marshal.dumps((key, hosts)))
+        except (OSError, ValueError) as e:
+            # ValueError: values marshal can not save, e.g. YAML timestamps
+            logger.warning("Cache %s not saved %r", cache_file, e)
+    return hosts
+
+
+def write_atomic(filename, data: bytes):
+    """
+    Write to a temporary file and rename it, so a reader never sees half a file
+    """
+    temporary = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, filename)
+
+
+class _EventComposer:
+    """
+    Nodes from the parser events, like yaml.composer.Composer (which the C parser does not expose per node), and
+    objects from the nodes with the safe constructor
+    """
+    def __init__(self, parser):
+        self.parser = parser
+        self.resolver = yaml.resolver.Resolver()
+        self.constructor = yaml.constructor.SafeConstructor()
+        self.anchors = {}
+
+    def compose(self):
+        event = self.parser.get_event()
+        if isinstance(event, AliasEvent):
+            return self.anchors[event.anchor]
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self.resolver.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag or self.resolver.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not self.parser.check_event(SequenceEndEvent):
+                node.value.append(self.compose())
+            node.end_mark = self.parser.get_event().end_mark
+        else:
+            tag = event.tag or self.resolver.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not self.parser.check_event(MappingEndEvent):
+                node.value.append((self.compose(), self.compose()))
+            node.end_mark = self.parser.get_event().end_mark
+        if event.anchor is not None:
+            self.anchors[event.anchor] = node
+        return node
+
+    def construct(self, node):
+        return self.constructor.construct_document(node)
@@ -0,0 +1,284 @@
+import io
+import re
+
+# Precompiled parsers, by (device_type, command)
+PARSERS = {}
+# Functions to cut the section of the output with the VLANs, by (device_type, command)
+SECTIONS = {}
+# Stateful parsers fed with the output as it is read from the device (StreamParser classes), by (device_type, command)
+STREAM_PARSERS = {}
+
+# Command to get the VLANs, when it is not "show vlan"
+VLAN_COMMANDS = {"juniper_junos": "show vlans"}
+DEFAULT_VLAN_COMMAND = "show vlan"
+
+# VLAN table row: id, name, status. Port list continuation lines start with spaces and do not match
+CISCO_VLAN_ROW = re.compile(r"(\d+)\s+(\S+)\s+\S+")
+# Junos ELS table row: routing instance, name, tag. Interface lines start with spaces and do not match
+JUNOS_VLAN_ROW = re.compile(r"(\S+)\s+(\S+)\s+(\d+)\b")
+# Header of the trunk allowed VLANs table: "Vlans allowed on trunk" (IOS, NX-OS) or "Vlans allowed" (EOS)
+TRUNK_ALLOWED_HEADER = re.compile(r"Port\s+Vlans allowed( on trunk)?\s*$", re.IGNORECASE)
+# "show ip interface brief" VLAN interface row: interface, IP, OK?, method, status (can be 2 words), protocol
+CISCO_SVI_ROW = re.compile(r"^(Vlan(\d+))\s+(\S+)\s+\S+\s+\S+\s+(\S+(?: down)?)\s+(\S+)\s*$", re.MULTILINE)
+
+
+def register_parser(device_type: str, *commands: str):
+    """
+    Decorator to add a parser to the registry
+    :param device_type: device type supported by Netmiko
+    :param commands: commands the parser understands
+    """
+    def decorator(function):
+        for command in commands:
+            PARSERS[(device_type, command)] = function
+        return function
+    return decorator
+
+
+def get_parser(device_type: str, command: str):
+    """
+    :return: parser function, or None if not implemented
+    """
+    return PARSERS.get((device_type, command))
+
+
+def register_stream_parser(device_type: str, *commands: str):
+    """
+    Class decorator to add a StreamParser to the registry
+    """
+    def decorator(cls):
+        for command in commands:
+            STREAM_PARSERS[(device_type, command)] = cls
+        return cls
+    return decorator
+
+
+def get_stream_parser(device_type: str, command: str):
+    """
+    :return: StreamParser class, or None if not implemented
+    """
+    return STREAM_PARSERS.get((device_type, command))
+
+
+class StreamParser:
+    """
+    Stateful line parser, fed with the output chunks as they are read from the device. A line split between
+    chunks waits for the next chunk. Once the table is complete (done) the rest of the output is not needed
+    """
+    def __init__(self):
+        # [{"vlan_id": x, "vlan_name": y}]
+        self.parsed = []
+        self.done = False
+        self.partial = ""
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(Rows={len(self.parsed)}, Done={self.done})>"
+
+    def feed(self, chunk: str) -> bool:
+        """
+        :return: True when the table is complete
+        """
+        if not self.done:
+            lines = (self.partial + chunk).split("\n")
+            self.partial = lines.pop()
+            self.done = self.lines(lines)
+        return self.done
+
+    def close(self) -> list:
+        """
+        End of the output: the last line, even without line break
+        :return: parsed output
+        """
+        if not self.done and self.partial:
+            self.lines([self.partial])
+        self.done = True
+        self.partial = ""
+        return self.parsed
+
+    def parse(self, output: str) -> list:
+        """
+        Whole output at once
+        """
+        self.feed(output)
+        return self.close()
+
+    def lines(self, lines: list) -> bool:
+        """
+        Parse complete lines
+        :return: True when the table is complete
+        """
+        raise NotImplementedError
+
+
+def register_section(device_type: str, *commands: str):
+    """
+    Decorator to add a VLAN section function to the registry
+    """
+    def decorator(function):
+        for command in commands:
+            SECTIONS[(device_type, command)] = function
+        return function
+    return decorator
+
+
+def vlan_section(output: str, device_type: str, command: str) -> str:
+    """
+    Part of the output with the VLAN table (the whole output if there is no section function)
+    """
+    section = SECTIONS.get((device_type, command))
+    return section(output) if section else output
+
+
+def vlan_command(device_type: str) -> str:
+    """
+    Command to get the VLANs of the device type
+    """
+    return VLAN_COMMANDS.get(device_type, DEFAULT_VLAN_COMMAND)
+
+
+@register_stream_parser("cisco_ios", "show vlan", "show vlan brief")
+@register_stream_parser("cisco_nxos", "show vlan", "show vlan brief")
+@register_stream_parser("arista_eos", "show vlan", "show vlan brief")
+class CiscoVlanTable(StreamParser):
+    """
+    "VLAN Name Status Ports" table. It is complete at the blank line after the table, so the next tables
+    ("VLAN Type SAID...", "Remote SPAN VLANs", etc.) are never read
+    """
+    def __init__(self):
+        super().__init__()
+        self.in_table = False
+
+    def lines(self, lines: list) -> bool:
+        parsed_output = self.parsed
+        in_table = self.in_table
+        match = CISCO_VLAN_ROW.match
+        for line in lines:
+            if not in_table:
+                in_table = line.startswith("----")
+                continue
+            if not line.strip():
+                if parsed_output:
+                    return True
+                continue
+            row = match(line)
+            if row:
+                parsed_output.append({"vlan_id": row.group(1), "vlan_name": row.group(2)})
+        self.in_table = in_table
+        return False
+
+
+@register_parser("cisco_ios", "show vlan", "show vlan brief")
+@register_parser("cisco_nxos", "show vlan", "show vlan brief")
+@register_parser("arista_eos", "show vlan", "show vlan brief")
+def parse_cisco_show_vlan(output: str) -> list:
+    """
+    "VLAN Name Status Ports" table, one pass over the lines (CiscoVlanTable)
+    :param output: command output
+    :return: [{"vlan_id": x, "vlan_name": y}]
+    """
+    return CiscoVlanTable().parse(output)
+
+
+@register_section("cisco_ios", "show vlan", "show vlan brief")
+@register_section("cisco_nxos", "show vlan", "show vlan brief")
+@register_section("arista_eos", "show vlan", "show vlan brief")
+def cisco_show_vlan_section(output: str) -> str:
+    """
+    From the table header to the blank line after the table, same limits as parse_cisco_show_vlan()
+    """
+    start = output.find("----")
+    if start == -1:
+        return output
+    end = output.find("\n\n", start)
+    return output[start:end] if end != -1 else output[start:]
+
+
+@register_section("juniper_junos", "show vlans")
+def junos_show_vlans_section(output: str) -> str:
+    start = output.find("Routing instance")
+    if start == -1:
+        return output
+    end = output.find("\n{", start)
+    return output[start:end] if end != -1 else output[start:]
+
+
+@register_stream_parser("juniper_junos", "show vlans")
+class JunosVlanTable(StreamParser):
+    """
+    "Routing instance VLAN name Tag Interfaces" table (ELS). Complete at the {master:0} banner of the virtual
+    chassis, otherwise at the end of the output
+    """
+    def __init__(self):
+        super().__init__()
+        self.in_table = False
+
+    def lines(self, lines: list) -> bool:
+        parsed_output = self.parsed
+        in_table = self.in_table
+        match = JUNOS_VLAN_ROW.match
+        for line in lines:
+            if not in_table:
+                in_table = line.startswith("Routing instance")
+                continue
+            if line.startswith("{"):
+                return True
+            row = match(line)
+            if row:
+                parsed_output.append({"vlan_id": row.group(3), "vlan_name": row.group(2)})
+        self.in_table = in_table
+        return False
+
+
+@register_parser("juniper_junos", "show vlans")
+def parse_junos_show_vlans(output: str) -> list:
+    """
+    "Routing instance VLAN name Tag Interfaces" table (ELS), one pass over the lines (JunosVlanTable)
+    :param output: command output
+    :return: [{"vlan_id": x, "vlan_name": y}]
+    """
+    return JunosVlanTable().parse(output)
+
+
+@register_parser("cisco_ios", "show interfaces trunk")
+@register_parser("cisco_nxos", "show interfaces trunk", "show interface trunk")
+@register_parser("arista_eos", "show interfaces trunk")
+def parse_trunk_allowed_vlans(output: str) -> list:
+    """
+    "Port Vlans allowed (on trunk)" table, one pass over the lines. Long lists continue in lines starting with
+    spaces. The other tables (mode, active, forwarding VLANs) are skipped
+    :param output: command output
+    :return: [{"interface": x, "allowed_vlans": "1-10,20"}]
+    """
+    parsed_output = []
+    in_table = False
+    for line in io.StringIO(output):
+        if not in_table:
+            in_table = TRUNK_ALLOWED_HEADER.match(line) is not None
+            continue
+        if line.startswith("--"):
+            continue
+        if not line.strip():
+            if parsed_output:
+                break
+            continue
+        if line[0].isspace() and parsed_output:
+            parsed_output[-1]["allowed_vlans"] += line.strip()
+            continue
+        row = line.split()
+        if len(row) >= 2:
+            parsed_output.append({"interface": row[0], "allowed_vlans": row[1]})
+    return parsed_output
+
+
+@register_parser("cisco_ios", "show ip interface brief")
+def parse_cisco_svis(output: str) -> list:
+    """
+    VLAN interfaces (SVIs) of "show ip interface brief", the other interfaces are skipped
+    :param output: command output
+    :return: [{"vlan_id": x, "interface": "Vlan<x>", "ip_address": y, "status": z, "protocol": w}]
+    """
+    parsed_output = []
+    for row in CISCO_SVI_ROW.finditer(output):
+        parsed_output.append({"vlan_id": row.group(2), "interface": row.group(1), "ip_address": row.group(3),
+                              "status": row.group(4), "protocol": row.group(5)})
+    return parsed_output
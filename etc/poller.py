@@ -0,0 +1,564 @@
+import asyncio
+import concurrent.futures
+import time
+
+from etc.collection import CollectionPlan, mark_saved, parse_record, unsaved_rows
+from etc.db_ops import query_all_vlan, append_journal, apply_vlan_changes, save_device_records, save_device_vlans, \
+    save_fingerprints
+from etc.device_ops import DeviceError, fetch_outputs, parse_output, stream_outputs
+from etc.async_device_ops import fetch_outputs_async, stream_outputs_async
+from etc.diff import diff_vlan_sets, TARGET_DB, TARGET_DEVICE
+from etc.fingerprint import output_fingerprint, parsed_fingerprint
+from etc.metrics import METRICS, STAGE_DEVICE, STAGE_DIFF
+from etc.parsers import get_stream_parser
+from etc.ratelimit import LoginLimiter
+from etc.vlanset import VlanSet
+from etc.updater import update_vlans, PUSH_DRY_RUN, PUSH_OFF
+
+
+class PollerState:
+    """
+    State kept between poll cycles
+    """
+    def __init__(self, snapshots=None, pool=None, cache=None, limiter=None, breaker=None, writer=None,
+                 journal=None, matrix=None, plan=None, stream=False):
+        # {device name: VlanSet} VLANs in the previous poll
+        self.snapshots = snapshots if snapshots is not None else {}
+        # {device name: bool} the device VLANs changed in the last poll, for the scheduler
+        self.changed = {}
+        # SessionPool in daemon mode
+        self.pool = pool
+        # FingerprintCache to skip the devices with the same output
+        self.cache = cache
+        # LoginLimiter of the new sessions, to not DoS the authentication systems
+        self.limiter = limiter
+        # CircuitBreaker to skip the failing devices until their retry time
+        self.breaker = breaker
+        # {device name: VlanOperation list} device changes of the cycle, pushed at the end of the cycle
+        self.pushes = {}
+        # DbWriter, the single writer thread of the DB. None to write from the calling thread
+        self.writer = writer
+        # ChangeJournal of the device and DB changes, None to not journal them
+        self.journal = journal
+        # FleetMatrix of the device VLANs, updated with every device change, None without NumPy or reports
+        self.matrix = matrix
+        # CollectionPlan, commands run in the device session besides the VLAN command
+        self.plan = plan if plan is not None else CollectionPlan()
+        # {device name: DeviceRecord} parsed output of those commands in the last poll
+        self.records = {}
+        # Parse the VLAN command output while it is read (StreamParser), new sessions closed after the table
+        self.stream = stream
+        # {device name: VlanSet or None} VLANs before the cycle of the devices changed in it, restored if the DB
+        # writes of the cycle fail
+        self.before = {}
+
+    def __repr__(self):
+        return f"<PollerState(Snapshots={len(self.snapshots)}, Pool={self.pool}, Cache={self.cache}, " \
+               f"Breaker={self.breaker}, Writer={self.writer}>"
+
+
+def get_device_vlans(output, device, command, logger_poller):
+    """
+    Get device VLANs from the command output
+    :return: parsed output, list of {"vlan_id": x, "vlan_name": y}
+    """
+    vlans_device = parse_output(device, command, output, logger_poller)
+
+    """
+    testing data
+    vlans_device = [{'vlan_id': '1', 'vlan_name': 'default'}, {'vlan_id': '110', 'vlan_name': 'vlan'},
+                    {'vlan_id': '200', 'vlan_name': 'INET_DTV'}, {'vlan_id': '201', 'vlan_name': 'para_borrar'},
+                    {'vlan_id': '202', 'vlan_name': 'Internet_Broadband'},
+                    {'vlan_id': '251', 'vlan_name': 'InsideFW_REGION(172.21.0.160/29)'},
+                    {'vlan_id': '280', 'vlan_name': 'INSIDE_CONC_VPN(172.21.1.0/28)'},
+                    {'vlan_id': '302', 'vlan_name': 'MPLS-IN'}, {'vlan_id': '303', 'vlan_name': 'descri'},
+                    {'vlan_id': '304', 'vlan_name': 'OutLevel3(201.234.41.80/28)'},
+                    {'vlan_id': '308', 'vlan_name': 'WIFI-PROV-OUT'},
+                    {'vlan_id': '400', 'vlan_name': 'MGMT(172.21.31.32/29)'},
+                    {'vlan_id': '401', 'vlan_name': 'WLC-MGMT(172.21.31.0/29)'},
+                    {'vlan_id': '402', 'vlan_name': 'ARG2FW(172.21.31.16/29)'},
+                    {'vlan_id': '404', 'vlan_name': 'WLC-corp(172.21.92.0/22)'},
+                    {'vlan_id': '405', 'vlan_name': 'WLC-Guest'}, {'vlan_id': '406', 'vlan_name': 'WIFI-Prov'},
+                    {'vlan_id': '407', 'vlan_name': 'ISE(172.21.31.40/29)'}, {'vlan_id': '408', 'vlan_name': 'WLC-HA'},
+                    {'vlan_id': '440', 'vlan_name': 'Failover-FW-AR-MTZ-FW-01-Guest'},
+                    {'vlan_id': '441', 'vlan_name': 'Failover-FW-AR-MTZ-VC-01'},
+                    {'vlan_id': '442', 'vlan_name': 'Failover-FW-AR-MTZ-CO-01'},
+                    {'vlan_id': '443', 'vlan_name': 'Failover-FW-AR-MTZ-FW-01-Prov'},
+                    {'vlan_id': '445', 'vlan_name': 'Failover-Fw-DTV-FW-DC-C-1'},
+                    {'vlan_id': '950', 'vlan_name': 'BC-AFM(172.21.1.16/28)'},
+                    {'vlan_id': '999', 'vlan_name': 'dump-vlan'},
+                    {'vlan_id': '1002', 'vlan_name': 'fddi-default'},
+                    {'vlan_id': '1003', 'vlan_name': 'token-ring-default'},
+                    {'vlan_id': '1004', 'vlan_name': 'fddinet-default'},
+                    {'vlan_id': '1005', 'vlan_name': 'trnet-default'},
+                    {'vlan_id': '1', 'vlan_name': 'enet'}, {'vlan_id': '110', 'vlan_name': 'enet'},
+                    {'vlan_id': '200', 'vlan_name': 'enet'}, {'vlan_id': '201', 'vlan_name': 'enet'},
+                    {'vlan_id': '202', 'vlan_name': 'enet'}, {'vlan_id': '251', 'vlan_name': 'enet'},
+                    {'vlan_id': '280', 'vlan_name': 'enet'}, {'vlan_id': '302', 'vlan_name': 'enet'},
+                    {'vlan_id': '303', 'vlan_name': 'enet'}, {'vlan_id': '304', 'vlan_name': 'enet'},
+                    {'vlan_id': '308', 'vlan_name': 'enet'}, {'vlan_id': '400', 'vlan_name': 'enet'},
+                    {'vlan_id': '401', 'vlan_name': 'enet'}, {'vlan_id': '402', 'vlan_name': 'enet'},
+                    {'vlan_id': '404', 'vlan_name': 'enet'}, {'vlan_id': '405', 'vlan_name': 'enet'},
+                    {'vlan_id': '406', 'vlan_name': 'enet'}, {'vlan_id': '407', 'vlan_name': 'enet'},
+                    {'vlan_id': '408', 'vlan_name': 'enet'}, {'vlan_id': '440', 'vlan_name': 'enet'},
+                    {'vlan_id': '441', 'vlan_name': 'enet'}, {'vlan_id': '442', 'vlan_name': 'enet'},
+                    {'vlan_id': '443', 'vlan_name': 'enet'}, {'vlan_id': '445', 'vlan_name': 'enet'},
+                    {'vlan_id': '950', 'vlan_name': 'enet'}, {'vlan_id': '999', 'vlan_name': 'enet'},
+                    {'vlan_id': '1002', 'vlan_name': 'fddi'}, {'vlan_id': '1003', 'vlan_name': 'tr'},
+                    {'vlan_id': '1004', 'vlan_name': 'fdnet'}, {'vlan_id': '1005', 'vlan_name': 'trnet'}]
+    """
+
+    return vlans_device
+
+
+def vlans_difference(vlans_db, vlans_device, logger_poller, dev_name="", vlans_previous=None):
+    """
+    Check differences between DB, device and previous device VLANs
+    :param vlans_db: VlanSet from the DB
+    :param vlans_device: VlanSet from the device
+    :param logger_poller: logging object
+    :param dev_name: device name
+    :param vlans_previous: VlanSet from the device in the previous poll, None if first poll
+    :return: list of VlanOperation (etc/diff.py)
+    """
+    with METRICS.timer(STAGE_DIFF, dev_name or None):
+        difference = diff_vlan_sets(dev_name, vlans_db, vlans_device, vlans_previous)
+    for operation in difference:
+        METRICS.inc("diff_operations", target=operation.target, operation=operation.operation_type)
+    logger_poller.debug("VLANs to sync %s", difference)
+    return difference
+
+
+def reconcile_device(vlans_db, dev_name, vlans_device, logger_poller, logger_orm, snapshots):
+    """
+    Compare the parsed device VLANs with the DB and the previous poll.
+    :param vlans_device: parsed output from run_cmd()
+    :param snapshots: {device name: VlanSet} VLANs in the previous poll
+    :return: VlanOperation list (DB and device), or None if the device has no VLANs
+    """
+    if len(vlans_device) == 0:
+        logger_poller.info("Vlan list is empty. Check host %s or db.", dev_name)
+        return None
+    vlans_device = VlanSet.from_parsed(vlans_device)
+    vlans_difference_result = vlans_difference(vlans_db, vlans_device, logger_poller,
+                                               dev_name, snapshots.get(dev_name))
+    snapshots[dev_name] = vlans_device
+    if len(vlans_difference_result) == 0:
+        logger_poller.info("Device %s in sync", dev_name)
+    return vlans_difference_result
+
+
+def process_output(vlans_db, device, command, output, logger_poller, logger_orm, state):
+    """
+    From the device output to the DB changes, common to all the transports.
+    The DB changes are returned, to be applied all together at the end of the cycle.
+    :param output: command output, None if the device was not reachable
+    :param state: PollerState
+    :return: VlanOperation list for the DB
+    """
+    if output is None:
+        return []
+    fingerprint = None
+    if state.cache is not None:
+        fingerprint = output_fingerprint(output, device["device_type"], command)
+
+    def parse():
+        return get_device_vlans(output, device, command, logger_poller)
+    return process_vlans(vlans_db, device, fingerprint, parse, logger_poller, logger_orm, state)
+
+
+def process_vlans(vlans_db, device, fingerprint, parse, logger_poller, logger_orm, state):
+    """
+    From the device VLANs to the DB changes, common to the buffered and the streamed outputs
+    :param fingerprint: of the device output for the output cache, None without cache
+    :param parse: function returning the parsed VLANs, not called if the output did not change
+    :return: VlanOperation list for the DB
+    """
+    dev_name = device["name"]
+    if state.breaker is not None:
+        state.breaker.record_success(dev_name)
+    cache = state.cache
+    if cache is not None:
+        # Only with the previous VLANs of the device, else (e.g. no journal, snapshots restored after a failed
+        # cycle) the output is parsed to have them again
+        if dev_name in state.snapshots and cache.unchanged(dev_name, fingerprint):
+            METRICS.inc("output_cache", result="hit")
+            logger_poller.info("Device %s in sync, output unchanged", dev_name)
+            state.changed[dev_name] = False
+            return []
+        METRICS.inc("output_cache", result="miss")
+    vlans_previous = state.snapshots.get(dev_name)
+    vlans_device = parse()
+    vlans_difference_result = reconcile_device(vlans_db, dev_name, vlans_device, logger_poller, logger_orm,
+                                               state.snapshots)
+    state.changed[dev_name] = state.snapshots.get(dev_name) != vlans_previous
+    if state.changed[dev_name]:
+        device_changed(state, dev_name, vlans_previous, state.snapshots[dev_name])
+    device_changes = [op for op in vlans_difference_result or [] if op.target == TARGET_DEVICE]
+    if len(device_changes) != 0:
+        state.pushes[dev_name] = device_changes
+    if cache is not None:
+        if vlans_difference_result == []:
+            cache.store(dev_name, fingerprint)
+        else:
+            cache.invalidate(dev_name)
+    return [op for op in vlans_difference_result or [] if op.target == TARGET_DB]
+
+
+def process_outputs(vlans_db, device, outputs, logger_poller, logger_orm, state, parsed=None):
+    """
+    All the outputs of the device collection plan: the VLAN command (the first) to the DB changes like
+    process_output(), and the other commands parsed to the device record
+    :param outputs: {command: output}, the VLAN command first. Only the other commands if parsed is given
+    :param parsed: VLANs parsed while the output was read (streaming), None to parse the VLAN command output
+    :return: VlanOperation list for the DB
+    """
+    if parsed is None:
+        command, *extra = outputs
+        db_changes = process_output(vlans_db, device, command, outputs[command], logger_poller, logger_orm, state)
+    else:
+        extra = list(outputs)
+        fingerprint = parsed_fingerprint(parsed) if state.cache is not None else None
+        db_changes = process_vlans(vlans_db, device, fingerprint, lambda: parsed, logger_poller, logger_orm, state)
+    if extra:
+        state.records[device["name"]] = parse_record(device, {extra_command: outputs[extra_command]
+                                                              for extra_command in extra}, logger_poller)
+    return db_changes
+
+
+def device_changed(state, dev_name, vlans_previous, vlans_device):
+    """
+    New VLANs of a device to the journal and the fleet matrix
+    """
+    state.before.setdefault(dev_name, vlans_previous)
+    if state.journal is not None:
+        state.journal.device_changes(dev_name, vlans_previous, vlans_device)
+    if state.matrix is not None:
+        state.matrix.update(dev_name, vlans_device)
+
+
+def sync_device(vlans_db, device, command, logger_poller, logger_orm, state):
+    """
+    Get device VLANs and check if they are the same
+    :param state: PollerState
+    :return: VlanOperation list for the DB
+    """
+    commands = state.plan.commands(device["device_type"], command)
+    with METRICS.timer(STAGE_DEVICE, device["name"]):
+        try:
+            if streaming(device, commands, state):
+                parsed, outputs = stream_outputs(device, commands, logger_poller, state.pool, state.limiter)
+            else:
+                parsed, outputs = None, fetch_outputs(device, commands, logger_poller, state.pool, state.limiter)
+        except DeviceError as e:
+            return device_failed(e, logger_poller, state)
+        return process_outputs(vlans_db, device, outputs, logger_poller, logger_orm, state, parsed)
+
+
+async def sync_device_async(vlans_db, device, command, semaphore, logger_poller, logger_orm, state):
+    """
+    Asyncio version of sync_device(). Parse and diff run in the default executor, so the event loop keeps
+    reading the other sessions meanwhile
+    """
+    commands = state.plan.commands(device["device_type"], command)
+    with METRICS.timer(STAGE_DEVICE, device["name"]):
+        try:
+            if streaming(device, commands, state):
+                parsed, outputs = await stream_outputs_async(device, commands, logger_poller, semaphore,
+                                                             state.limiter)
+            else:
+                parsed, outputs = None, await fetch_outputs_async(device, commands, logger_poller, semaphore,
+                                                                  state.limiter)
+        except DeviceError as e:
+            return device_failed(e, logger_poller, state)
+        return await asyncio.get_running_loop().run_in_executor(None, process_outputs, vlans_db, device, outputs,
+                                                                logger_poller, logger_orm, state, parsed)
+
+
+def streaming(device, commands, state) -> bool:
+    """
+    Streaming mode, and a StreamParser for the VLAN command of the device type
+    """
+    return state.stream and get_stream_parser(device["device_type"], commands[0]) is not None
+
+
+def device_failed(error, logger_poller, state):
+    """
+    The device was not polled. Its VLANs are unknown (not empty), so there is nothing to sync
+    :param error: DeviceError
+    :return: no DB changes
+    """
+    logger_poller.error("%s", error)
+    METRICS.inc("errors", stage=STAGE_DEVICE, reason="auth" if error.auth else "connection")
+    if state.breaker is not None:
+        state.breaker.record_failure(error.name, error.reason, error.auth)
+    return []
+
+
+def pollable_devices(inventory, logger_poller, state):
+    """
+    Devices allowed by the circuit breaker. The others are skipped, without using a worker or session slot
+    """
+    if state.breaker is None:
+        return inventory
+    devices = [device for device in inventory if state.breaker.allow(device["name"])]
+    METRICS.set_gauge("open_circuits", len(inventory) - len(devices))
+    if len(devices) != len(inventory):
+        logger_poller.info("Skipping %s devices with open circuit", len(inventory) - len(devices))
+    return devices
+
+
+def submit_write(state, session_obj, logger_orm, function, *args) -> concurrent.futures.Future:
+    """
+    DB write operation with the DB writer, grouped with the other queued writes, or at once without it
+    :param function: db_ops write function, function(session_obj, logger_orm, *args). It can be applied again after
+        a rollback, so it only writes its arguments and does not change any state of the poller
+    :return: Future with the result, or the exception raised
+    """
+    if state.writer is not None:
+        return state.writer.submit(function, *args)
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(function(session_obj, logger_orm, *args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def cycle_db_changes(inventory, results, logger_poller) -> list:
+    """
+    DB changes of all the devices of the cycle, to apply them in one transaction (or chunks of chunk_size)
+    :param inventory: polled devices
+    :param results: VlanOperation list (or the exception raised) per device, in inventory order
+    """
+    db_changes = []
+    for device, device_changes in zip(inventory, results):
+        if isinstance(device_changes, Exception):
+            logger_poller.error("Device %s sync failed %r", device['name'], device_changes)
+            METRICS.inc("errors", stage=STAGE_DEVICE, reason="exception")
+            continue
+        db_changes.extend(device_changes)
+    return db_changes
+
+
+def load_db_vlans(session_obj, logger_orm, state):
+    """
+    DB VLANs at the start of the cycle
+    """
+    state.before = {}
+    if state.journal is not None:
+        state.journal.begin_cycle()
+    logger_orm.info("Getting VLANs from DB")
+    vlans_db = VlanSet.from_db(query_all_vlan(session_obj, logger_orm))
+    if state.cache is not None:
+        state.cache.begin_cycle(vlans_db.digest())
+    return vlans_db
+
+
+def finish_cycle(inventory, results, session_obj, logger_poller, logger_orm, state, chunk_size) -> bool:
+    """
+    Save the DB changes and the fingerprints of the cycle. With the DB writer they are one transaction
+    :return: False if the DB writes failed (the changes are found again in the next cycle)
+    """
+    logger_poller.info("Sync finished")
+    db_changes = cycle_db_changes(inventory, results, logger_poller)
+    writes = [submit_write(state, session_obj, logger_orm, apply_vlan_changes, db_changes, chunk_size)
+              if db_changes else None]
+    # VLANs per device (device_vlans table), only the devices with new VLANs
+    writes.append(submit_write(state, session_obj, logger_orm, save_device_vlans,
+                               {device["name"]: state.snapshots[device["name"]].items()
+                                for device in inventory if state.changed.get(device["name"])}))
+    # Collection plan records of the devices polled in the cycle, for the reports
+    records = unsaved_rows(state.records, [device["name"] for device in inventory])
+    if records:
+        writes.append(submit_write(state, session_obj, logger_orm, save_device_records, records))
+    fingerprints = state.cache.pending() if state.cache is not None else {}
+    if fingerprints:
+        writes.append(submit_write(state, session_obj, logger_orm, save_fingerprints, fingerprints))
+    if state.cache is not None:
+        logger_poller.info("Output cache hits %s misses %s", state.cache.hits, state.cache.misses)
+    try:
+        for write in writes:
+            if write is not None:
+                write.result()
+    except Exception as e:
+        writes_failed(e, [device["name"] for device in inventory], logger_poller, state)
+        return False
+    mark_saved(state.records, records)
+    if fingerprints:
+        state.cache.saved(fingerprints)
+    if state.journal is not None:
+        # Only the DB changes applied
+        state.journal.db_changes(db_changes)
+        save_journal(session_obj, logger_orm, state)
+    return True
+
+
+def writes_failed(error, names, logger_poller, state):
+    """
+    The DB writes of the cycle failed (e.g. database is locked). The changed devices go back to their VLANs before
+    the cycle and their output cache entries are dropped, so the next cycle finds and saves the same changes
+    :param names: devices of the cycle
+    """
+    logger_poller.error("DB writes of the cycle failed %r. %s changed devices synced again in the next cycle",
+                        error, len(state.before))
+    METRICS.inc("errors", stage="db_writer", reason="cycle")
+    for name, vlans in state.before.items():
+        if vlans is None:
+            state.snapshots.pop(name, None)
+        else:
+            state.snapshots[name] = vlans
+    if state.journal is not None:
+        # Journaled again in the next cycle
+        state.journal.discard(state.before)
+    if state.cache is not None:
+        for name in names:
+            state.cache.invalidate(name)
+    state.before = {}
+    # Found again in the next cycle
+    state.pushes = {}
+
+
+def save_journal(session_obj, logger_orm, state):
+    """
+    Append the journal rows of the cycle, with a snapshot of the device VLANs if it is due. If the write fails
+    the rows stay pending for the next cycle
+    """
+    batch = state.journal.batch(dict(state.snapshots))
+    if batch is None:
+        return
+    try:
+        submit_write(state, session_obj, logger_orm, append_journal, *batch, state.journal.shard).result()
+    except Exception as e:
+        logger_orm.error("Journal rows not saved %r, saved with the next cycle", e)
+        METRICS.inc("errors", stage="db_writer", reason="journal")
+        return
+    state.journal.saved(*batch, logger_orm)
+
+
+async def sync_vlans(executor, inventory, session_obj, logger_poller, logger_orm, state=None, chunk_size=0):
+    """
+    Get VLANs from DB and pool devices with threads
+    """
+    if state is None:
+        state = PollerState()
+    loop = asyncio.get_event_loop()
+    # VLAN command by device type (etc/parsers.py), then the collection plan commands
+    command = None
+    tasks = []
+    inventory = pollable_devices(inventory, logger_poller, state)
+    vlans_db = load_db_vlans(session_obj, logger_orm, state)
+    logger_poller.info("Staring the poller")
+    for device in inventory:
+        tasks.append(loop.run_in_executor(executor, sync_device, vlans_db, device, command, logger_poller, logger_orm,
+                                          state))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    finish_cycle(inventory, results, session_obj, logger_poller, logger_orm, state, chunk_size)
+
+
+async def sync_vlans_async(inventory, session_obj, logger_poller, logger_orm, max_sessions, state=None,
+                           chunk_size=0):
+    """
+    Get VLANs from DB and pool devices with asyncio coroutines, limited by a semaphore
+    """
+    if state is None:
+        state = PollerState()
+    # VLAN command by device type (etc/parsers.py), then the collection plan commands
+    command = None
+    semaphore = asyncio.Semaphore(max_sessions)
+    inventory = pollable_devices(inventory, logger_poller, state)
+    vlans_db = load_db_vlans(session_obj, logger_orm, state)
+    logger_poller.info("Staring the asyncio poller, max sessions %s", max_sessions)
+    results = await asyncio.gather(*(sync_device_async(vlans_db, device, command, semaphore, logger_poller,
+                                                       logger_orm, state) for device in inventory),
+                                   return_exceptions=True)
+    finish_cycle(inventory, results, session_obj, logger_poller, logger_orm, state, chunk_size)
+
+
+def diff_devices(executor, inventory, session_obj, logger_poller, logger_orm, state) -> dict:
+    """
+    Poll the devices and compare them with the DB and their previous VLANs, without saving or pushing anything
+    :return: {device name: VlanOperation list}, DB and device changes of the devices not in sync
+    """
+    inventory = pollable_devices(inventory, logger_poller, state)
+    vlans_db = load_db_vlans(session_obj, logger_orm, state)
+    futures = [executor.submit(sync_device, vlans_db, device, None, logger_poller, logger_orm, state)
+               for device in inventory]
+    changes = {}
+    for device, future in zip(inventory, futures):
+        try:
+            operations = future.result() + state.pushes.get(device["name"], [])
+        except Exception as e:
+            logger_poller.error("Device %s sync failed %r", device["name"], e)
+            METRICS.inc("errors", stage=STAGE_DEVICE, reason="exception")
+            continue
+        if operations:
+            changes[device["name"]] = operations
+    return changes
+
+
+def run_cycle(config, executor, devices, session_obj, logger_poller, logger_orm, state):
+    """
+    One poll and sync pass over the devices
+    :return: cycle duration, seconds
+    """
+    start = time.monotonic()
+    event_loop = asyncio.get_event_loop()
+    chunk_size = config["db_orm"].get("write_chunk_size", 0)
+    if config["poller"].get("transport", "thread") == "asyncio":
+        # asyncssh sessions are coroutines, so the semaphore is the only limit of concurrent sessions
+        max_sessions = config["poller"].get("max_sessions", 500)
+        event_loop.run_until_complete(sync_vlans_async(devices, session_obj, logger_poller, logger_orm,
+                                                       max_sessions, state, chunk_size))
+    else:
+        event_loop.run_until_complete(sync_vlans(executor, devices, session_obj, logger_poller,
+                                                 logger_orm, state, chunk_size))
+    if push_changes(config, executor, devices, logger_poller, state) and state.journal is not None:
+        save_journal(session_obj, logger_orm, state)
+    return record_cycle(config, devices, start, logger_poller)
+
+
+def record_cycle(config, devices, start, logger_poller):
+    """
+    Cycle metrics, and the metrics summary file
+    :param start: time.monotonic() at the start of the cycle
+    :return: cycle duration, seconds
+    """
+    duration = time.monotonic() - start
+    METRICS.inc("cycles")
+    METRICS.set_gauge("cycle_duration_seconds", duration)
+    METRICS.set_gauge("cycle_devices", len(devices))
+    metrics_file = config["poller"].get("metrics_file")
+    if metrics_file:
+        METRICS.write_summary(metrics_file)
+        logger_poller.debug("Metrics summary saved in %s", metrics_file)
+    return duration
+
+
+def push_changes(config, executor, devices, logger_poller, state):
+    """
+    Push the device changes of the cycle, one config set per device, with the poller executor
+    :return: PushResult list (etc/updater.py)
+    """
+    pushes, state.pushes = state.pushes, {}
+    push_mode = config["poller"].get("push_mode", PUSH_DRY_RUN)
+    if len(pushes) == 0 or push_mode == PUSH_OFF:
+        return []
+    results = update_vlans(executor, devices, pushes, logger_poller, state.pool, state.limiter,
+                           dry_run=push_mode == PUSH_DRY_RUN)
+    for result in results:
+        if result.vlans is not None:
+            # Verified VLANs, so the next poll does not see the pushed changes as changes in the device
+            device_changed(state, result.device, state.snapshots.get(result.device), result.vlans)
+            state.snapshots[result.device] = result.vlans
+    return results
+
+
+def login_limiter(poller_config):
+    """
+    LoginLimiter from the poller config, None if there is no login rate
+    """
+    if not (poller_config.get("login_rate") or poller_config.get("site_login_rate")):
+        return None
+    return LoginLimiter(poller_config.get("login_rate", 0), poller_config.get("login_burst", 1),
+                        poller_config.get("site_login_rate", 0), poller_config.get("site_login_burst", 1))
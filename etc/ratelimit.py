@@ -0,0 +1,155 @@
+import asyncio
+import random
+import threading
+import time
+
+DEFAULT_SITE = "default"
+
+
+class TokenBucket:
+    """
+    Token bucket: rate tokens per second, up to burst tokens. Tokens are reserved in order, so a caller gets the
+    time to wait for its token and waits outside the lock (time.sleep in threads, asyncio.sleep in coroutines)
+    """
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<TokenBucket(Rate={self.rate}, Burst={self.burst})>"
+
+    def reserve(self) -> float:
+        """
+        Take one token
+        :return: seconds to wait until the token is available
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class LoginLimiter:
+    """
+    Rate limit of new logins (SSH + AAA), global and per site (inventory "site" key), to not overload the
+    authentication servers. A rate of 0 means no limit
+    """
+    def __init__(self, rate=0, burst=1, site_rate=0, site_burst=1, clock=time.monotonic):
+        self.global_bucket = TokenBucket(rate, burst, clock) if rate else None
+        self.site_rate = site_rate
+        self.site_burst = site_burst
+        self.clock = clock
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def __repr__(self):
+        return f"<LoginLimiter(Global={self.global_bucket}, Site_rate={self.site_rate}, Sites={len(self.sites)}>"
+
+    def reserve(self, device: dict) -> float:
+        """
+        :return: seconds to wait before the login
+        """
+        wait = 0.0
+        if self.site_rate:
+            site = device.get("site", DEFAULT_SITE)
+            with self.lock:
+                bucket = self.sites.get(site)
+                if bucket is None:
+                    bucket = self.sites[site] = TokenBucket(self.site_rate, self.site_burst, self.clock)
+            wait = bucket.reserve()
+        if self.global_bucket is not None:
+            wait = max(wait, self.global_bucket.reserve())
+        with self.lock:
+            self.waited += wait
+        return wait
+
+    def acquire(self, device: dict):
+        wait = self.reserve(device)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, device: dict):
+        wait = self.reserve(device)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Per-device circuit breaker. After threshold consecutive failures (or one authentication failure, to not lock
+    the account) the device is not polled until its retry time, with exponential backoff between retries.
+    A success closes the breaker again
+    """
+    def __init__(self, logger, threshold=3, backoff=60, max_backoff=3600, auth_factor=4, clock=time.monotonic,
+                 seed=None):
+        """
+        :param logger: logging object
+        :param threshold: consecutive failures to open the breaker
+        :param backoff: seconds to wait after the breaker opens, doubled on every failed retry
+        :param max_backoff: maximum seconds to wait
+        :param auth_factor: backoff multiplier for authentication failures
+        :param clock: time function, seconds
+        :param seed: random seed, for testing
+        """
+        self.logger = logger
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.auth_factor = auth_factor
+        self.clock = clock
+        self.random = random.Random(seed)
+        # {device name: [consecutive failures, retry time, last reason]}
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<CircuitBreaker(Failing={len(self.failures)}, Open={len(self.open_devices())}>"
+
+    def allow(self, name: str) -> bool:
+        """
+        False while the device breaker is open
+        """
+        entry = self.failures.get(name)
+        return entry is None or self.clock() >= entry[1]
+
+    def record_success(self, name: str):
+        with self.lock:
+            entry = self.failures.pop(name, None)
+        if entry is not None and entry[0] >= self.threshold:
+            self.logger.info("Device %s - Circuit closed after %s failures", name, entry[0])
+
+    def record_failure(self, name: str, reason: str, auth=False) -> float:
+        """
+        :return: retry time, 0 if the breaker is still closed
+        """
+        with self.lock:
+            entry = self.failures.setdefault(name, [0, 0.0, ""])
+            entry[0] += 1
+            if auth:
+                entry[0] = max(entry[0], self.threshold)
+            entry[2] = reason
+            if entry[0] < self.threshold:
+                return 0.0
+            backoff = min(self.max_backoff, self.backoff * 2 ** (entry[0] - self.threshold))
+            if auth:
+                backoff = min(self.max_backoff, backoff * self.auth_factor)
+            entry[1] = self.clock() + backoff * self.random.uniform(0.9, 1.1)
+            failures, retry_at = entry[0], entry[1]
+        self.logger.info("Device %s - Circuit open after %s failures (%s), retry in %.0f seconds",
+                         name, failures, reason, retry_at - self.clock())
+        return retry_at
+
+    def open_devices(self) -> list:
+        """
+        [(device name, consecutive failures, retry time, last reason)] of the devices not allowed now
+        """
+        now = self.clock()
+        return [(name, entry[0], entry[1], entry[2]) for name, entry in list(self.failures.items())
+                if now < entry[1]]
@@ -0,0 +1,152 @@
+import collections
+import heapq
+import random
+import time
+from typing import NamedTuple, Optional
+
+DEFAULT_GROUP = "default"
+DEFAULT_JITTER = 0.1
+# Interval factors after a poll: faster when the VLANs changed, slower when not
+CHANGED_FACTOR = 0.5
+UNCHANGED_FACTOR = 1.5
+DECISIONS_KEPT = 1000
+
+
+class ScheduleDecision(NamedTuple):
+    """
+    Why and when a device is polled again
+    """
+    device: str
+    group: str
+    changed: bool
+    interval: float
+    next_poll: float
+
+
+class PollScheduler:
+    """
+    Per-device poll times in a priority queue (heap by next poll time). The interval of each device adapts to how
+    often its VLANs change: shorter after a change, longer while nothing changes, always within the min/max
+    interval of the device group. A random jitter spreads the sessions, so devices are not polled all at once
+    """
+    def __init__(self, groups: dict, logger, jitter=DEFAULT_JITTER, clock=time.monotonic, seed=None):
+        """
+        :param groups: {group: {"min_interval": seconds, "max_interval": seconds}}, must include "default"
+        :param logger: logging object
+        :param jitter: random +/- fraction of the interval
+        :param clock: time function, seconds
+        :param seed: random seed, for testing
+        """
+        self.groups = groups
+        self.logger = logger
+        self.jitter = jitter
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.queue = []
+        self.devices = {}
+        self.intervals = {}
+        self.recent = collections.deque(maxlen=DECISIONS_KEPT)
+
+    def __repr__(self):
+        return f"<PollScheduler(Devices={len(self.devices)}, Groups={list(self.groups)}, Jitter={self.jitter}>"
+
+    def limits(self, group: str) -> tuple:
+        limits = self.groups.get(group) or self.groups[DEFAULT_GROUP]
+        return limits["min_interval"], limits["max_interval"]
+
+    def add_devices(self, devices: list):
+        """
+        Schedule new devices. The first poll is spread randomly within the jitter of the group min interval
+        """
+        now = self.clock()
+        for device in devices:
+            name = device["name"]
+            if name in self.devices:
+                self.devices[name] = device
+                continue
+            self.devices[name] = device
+            min_interval, _ = self.limits(device.get("group", DEFAULT_GROUP))
+            self.intervals[name] = min_interval
+            heapq.heappush(self.queue, (now + self.random.uniform(0, min_interval * self.jitter), name))
+
+    def remove_device(self, name: str):
+        """
+        The device is dropped from the queue when it is due
+        """
+        self.devices.pop(name, None)
+        self.intervals.pop(name, None)
+
+    def due(self) -> list:
+        """
+        Devices to poll now, most overdue first
+        """
+        now = self.clock()
+        devices = []
+        while self.queue and self.queue[0][0] <= now:
+            _, name = heapq.heappop(self.queue)
+            if name in self.devices:
+                devices.append(self.devices[name])
+        return devices
+
+    def next_poll(self) -> Optional[float]:
+        """
+        Time of the next due device, None if there are no devices
+        """
+        return self.queue[0][0] if self.queue else None
+
+    def wait_time(self, idle: float) -> float:
+        """
+        Seconds until the next due device
+        :param idle: seconds to wait if there are no devices (empty inventory or shard)
+        """
+        next_poll = self.next_poll()
+        if next_poll is None:
+            return idle
+        return max(0.0, next_poll - self.clock())
+
+    def record(self, name: str, changed: bool) -> ScheduleDecision:
+        """
+        Reschedule a polled device
+        :param name: device name
+        :param changed: the device VLANs changed in this poll
+        :return: the decision
+        """
+        device = self.devices.get(name)
+        if device is None:
+            return None
+        group = device.get("group", DEFAULT_GROUP)
+        min_interval, max_interval = self.limits(group)
+        factor = CHANGED_FACTOR if changed else UNCHANGED_FACTOR
+        interval = min(max_interval, max(min_interval, self.intervals[name] * factor))
+        self.intervals[name] = interval
+        next_poll = self.clock() + interval * (1 + self.random.uniform(-self.jitter, self.jitter))
+        heapq.heappush(self.queue, (next_poll, name))
+        decision = ScheduleDecision(name, group, changed, interval, next_poll)
+        self.recent.append(decision)
+        self.logger.debug("Schedule %s", decision)
+        return decision
+
+    def decisions(self) -> list:
+        """
+        Last decisions, oldest first
+        """
+        return list(self.recent)
+
+    def schedule(self) -> list:
+        """
+        Upcoming polls: [(next_poll, device, group, interval)] in poll order
+        """
+        return [(next_poll, name, self.devices[name].get("group", DEFAULT_GROUP), self.intervals[name])
+                for next_poll, name in sorted(self.queue) if name in self.devices]
+
+
+def scheduler_groups(config: dict, sync_time: int, polling_time: int = None) -> dict:
+    """
+    Groups from the scheduler config. Without config, the default group polls every sync_time
+    :param polling_time: fixed interval of the default group (-p/--polling_time), replacing its config
+    """
+    groups = dict(config.get("groups") or {})
+    if polling_time:
+        groups[DEFAULT_GROUP] = {"min_interval": polling_time, "max_interval": polling_time}
+    groups.setdefault(DEFAULT_GROUP, {"min_interval": sync_time, "max_interval": sync_time})
+    return groups
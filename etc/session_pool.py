@@ -0,0 +1,123 @@
+import threading
+import time
+from netmiko import ConnectHandler
+from etc.device_ops import netmiko_params
+from etc.metrics import METRICS, STAGE_CONNECT
+
+DEFAULT_KEEPALIVE = 30
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+class SessionPool:
+    """
+    Keep one Netmiko session per device alive between poll cycles (daemon mode), so the SSH handshake and
+    the AAA login are done once and not in every cycle
+    """
+    def __init__(self, logger, keepalive=DEFAULT_KEEPALIVE, idle_timeout=DEFAULT_IDLE_TIMEOUT, limiter=None):
+        """
+        :param limiter: LoginLimiter, only the new sessions wait for it
+        """
+        self.logger = logger
+        self.limiter = limiter
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<SessionPool(Sessions={len(self.sessions)}, Keepalive={self.keepalive}, " \
+               f"Idle_timeout={self.idle_timeout}>"
+
+    def connect(self, device):
+        """
+        New session. The SSH keepalive keeps the session up between cycles
+        """
+        params = netmiko_params(device)
+        params.setdefault("keepalive", self.keepalive)
+        if self.limiter is not None:
+            self.limiter.acquire(device)
+        with METRICS.timer(STAGE_CONNECT, device["name"]):
+            conn = ConnectHandler(**params)
+        self.logger.info("Device %s - New session", device['name'])
+        return conn
+
+    def get(self, device):
+        """
+        Get the device session, reconnecting if it is not alive anymore
+        :param device: device info
+        :return: Netmiko connection
+        """
+        name = device["name"]
+        with self.lock:
+            entry = self.sessions.pop(name, None)
+        if entry is not None:
+            conn = entry[0]
+            if conn.is_alive():
+                self._store(name, conn)
+                return conn
+            self.logger.info("Device %s - Session not alive, reconnecting", name)
+            self._disconnect(name, conn)
+        conn = self.connect(device)
+        self._store(name, conn)
+        return conn
+
+    def send_command(self, device, command):
+        """
+        Send command in the pooled session. If the session drops, reconnect and retry once
+        """
+        return self.send_commands(device, (command,))[command]
+
+    def send_commands(self, device, commands) -> dict:
+        """
+        Send the commands back to back in the pooled session. If the session drops, reconnect and retry them once
+        :return: {command: output}, in commands order
+        """
+        return self.run(device, lambda conn: {command: conn.send_command(command) for command in commands})
+
+    def run(self, device, function):
+        """
+        Call function(conn) with the pooled session. If the session drops, reconnect and call it again once
+        """
+        try:
+            return function(self.get(device))
+        except (OSError, EOFError) as e:
+            self.logger.info("Device %s - Session dropped %r, reconnecting", device['name'], e)
+            self.discard(device["name"])
+            return function(self.get(device))
+
+    def discard(self, name):
+        """
+        Close and forget the device session
+        """
+        with self.lock:
+            entry = self.sessions.pop(name, None)
+        if entry is not None:
+            self._disconnect(name, entry[0])
+
+    def evict_idle(self):
+        """
+        Close the sessions not used in idle_timeout seconds (i.e. devices removed from the inventory)
+        """
+        limit = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [name for name, (_, last_used) in self.sessions.items() if last_used < limit]
+        for name in idle:
+            self.logger.info("Device %s - Session idle, closing", name)
+            self.discard(name)
+        return len(idle)
+
+    def close_all(self):
+        with self.lock:
+            names = list(self.sessions)
+        for name in names:
+            self.discard(name)
+
+    def _store(self, name, conn):
+        with self.lock:
+            self.sessions[name] = (conn, time.monotonic())
+
+    def _disconnect(self, name, conn):
+        try:
+            conn.disconnect()
+        except Exception as e:
+            self.logger.debug("Device %s - Error closing session %r", name, e)
@@ -0,0 +1,447 @@
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+from typing import NamedTuple
+
+from etc.metrics import METRICS
+from etc.vlanset import VlanSet
+
+# Points of each shard on the hash ring. More points, more even shards
+DEFAULT_REPLICAS = 128
+# Seconds for a shard to return its devices of a cycle, then it is replaced
+DEFAULT_SHARD_TIMEOUT = 900
+# Seconds between checks of the shard processes while waiting for their results
+RESULT_WAIT = 1.0
+
+
+def ring_hash(key: str) -> int:
+    """
+    64-bit position on the ring, the same in every process and host (not hash(), which is salted per process)
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of the device names over the shards: every shard has `replicas` points on a ring of 64-bit
+    hashes, and a device belongs to the shard of the first point after the device hash. A shard joining or leaving
+    only moves the devices of its ring segments, about 1/N of the fleet
+    """
+    def __init__(self, shards=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.shards = set()
+        # Sorted point hashes, and the shard of each point
+        self.points = []
+        self.owners = []
+        for shard in shards:
+            self.add(shard)
+
+    def __repr__(self):
+        return f"<HashRing(Shards={sorted(self.shards)}, Replicas={self.replicas}>"
+
+    def __len__(self):
+        return len(self.shards)
+
+    def _build(self, ring):
+        ring.sort()
+        self.points = [point for point, _ in ring]
+        self.owners = [shard for _, shard in ring]
+
+    def add(self, shard: str):
+        if shard in self.shards:
+            return
+        self.shards.add(shard)
+        self._build(list(zip(self.points, self.owners)) +
+                    [(ring_hash(f"{shard}#{replica}"), shard) for replica in range(self.replicas)])
+
+    def remove(self, shard: str):
+        if shard not in self.shards:
+            return
+        self.shards.discard(shard)
+        self._build([(point, owner) for point, owner in zip(self.points, self.owners) if owner != shard])
+
+    def shard_of(self, name: str) -> str:
+        if not self.points:
+            raise ValueError("No shards in the ring")
+        return self.owners[bisect.bisect(self.points, ring_hash(name)) % len(self.points)]
+
+    def assign(self, devices: list) -> dict:
+        """
+        :return: {shard: devices}, in the order of the devices
+        """
+        shards = {}
+        for device in devices:
+            shards.setdefault(self.shard_of(device["name"]), []).append(device)
+        return shards
+
+    def devices_of(self, shard: str, devices: list) -> list:
+        return [device for device in devices if self.shard_of(device["name"]) == shard]
+
+
+class ShardTask(NamedTuple):
+    """
+    Devices of one shard in one cycle
+    """
+    task_id: int
+    # VlanSet.to_bytes() of the DB VLANs, loaded once by the coordinator
+    vlans_db: bytes
+    devices: list
+    # {device name: VlanSet.to_bytes()} previous VLANs of the devices new to the shard
+    snapshots: dict
+    # Devices moved to other shards: their state in the shard is dropped
+    dropped: list
+
+
+class ShardResult(NamedTuple):
+    """
+    Poll of a ShardTask, to merge in the DB
+    """
+    shard: str
+    task_id: int
+    # VlanOperation list for the DB
+    db_changes: list
+    # {device name: VlanSet.to_bytes()} devices with new VLANs (polled or pushed)
+    vlans: dict
+    pushed: int
+    seconds: float
+    error: str = None
+    # {device name: DeviceRecord} collection plan data of the polled devices
+    records: dict = None
+
+
+def shard_config(config: dict, shard: str, shards: int) -> dict:
+    """
+    Config of a shard process: its own log files, and its part of the login rates, so all the shards together
+    keep the configured rates
+    """
+    poller = dict(config["poller"])
+    for key in ("logging_file", "logging_json_file"):
+        if poller.get(key):
+            root, extension = os.path.splitext(poller[key])
+            poller[key] = f"{root}.{shard}{extension}"
+    for key in ("login_rate", "site_login_rate"):
+        if poller.get(key):
+            poller[key] = poller[key] / shards
+    return dict(config, poller=poller)
+
+
+def shard_worker(shard, config, shards, tasks, results, keep_sessions=False, initializer=None, initargs=()):
+    """
+    Poll loop of a shard process: it keeps its sessions, circuit breaker, login limiter, output cache and the
+    previous VLANs of its devices between cycles. The DB is only written by the coordinator
+    :param shards: number of shards, for the login rates
+    :param tasks: queue of ShardTask, None to stop
+    :param results: queue of ShardResult
+    :param keep_sessions: SessionPool (daemon mode)
+    :param initializer: called with initargs when the process starts, like multiprocessing.Pool
+    """
+    import concurrent.futures
+    from etc.collection import CollectionPlan
+    from etc.fingerprint import FingerprintCache
+    from etc.logger_svc import CustomLogger
+    from etc.poller import PollerState, login_limiter
+    from etc.ratelimit import CircuitBreaker
+    from etc.session_pool import SessionPool
+
+    if initializer is not None:
+        initializer(*initargs)
+    config = shard_config(config, shard, shards)
+    poller_config = config["poller"]
+    logger = CustomLogger(f"shard.{shard}", poller_config)
+    state = PollerState(limiter=login_limiter(poller_config),
+                        breaker=CircuitBreaker(logger, poller_config.get("breaker_failures", 3),
+                                               poller_config.get("backoff_base", 60),
+                                               poller_config.get("backoff_max", 3600)),
+                        plan=CollectionPlan.from_config(poller_config), stream=poller_config.get("stream_parse", False))
+    if poller_config.get("change_cache", True):
+        # In memory: the cache of the shard devices lives as long as the shard
+        state.cache = FingerprintCache()
+    if keep_sessions:
+        state.pool = SessionPool(logger, poller_config.get("session_keepalive", 30),
+                                 poller_config.get("session_idle_timeout", 300), state.limiter)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=poller_config.get("workers", 4))
+    logger.info("Shard %s started, pid %s", shard, os.getpid())
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            start = time.monotonic()
+            try:
+                results.put(poll_shard(shard, task, config, executor, logger, state))
+            except Exception as e:
+                logger.error("Shard %s task %s failed %r", shard, task.task_id, e)
+                results.put(ShardResult(shard, task.task_id, [], {}, 0, time.monotonic() - start, repr(e)))
+            if state.pool is not None:
+                state.pool.evict_idle()
+    finally:
+        if state.pool is not None:
+            state.pool.close_all()
+        executor.shutdown()
+
+
+def poll_shard(shard, task, config, executor, logger, state) -> ShardResult:
+    """
+    Poll the devices of the task, and push their device changes. Like poller.run_cycle() without the DB
+    """
+    from etc.poller import cycle_db_changes, pollable_devices, push_changes, sync_device
+
+    start = time.monotonic()
+    for name in task.dropped:
+        state.snapshots.pop(name, None)
+        if state.cache is not None:
+            state.cache.invalidate(name)
+    state.snapshots.update((name, VlanSet.from_bytes(data)) for name, data in task.snapshots.items())
+    vlans_db = VlanSet.from_bytes(task.vlans_db)
+    if state.cache is not None:
+        state.cache.begin_cycle(vlans_db.digest())
+    devices = pollable_devices(task.devices, logger, state)
+    futures = [executor.submit(sync_device, vlans_db, device, None, logger, logger, state) for device in devices]
+    db_changes = cycle_db_changes(devices, [future.exception() or future.result() for future in futures], logger)
+    pushed = push_changes(config, executor, devices, logger, state)
+    changed = {device["name"] for device in task.devices if state.changed.pop(device["name"], False)}
+    changed.update(result.device for result in pushed if result.vlans is not None)
+    logger.info("Shard %s polled %s devices, %s changed", shard, len(devices), len(changed))
+    # Kept by the coordinator only
+    records = {device["name"]: state.records.pop(device["name"]) for device in devices
+               if device["name"] in state.records}
+    return ShardResult(shard, task.task_id, db_changes, {name: state.snapshots[name].to_bytes() for name in changed},
+                       len(pushed), time.monotonic() - start, records=records)
+
+
+class ShardCoordinator:
+    """
+    Local shards: one worker process per shard (shard_worker), the devices assigned by consistent hashing of their
+    name. Every cycle the coordinator loads the DB VLANs once, sends each shard its devices, and merges the results
+    of all the shards in the DB (with the DB writer) and the journal. A shard that dies or times out is removed
+    and a new one takes its place. The devices of a dead shard are polled again in the same cycle
+    """
+    def __init__(self, config, session_obj, logger_poller, logger_orm, state, keep_sessions=False, initializer=None,
+                 initargs=(), start_method="spawn"):
+        """
+        :param state: PollerState of the coordinator: previous VLANs of every device (to send them to the shards
+            and journal the changes), DB writer and journal
+        :param keep_sessions: shards keep their device sessions open between cycles (daemon mode)
+        :param start_method: multiprocessing start method. "spawn" does not copy the threads of this process
+        """
+        sharding = config.get("sharding") or {}
+        self.config = config
+        self.session_obj = session_obj
+        self.logger_poller = logger_poller
+        self.logger_orm = logger_orm
+        self.state = state
+        self.keep_sessions = keep_sessions
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = sharding.get("timeout", DEFAULT_SHARD_TIMEOUT)
+        # The login rates are split in this many parts, one per shard
+        self.rate_shares = max(1, sharding.get("processes", 1))
+        self.ring = HashRing(replicas=sharding.get("replicas", DEFAULT_REPLICAS))
+        self.context = multiprocessing.get_context(start_method)
+        self.results = self.context.Queue()
+        # {shard: (process, task queue)}
+        self.processes = {}
+        # Shards kept running, the removed ones are replaced
+        self.size = 0
+        # {shard: device names with their previous VLANs in the shard}
+        self.assigned = {}
+        # {shard: device names moved to other shards}, sent with the next task of the shard
+        self.dropped = {}
+        self.shard_names = (f"shard{index}" for index in itertools.count())
+        self.task_ids = itertools.count(1)
+
+    def __repr__(self):
+        return f"<ShardCoordinator(Shards={sorted(self.processes)}, Ring={self.ring}>"
+
+    def start(self, shards: int):
+        self.size = shards
+        for _ in range(shards):
+            self.add_shard()
+
+    def replace_shards(self):
+        """
+        Start new shards in place of the removed ones
+        """
+        while len(self.processes) < self.size:
+            shard = self.add_shard()
+            METRICS.inc("shard_replaced")
+            self.logger_poller.info("Shard %s replaces a removed shard", shard)
+
+    def add_shard(self, shard: str = None) -> str:
+        """
+        Start a shard process. It takes its ring segments from the other shards
+        """
+        shard = shard or next(self.shard_names)
+        tasks = self.context.Queue()
+        process = self.context.Process(target=shard_worker, name=shard, daemon=True,
+                                       args=(shard, self.config, self.rate_shares, tasks, self.results,
+                                             self.keep_sessions, self.initializer, self.initargs))
+        process.start()
+        self.processes[shard] = (process, tasks)
+        self.assigned[shard] = set()
+        self.dropped[shard] = []
+        self.ring.add(shard)
+        self.rebalance()
+        self.logger_poller.info("Shard %s joined, pid %s. %s", shard, process.pid, self.ring)
+        return shard
+
+    def remove_shard(self, shard: str, stop=True):
+        """
+        Stop a shard process. Its devices go to the other shards
+        :param stop: ask the shard to finish, else terminate it (dead or not responding)
+        """
+        process, tasks = self.processes.pop(shard)
+        self.assigned.pop(shard)
+        self.dropped.pop(shard)
+        self.ring.remove(shard)
+        if stop and process.is_alive():
+            tasks.put(None)
+            process.join(self.timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        METRICS.inc("shard_removed")
+        self.logger_poller.info("Shard %s left. %s", shard, self.ring)
+
+    def rebalance(self):
+        """
+        After a shard joined: the devices that moved to it are dropped by their old shards with their next task.
+        When a shard leaves, its devices are new to their next shards, which get their previous VLANs with them
+        """
+        for shard, assigned in self.assigned.items():
+            moved = [name for name in assigned if self.ring.shard_of(name) != shard]
+            assigned.difference_update(moved)
+            self.dropped[shard].extend(moved)
+            if moved:
+                self.logger_poller.info("Shard %s: %s devices moved to other shards", shard, len(moved))
+
+    def stop(self):
+        for shard in list(self.processes):
+            self.remove_shard(shard)
+
+    def dispatch(self, devices, vlans_db: bytes) -> dict:
+        """
+        Send every shard its devices, with the previous VLANs of the devices new to it
+        :return: {task id: (shard, devices)}
+        """
+        pending = {}
+        for shard, shard_devices in self.ring.assign(devices).items():
+            assigned = self.assigned[shard]
+            dropped, self.dropped[shard] = self.dropped[shard], []
+            names = [device["name"] for device in shard_devices if device["name"] not in assigned]
+            snapshots = {name: self.state.snapshots[name].to_bytes() for name in names if name in self.state.snapshots}
+            assigned.update(names)
+            task = ShardTask(next(self.task_ids), vlans_db, shard_devices, snapshots, dropped)
+            self.processes[shard][1].put(task)
+            pending[task.task_id] = (shard, shard_devices)
+            METRICS.set_gauge("shard_devices", len(shard_devices), shard=shard)
+        return pending
+
+    def collect(self, pending: dict, vlans_db: bytes, deadline: float) -> list:
+        """
+        Results of the pending tasks. A dead or late shard is replaced. The devices of a dead shard are sent to the
+        shards again, the devices of a late shard are polled in the next cycle
+        :return: ShardResult list
+        """
+        results = []
+        while pending:
+            try:
+                result = self.results.get(timeout=RESULT_WAIT)
+            except queue.Empty:
+                late = time.monotonic() > deadline
+                failed = {shard for shard, _ in pending.values() if late or not self.processes[shard][0].is_alive()}
+                for shard in failed:
+                    task_ids = [task_id for task_id, (owner, _) in pending.items() if owner == shard]
+                    orphans = [device for task_id in task_ids for device in pending.pop(task_id)[1]]
+                    METRICS.inc("errors", stage="shard", reason="timeout" if late else "exited")
+                    self.remove_shard(shard, stop=False)
+                    self.replace_shards()
+                    if late:
+                        self.logger_poller.error("Shard %s timed out, %s devices not polled", shard, len(orphans))
+                    else:
+                        self.logger_poller.error("Shard %s exited, %s devices sent again", shard, len(orphans))
+                        pending.update(self.dispatch(orphans, vlans_db))
+                continue
+            # Results of removed shards are ignored, their devices were sent to other shards
+            if pending.pop(result.task_id, None) is None:
+                continue
+            if result.error:
+                self.logger_poller.error("Shard %s failed %s", result.shard, result.error)
+                METRICS.inc("errors", stage="shard", reason="exception")
+            results.append(result)
+        return results
+
+    def merge(self, results, devices) -> bool:
+        """
+        Apply the DB changes and the new device VLANs of all the shards, like poller.finish_cycle()
+        :param devices: devices of the cycle
+        :return: False if the DB writes failed
+        """
+        from etc.collection import mark_saved, unsaved_rows
+        from etc.db_ops import apply_vlan_changes, save_device_records, save_device_vlans
+        from etc.poller import device_changed, save_journal, submit_write, writes_failed
+
+        state = self.state
+        db_changes = [operation for result in results for operation in result.db_changes]
+        changed = {}
+        for result in results:
+            changed.update(result.vlans)
+            state.records.update(result.records or {})
+            self.logger_poller.info("Shard %s: %s DB changes, %s devices changed, %s pushed in %.1f seconds",
+                                    result.shard, len(result.db_changes), len(result.vlans), result.pushed,
+                                    result.seconds)
+        for name, data in changed.items():
+            vlans = VlanSet.from_bytes(data)
+            device_changed(state, name, state.snapshots.get(name), vlans)
+            state.snapshots[name] = vlans
+            state.changed[name] = True
+        chunk_size = self.config["db_orm"].get("write_chunk_size", 0)
+        writes = [submit_write(state, self.session_obj, self.logger_orm, apply_vlan_changes, db_changes, chunk_size)
+                  if db_changes else None,
+                  submit_write(state, self.session_obj, self.logger_orm, save_device_vlans,
+                               {name: state.snapshots[name].items() for name in changed})]
+        records = unsaved_rows(state.records, [name for result in results for name in result.records or {}])
+        if records:
+            writes.append(submit_write(state, self.session_obj, self.logger_orm, save_device_records, records))
+        try:
+            for write in writes:
+                if write is not None:
+                    write.result()
+        except Exception as e:
+            names = {device["name"] for device in devices}
+            writes_failed(e, names, self.logger_poller, state)
+            # The shards drop their VLANs and fingerprints of the devices, and get the restored VLANs again
+            for shard, assigned in self.assigned.items():
+                moved = assigned & names
+                assigned.difference_update(moved)
+                self.dropped[shard].extend(moved)
+            return False
+        mark_saved(state.records, records)
+        if state.journal is not None:
+            state.journal.db_changes(db_changes)
+            save_journal(self.session_obj, self.logger_orm, state)
+        return True
+
+    def run_cycle(self, devices) -> float:
+        """
+        One poll and sync pass over the devices, in the shards
+        :return: cycle duration, seconds
+        """
+        from etc.poller import load_db_vlans, record_cycle
+
+        start = time.monotonic()
+        for shard, (process, _) in list(self.processes.items()):
+            if not process.is_alive():
+                self.logger_poller.error("Shard %s exited with code %s", shard, process.exitcode)
+                self.remove_shard(shard, stop=False)
+        self.replace_shards()
+        if len(self.ring) == 0:
+            raise RuntimeError("No shards left")
+        vlans_db = load_db_vlans(self.session_obj, self.logger_orm, self.state).to_bytes()
+        results = self.collect(self.dispatch(devices, vlans_db), vlans_db, start + self.timeout)
+        self.merge(results, devices)
+        return record_cycle(self.config, devices, start, self.logger_poller)
@@ -1,4 +1,162 @@
-def update_vlans(vlans_difference_result, logger_poller, logger_orm):
-    for item in vlans_difference_result:
-        # TODO go item by item and update device or DB accordingly to the record
-        pass
+import concurrent.futures
+from typing import NamedTuple
+from netmiko import ConnectHandler
+from etc.device_ops import DeviceError, device_errors, netmiko_params, parse_output
+from etc.diff import OP_REMOVE
+from etc.metrics import METRICS, STAGE_CONNECT, STAGE_DEVICE_UPDATE
+from etc.parsers import vlan_command
+from etc.vlanset import VlanSet
+
+# poller.push_mode: push the device changes, only log the config sets, or nothing
+PUSH_APPLY = "apply"
+PUSH_DRY_RUN = "dry_run"
+PUSH_OFF = "off"
+
+# Config set renderers, by device_type
+RENDERERS = {}
+
+
+class PushResult(NamedTuple):
+    """
+    Config push to one device
+    """
+    device: str
+    commands: list
+    # The config set was sent to the device
+    applied: bool
+    # VlanOperation not found on the device after the push (or not pushed)
+    mismatches: list
+    # Device VLANs after the push, None if not verified
+    vlans: VlanSet
+    error: str = None
+
+
+def register_renderer(*device_types: str):
+    """
+    Decorator to add a config set renderer to the registry
+    """
+    def decorator(function):
+        for device_type in device_types:
+            RENDERERS[device_type] = function
+        return function
+    return decorator
+
+
+@register_renderer("cisco_ios", "cisco_nxos", "arista_eos")
+def render_cisco(operations: list) -> list:
+    """
+    :param operations: VlanOperation list, one per VLAN
+    :return: config set, "vlan X / name Y / exit" for add and rename, "no vlan X" for remove
+    """
+    commands = []
+    for operation in operations:
+        if operation.operation_type == OP_REMOVE:
+            commands.append(f"no vlan {operation.vlan_id}")
+        else:
+            commands.extend((f"vlan {operation.vlan_id}", f"name {operation.vlan_name}", "exit"))
+    return commands
+
+
+def latest_operations(operations: list) -> list:
+    """
+    Last operation of each VLAN, in VLAN order
+    """
+    latest = {}
+    for operation in operations:
+        latest[int(operation.vlan_id)] = operation
+    return [latest[vlan_id] for vlan_id in sorted(latest)]
+
+
+def render_config_set(device_type: str, operations: list) -> list:
+    """
+    :return: config set of all the device changes, None if there is no renderer for the device type
+    """
+    renderer = RENDERERS.get(device_type)
+    return renderer(latest_operations(operations)) if renderer else None
+
+
+def verify(vlans: VlanSet, operations: list) -> list:
+    """
+    :param vlans: device VLANs after the push
+    :return: operations not applied
+    """
+    mismatches = []
+    for operation in latest_operations(operations):
+        vlan_id = int(operation.vlan_id)
+        if operation.operation_type == OP_REMOVE:
+            if vlan_id in vlans:
+                mismatches.append(operation)
+        elif vlans.name(vlan_id) != operation.vlan_name:
+            mismatches.append(operation)
+    return mismatches
+
+
+def push_device(device: dict, operations: list, logger_poller, pool=None, limiter=None, dry_run=False) -> PushResult:
+    """
+    Send all the changes of the device in one config set, and verify them with one "show vlan", in one session
+    :param device: device info
+    :param operations: VlanOperation list with target "device" (etc/diff.py)
+    :param pool: SessionPool (daemon mode), None for a new session
+    :param limiter: LoginLimiter for the new session
+    :param dry_run: only log the config set, without connecting
+    :raise DeviceError: if the device is not reachable or the login fails
+    """
+    name = device["name"]
+    device_type = device["device_type"]
+    commands = render_config_set(device_type, operations)
+    if commands is None:
+        logger_poller.info("Push not implemented for device_type %s, device %s", device_type, name)
+        return PushResult(name, [], False, latest_operations(operations), None)
+    if dry_run:
+        logger_poller.info("Device %s - Dry run, config set:\n%s", name, "\n".join(commands))
+        METRICS.inc("pushes", result="dry_run")
+        return PushResult(name, commands, False, [], None)
+
+    command = vlan_command(device_type)
+    with METRICS.timer(STAGE_DEVICE_UPDATE, name), device_errors(name, logger_poller):
+        if pool is not None:
+            output = _send(pool.get(device), commands, command)
+        else:
+            if limiter is not None:
+                limiter.acquire(device)
+            with METRICS.timer(STAGE_CONNECT, name):
+                conn = ConnectHandler(**netmiko_params(device))
+            with conn:
+                output = _send(conn, commands, command)
+    vlans = VlanSet.from_parsed(parse_output(device, command, output, logger_poller))
+    mismatches = verify(vlans, operations)
+    if mismatches:
+        METRICS.inc("pushes", result="mismatch")
+        logger_poller.error("Device %s - Pushed %s commands, not applied %s", name, len(commands), mismatches)
+    else:
+        METRICS.inc("pushes", result="verified")
+        logger_poller.info("Device %s updated, %s changes verified", name, len(latest_operations(operations)))
+    return PushResult(name, commands, True, mismatches, vlans)
+
+
+def _send(conn, commands, command):
+    conn.send_config_set(commands)
+    return conn.send_command(command)
+
+
+def update_vlans(executor, devices, pushes: dict, logger_poller, pool=None, limiter=None, dry_run=False) -> list:
+    """
+    Push the pending changes of the devices, one session per device, in the poller executor
+    :param executor: concurrent.futures executor of the poller (workers)
+    :param devices: inventory devices
+    :param pushes: {device name: VlanOperation list}
+    :return: PushResult list
+    """
+    by_name = {device["name"]: device for device in devices}
+    futures = {executor.submit(push_device, by_name[name], operations, logger_poller, pool, limiter, dry_run): name
+               for name, operations in pushes.items() if name in by_name}
+    results = []
+    for future in concurrent.futures.as_completed(futures):
+        name = futures[future]
+        try:
+            results.append(future.result())
+        except DeviceError as e:
+            METRICS.inc("pushes", result="error")
+            logger_poller.error("Push failed: %s", e)
+            results.append(PushResult(name, [], False, latest_operations(pushes[name]), None, e.reason))
+    return results
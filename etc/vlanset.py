@@ -0,0 +1,212 @@
+import hashlib
+import re
+import sys
+import zlib
+
+VLAN_ID_BITS = 4096
+# Up to this number of removed ids, project() deletes them from a copy of the names instead of rebuilding them
+PROJECT_DELETE_LIMIT = 32
+# Up to this number of lookups, select_bit() is faster than listing all the ids with bit_ids()
+SELECT_LIMIT = 4
+ONE_BIT = re.compile("1")
+
+if hasattr(int, "bit_count"):
+    # Python 3.10+
+    popcount = int.bit_count
+else:
+    def popcount(bits: int) -> int:
+        return bin(bits).count("1")
+
+
+class VlanRecord:
+    """
+    One VLAN, with the name interned so the same name is one object in the whole fleet
+    """
+    __slots__ = ("vlan_id", "vlan_name")
+
+    def __init__(self, vlan_id: int, vlan_name: str):
+        self.vlan_id = vlan_id
+        self.vlan_name = sys.intern(vlan_name or "")
+
+    def __repr__(self):
+        return f"<VlanRecord(vlan_id={self.vlan_id}, vlan_name={self.vlan_name})>"
+
+    def __eq__(self, other):
+        return isinstance(other, VlanRecord) and (self.vlan_id, self.vlan_name) == (other.vlan_id, other.vlan_name)
+
+
+class VlanSet:
+    """
+    Compact and immutable set of VLANs of one device (or the DB): the ids are a 4096-bit bitmap (Python int),
+    and the names a tuple of interned strings in ascending id order. Union, difference, intersection and
+    symmetric difference are bit operations
+    """
+    __slots__ = ("bits", "names")
+
+    def __init__(self, bits: int = 0, names: tuple = ()):
+        self.bits = bits
+        self.names = names
+
+    def __repr__(self):
+        return f"<VlanSet(Vlans={len(self)})>"
+
+    @classmethod
+    def from_items(cls, items) -> "VlanSet":
+        """
+        From (vlan_id, vlan_name) pairs. If a vlan_id is repeated the first one wins
+        """
+        index = {}
+        for vlan_id, vlan_name in items:
+            vlan_id = int(vlan_id)
+            if not 0 <= vlan_id < VLAN_ID_BITS:
+                raise ValueError(f"VLAN id {vlan_id} out of range")
+            index.setdefault(vlan_id, vlan_name)
+        bits = 0
+        for vlan_id in index:
+            bits |= 1 << vlan_id
+        return cls(bits, tuple(sys.intern(index[vlan_id] or "") for vlan_id in sorted(index)))
+
+    @classmethod
+    def from_parsed(cls, parsed: list) -> "VlanSet":
+        """
+        From the parsed output, list of {"vlan_id": x, "vlan_name": y}
+        """
+        return cls.from_items((vlan["vlan_id"], vlan["vlan_name"]) for vlan in parsed)
+
+    @classmethod
+    def from_db(cls, vlans_db) -> "VlanSet":
+        """
+        From VlanDb objects (query_all_vlan())
+        """
+        return cls.from_items((vlan.id, vlan.name) for vlan in vlans_db)
+
+    @classmethod
+    def from_ids(cls, vlan_ids) -> "VlanSet":
+        """
+        Without names, i.e. the reserved VLANs mask
+        """
+        return cls.from_items((vlan_id, "") for vlan_id in vlan_ids)
+
+    def rank(self, vlan_id: int) -> int:
+        """
+        Position of the vlan_id in names
+        """
+        return popcount(self.bits & ((1 << vlan_id) - 1))
+
+    def name(self, vlan_id: int) -> str:
+        """
+        :return: VLAN name or None if the vlan_id is not in the set
+        """
+        if vlan_id not in self:
+            return None
+        return self.names[self.rank(vlan_id)]
+
+    def ids(self) -> list:
+        return bit_ids(self.bits)
+
+    def items(self):
+        return zip(bit_ids(self.bits), self.names)
+
+    def records(self) -> list:
+        return [VlanRecord(vlan_id, vlan_name) for vlan_id, vlan_name in self.items()]
+
+    def to_index(self) -> dict:
+        """
+        {vlan_id: vlan_name} with str ids, like etc.diff.index_device_vlans()
+        """
+        return {str(vlan_id): vlan_name for vlan_id, vlan_name in self.items()}
+
+    def project(self, mask: int) -> tuple:
+        """
+        Names of the ids in mask, in ascending id order. Without copies when mask includes the whole set
+        """
+        removed = self.bits & ~mask
+        if not removed:
+            return self.names
+        removed_ids = bit_ids(removed)
+        if len(removed_ids) > PROJECT_DELETE_LIMIT:
+            return tuple(vlan_name for vlan_id, vlan_name in self.items() if mask >> vlan_id & 1)
+        names = list(self.names)
+        for vlan_id in reversed(removed_ids):
+            del names[self.rank(vlan_id)]
+        return tuple(names)
+
+    def digest(self) -> str:
+        """
+        Stable fingerprint of ids and names, the same between runs (hash() of str is not)
+        """
+        fingerprint = hashlib.blake2b(self.bits.to_bytes(VLAN_ID_BITS // 8, "little"), digest_size=16)
+        fingerprint.update("\n".join(self.names).encode())
+        return fingerprint.hexdigest()
+
+    def to_bytes(self) -> bytes:
+        """
+        Compact encoding (journal snapshots): bitmap and NUL separated names, compressed
+        """
+        return zlib.compress(self.bits.to_bytes(VLAN_ID_BITS // 8, "little") + "\0".join(self.names).encode())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VlanSet":
+        raw = zlib.decompress(data)
+        bits = int.from_bytes(raw[:VLAN_ID_BITS // 8], "little")
+        names = raw[VLAN_ID_BITS // 8:].decode().split("\0") if bits else ()
+        return cls(bits, tuple(sys.intern(name) for name in names))
+
+    def __contains__(self, vlan_id: int) -> bool:
+        return bool(self.bits >> vlan_id & 1)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(bit_ids(self.bits))
+
+    def __eq__(self, other):
+        return isinstance(other, VlanSet) and self.bits == other.bits and self.names == other.names
+
+    def __hash__(self):
+        return hash((self.bits, self.names))
+
+    def _combine(self, bits: int, *sources) -> "VlanSet":
+        """
+        New set with the names of the ids in bits, taken from the first source that has them
+        """
+        index = {}
+        for source in reversed(sources):
+            index.update(source.items())
+        return VlanSet(bits, tuple(index[vlan_id] for vlan_id in bit_ids(bits)))
+
+    def __or__(self, other: "VlanSet") -> "VlanSet":
+        return self._combine(self.bits | other.bits, self, other)
+
+    def __and__(self, other: "VlanSet") -> "VlanSet":
+        return VlanSet(self.bits & other.bits, self.project(other.bits))
+
+    def __sub__(self, other: "VlanSet") -> "VlanSet":
+        return VlanSet(self.bits & ~other.bits, self.project(~other.bits))
+
+    def __xor__(self, other: "VlanSet") -> "VlanSet":
+        return self._combine(self.bits ^ other.bits, self, other)
+
+
+def bit_ids(bits: int) -> list:
+    """
+    Ids of the bits set, ascending
+    """
+    if not bits:
+        return []
+    return [match.start() for match in ONE_BIT.finditer(bin(bits)[:1:-1])]
+
+
+def select_bit(bits: int, position: int) -> int:
+    """
+    Id of the set bit in that position (0 is the lowest id). Binary search of the rank, without listing all the ids
+    """
+    low, high = 0, bits.bit_length()
+    while low < high:
+        middle = (low + high) // 2
+        if popcount(bits & ((2 << middle) - 1)) > position:
+            high = middle
+        else:
+            low = middle + 1
+    return low
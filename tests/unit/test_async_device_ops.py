@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+
+import pytest
+
+asyncssh = pytest.importorskip("asyncssh")
+
+from etc.async_device_ops import run_cmd_async, stream_outputs_async  # noqa: E402
+from etc.device_ops import custom_parser  # noqa: E402
+from etc.metrics import METRICS  # noqa: E402
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+
+class FakeCiscoServer(asyncssh.SSHServer):
+    """
+    Fake Cisco device, password "cisco"
+    """
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return password == "cisco"
+
+
+def fake_cisco_process(process):
+    """
+    Replay "show vlan" output for the exec channel command
+    """
+    if process.command == "show vlan":
+        with open(SHOW_VLAN) as file:
+            process.stdout.write(file.read())
+    else:
+        process.stdout.write("% Invalid input detected at '^' marker.\n")
+    process.exit(0)
+
+
+async def start_fake_device(process_factory=fake_cisco_process):
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    return await asyncssh.create_server(FakeCiscoServer, "127.0.0.1", 0, server_host_keys=[key],
+                                        process_factory=process_factory)
+
+
+def device(port, password="cisco"):
+    return {"name": "fake-sw", "host": "127.0.0.1", "port": port, "device_type": "cisco_ios",
+            "username": "admin", "password": password, "timeout": 10}
+
+
+async def poll(devices, max_sessions, process_factory=fake_cisco_process):
+    server = await start_fake_device(process_factory)
+    port = server.sockets[0].getsockname()[1]
+    semaphore = asyncio.Semaphore(max_sessions)
+    try:
+        return await asyncio.gather(*(run_cmd_async(device(port, password), "show vlan", logger, semaphore)
+                                      for password in devices))
+    finally:
+        server.close()
+
+
+def test_run_cmd_async_parses_show_vlan():
+    result = asyncio.run(poll(["cisco"], 1))[0]
+    assert {"vlan_id": "840", "vlan_name": "VOIP-SSMR"} in result
+
+
+def test_run_cmd_async_concurrent_sessions():
+    results = asyncio.run(poll(["cisco"] * 20, 5))
+    assert all(result == results[0] for result in results)
+
+
+def test_in_flight_counts_open_sessions():
+    in_flight = []
+
+    def process(process_):
+        in_flight.append(METRICS.gauges[("devices_in_flight", ())])
+        fake_cisco_process(process_)
+    METRICS.reset()
+    asyncio.run(poll(["cisco"] * 20, 5, process))
+    # The coroutines waiting for a session slot are not in flight
+    assert len(in_flight) == 20 and max(in_flight) <= 5
+    assert METRICS.gauges[("devices_in_flight", ())] == 0
+
+
+def test_run_cmd_async_auth_failure():
+    assert asyncio.run(poll(["wrong"], 1)) == [[]]
+
+
+def test_stream_outputs_async():
+    async def stream():
+        server = await start_fake_device()
+        try:
+            return await stream_outputs_async(device(server.sockets[0].getsockname()[1]), ("show vlan", "show clock"),
+                                              logger, asyncio.Semaphore(1))
+        finally:
+            server.close()
+    parsed, outputs = asyncio.run(stream())
+    with open(SHOW_VLAN) as file:
+        assert parsed == custom_parser(file.read(), "show vlan", "cisco_ios", logger)
+    assert list(outputs) == ["show clock"]
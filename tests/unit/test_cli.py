@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+import vlan_sync_tool
+from etc import poller
+from etc.db_ops import init_db, add_vlan, query_all_vlan, save_device_records, save_device_vlans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+# Cumulative import time of vlan_sync_tool, microseconds. About 50ms, it was 760ms importing the whole poller
+IMPORT_BUDGET_US = 250000
+HEAVY_MODULES = ("netmiko", "paramiko", "sqlalchemy", "asyncssh")
+logger = logging.getLogger("test")
+
+
+def import_times(*args) -> dict:
+    """
+    python -X importtime, from the repository root
+    :return: {module: cumulative microseconds}
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, module = line.split("|")
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    with open(SHOW_VLAN) as file:
+        output = file.read()
+    inventory_file = tmp_path / "inventory.yml"
+    inventory_file.write_text(yaml.safe_dump({"hosts": [{"name": "sw1", "host": "10.0.0.1",
+                                                         "device_type": "cisco_ios"}]}))
+    logging_config = {"logging_level": "ERROR", "logging_file": str(tmp_path / "tool.log")}
+    config = {"poller": dict(logging_config, inventory_cache_dir=str(tmp_path / "cache")),
+              "db_orm": dict(logging_config, db_url=f"sqlite:///{tmp_path / 'vlan_sync.sqlite'}"),
+              "inventory_sources": {"file_list": [{"filename": str(inventory_file)}]}}
+    filename = tmp_path / "vlan_sync_cfg.yml"
+    filename.write_text(yaml.safe_dump(config))
+    session_obj = init_db(config["db_orm"]["db_url"])
+    add_vlan(session_obj, logger, "3000", "new")
+    save_device_vlans(session_obj, logger, {"sw1": [(3000, "new")]})
+    session_obj.remove()
+    yield str(filename), output, config["db_orm"]["db_url"]
+
+
+def test_import_budget():
+    times = import_times("-c", "import vlan_sync_tool")
+    assert times["vlan_sync_tool"] < IMPORT_BUDGET_US
+    assert not [module for module in times if module.split(".")[0] in HEAVY_MODULES]
+
+
+def test_db_report_without_device_libraries(config_file):
+    times = import_times("vlan_sync_tool.py", "db-report", "-f", config_file[0])
+    assert "sqlalchemy" in times
+    assert not [module for module in times if module.split(".")[0] in ("netmiko", "paramiko", "asyncssh")]
+    report = subprocess.run([sys.executable, "vlan_sync_tool.py", "db-report", "-f", config_file[0], "--vlan",
+                             "3000"], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert report.startswith("VLAN 3000 devices: sw1")
+
+
+def test_poll_without_numpy(config_file, tmp_path):
+    filename = config_file[0]
+    with open(filename) as file:
+        config = yaml.safe_load(file)
+    inventory_file = tmp_path / "empty.yml"
+    inventory_file.write_text(yaml.safe_dump({"hosts": []}))
+    config["inventory_sources"] = {"file_list": [{"filename": str(inventory_file)}]}
+    with open(filename, "w") as file:
+        yaml.safe_dump(config, file)
+    # NumPy only with poller.matrix_file
+    times = import_times("vlan_sync_tool.py", "poll", "-f", filename)
+    assert "etc.poller" in times
+    assert not [module for module in times if module.split(".")[0] == "numpy" or module == "etc.fleet_matrix"]
+
+
+def test_diff_only_and_push_dry_run(config_file, monkeypatch, capsys):
+    filename, output, db_url = config_file
+    monkeypatch.setattr(poller, "fetch_outputs", lambda device, commands, logger_poller, pool, limiter:
+                        dict.fromkeys(commands, output))
+    vlan_sync_tool.main(["diff-only", "-f", filename])
+    lines = capsys.readouterr().out.splitlines()
+    assert "sw1 device add 3000 new" in lines
+    assert "sw1 db add 119 Munro-ELAN" in lines
+    # Nothing saved
+    assert [vlan.id for vlan in query_all_vlan(init_db(db_url), logger)] == ["3000"]
+
+    vlan_sync_tool.main(["push", "--dry-run", "-f", filename])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "sw1 dry run"
+    assert "  vlan 3000" in lines
+
+
+def test_report(config_file, capsys, tmp_path):
+    pytest.importorskip("numpy")
+    filename, output, db_url = config_file
+    save_device_vlans(init_db(db_url), logger, {"sw2": [(5, "local"), (3000, "old")]})
+    vlan_sync_tool.main(["report", "drift", "--format", "json", "-f", filename])
+    assert json.loads(capsys.readouterr().out) == [{"device": "sw2", "extra": [5], "missing": [], "renamed": [3000]}]
+    vlan_sync_tool.main(["report", "names", "-f", filename, "-o", str(tmp_path / "names.csv")])
+    assert (tmp_path / "names.csv").read_text().splitlines() == ["device,vlan_id,device_name,db_name",
+                                                                 "sw2,3000,old,new"]
+
+
+def test_trunks_report(config_file):
+    filename, output, db_url = config_file
+    trunks = json.dumps([{"interface": "Gi0/1", "allowed_vlans": "1-10"}])
+    save_device_records(init_db(db_url), logger, [{"device": "sw1", "command": "show interfaces trunk", "collected": 0,
+                                                   "data": trunks}])
+    times = import_times("vlan_sync_tool.py", "report", "trunks", "-f", filename)
+    assert not [module for module in times if module.split(".")[0] in ("netmiko", "paramiko", "numpy")]
+    result = subprocess.run([sys.executable, "vlan_sync_tool.py", "report", "trunks", "-f", filename], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines() == ["device,vlan_id,vlan_name", "sw1,3000,new"]
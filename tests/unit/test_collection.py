@@ -0,0 +1,101 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+import etc.device_ops
+from etc import poller
+from etc.collection import CollectionPlan, TRUNK_COMMANDS, allowed_vlan_ids, trunk_report
+from etc.db_ops import init_db, query_all_vlan, query_device_records
+from test_parsers import IOS_SHOW_INTERFACES_TRUNK, IOS_SHOW_IP_INTERFACE_BRIEF
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+
+class FakeDevices:
+    """
+    ConnectHandler stand-in: one session per login, with the commands sent in it
+    """
+    def __init__(self):
+        self.sessions = []
+        with open(SHOW_VLAN) as file:
+            self.outputs = {"show vlan": file.read(), "show interfaces trunk": IOS_SHOW_INTERFACES_TRUNK,
+                            "show ip interface brief": IOS_SHOW_IP_INTERFACE_BRIEF}
+
+    def __call__(self, **params):
+        session = FakeSession(params["host"], self.outputs)
+        self.sessions.append(session)
+        return session
+
+    @property
+    def commands(self):
+        return [command for session in self.sessions for command in session.commands]
+
+
+class FakeSession:
+    def __init__(self, host, outputs):
+        self.host = host
+        self.outputs = outputs
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send_command(self, command):
+        self.commands.append(command)
+        return self.outputs[command]
+
+
+def test_plan_commands():
+    plan = CollectionPlan({"cisco_ios": ["show interfaces trunk", "show vlan", "show interfaces trunk",
+                                         "show ip interface brief"]})
+    assert plan.commands("cisco_ios") == ("show vlan", "show interfaces trunk", "show ip interface brief")
+    assert plan.commands("juniper_junos") == ("show vlans",)
+    assert CollectionPlan.from_config({}).commands("cisco_ios", "show vlan brief") == ("show vlan brief",)
+
+
+def test_one_login_per_device(tmp_path, monkeypatch):
+    fake = FakeDevices()
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", fake)
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}")
+    devices = [{"name": f"sw{index}", "host": f"10.0.0.{index}", "device_type": "cisco_ios"} for index in range(5)]
+    plan = CollectionPlan.from_config({"collection_plan": {"cisco_ios": ["show interfaces trunk",
+                                                                        "show ip interface brief"]}})
+    state = poller.PollerState(plan=plan)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+
+    # One login per device, all the commands in its session
+    assert sorted(session.host for session in fake.sessions) == [device["host"] for device in devices]
+    assert all(session.commands == ["show vlan", "show interfaces trunk", "show ip interface brief"]
+               for session in fake.sessions)
+    assert len(state.snapshots["sw3"]) == 13 and len(query_all_vlan(session_obj, logger)) > 0
+    record = state.records["sw3"]
+    assert record.get("show interfaces trunk")[0] == {"interface": "Gi0/1", "allowed_vlans": "1-4094"}
+    assert [svi["vlan_id"] for svi in record.get("show ip interface brief")] == ["1", "101"]
+
+    # Saved for the reports
+    assert {(row.device, row.command) for row in query_device_records(session_obj, logger, TRUNK_COMMANDS)} == {
+        (device["name"], "show interfaces trunk") for device in devices}
+    assert all(record.saved for record in state.records.values())
+
+    # Without extra commands: only the VLAN command, and no records
+    fake.sessions.clear()
+    state = poller.PollerState()
+    asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+    assert fake.commands == ["show vlan"] * len(devices)
+    assert state.records == {}
+
+
+def test_trunk_report():
+    assert allowed_vlan_ids("1-3,10,2000-2001") == {1, 2, 3, 10, 2000, 2001}
+    assert allowed_vlan_ids("none") == set() and len(allowed_vlan_ids("All")) == 4094
+    trunks = [{"interface": "Gi0/1", "allowed_vlans": "10-20"}, {"interface": "Gi0/2", "allowed_vlans": "30"}]
+    device_vlans = {"sw1": [(10, "users"), (25, "lost"), (30, "voice")], "sw2": [(40, "access")]}
+    # sw2 has no trunks up: not reported
+    assert trunk_report([("sw1", trunks), ("sw2", [])], device_vlans.get) == [
+        {"device": "sw1", "vlan_id": 25, "vlan_name": "lost"}]
@@ -0,0 +1,80 @@
+import logging
+import sqlite3
+
+from etc.db_ops import init_db, add_vlan, query_vlan, query_all_vlan, apply_vlan_changes, save_device_vlans, \
+    query_device_vlans, query_vlan_devices, query_vlan_device_counts, SCHEMA_VERSION
+from etc.diff import VlanOperation, TARGET_DB, OP_ADD, OP_REMOVE, OP_RENAME
+
+logger = logging.getLogger("test")
+
+
+def new_db(tmp_path):
+    return init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+
+
+def op(operation_type, vlan_id, vlan_name="name"):
+    return VlanOperation(TARGET_DB, "sw1", operation_type, vlan_id, vlan_name)
+
+
+def test_apply_vlan_changes(tmp_path):
+    session_obj = new_db(tmp_path)
+    add_vlan(session_obj, logger, "100", "users", "office")
+    add_vlan(session_obj, logger, "200", "voice")
+    counts = apply_vlan_changes(session_obj, logger, [op(OP_ADD, "300", "mgmt"), op(OP_RENAME, "100", "staff"),
+                                                      op(OP_REMOVE, "200")])
+    assert counts == {"upserted": 2, "deleted": 1}
+    session_obj.remove()
+    vlan = query_vlan(session_obj, logger, "100")
+    assert (vlan.name, vlan.description) == ("staff", "office")
+    assert query_vlan(session_obj, logger, "200") is None
+    assert query_vlan(session_obj, logger, "300").name == "mgmt"
+
+
+def test_last_operation_wins(tmp_path):
+    session_obj = new_db(tmp_path)
+    counts = apply_vlan_changes(session_obj, logger, [op(OP_ADD, "300", "mgmt"), op(OP_ADD, "300", "mgmt2")])
+    assert counts == {"upserted": 1, "deleted": 0}
+    assert query_vlan(session_obj, logger, "300").name == "mgmt2"
+
+
+def test_chunked_transactions(tmp_path):
+    session_obj = new_db(tmp_path)
+    operations = [op(OP_ADD, str(vlan_id)) for vlan_id in range(2, 1002)]
+    assert apply_vlan_changes(session_obj, logger, operations, chunk_size=150)["upserted"] == 1000
+    assert len(query_all_vlan(session_obj, logger)) == 1000
+    removes = [op(OP_REMOVE, str(vlan_id)) for vlan_id in range(2, 1002)]
+    assert apply_vlan_changes(session_obj, logger, removes)["deleted"] == 1000
+
+
+def test_device_vlans_replace_and_queries(tmp_path):
+    session_obj = new_db(tmp_path)
+    save_device_vlans(session_obj, logger, {"sw1": [(1, "default"), (400, "mgmt")], "sw2": [(400, "mgmt")]})
+    save_device_vlans(session_obj, logger, {"sw1": [(1, "default"), (500, "users")]})
+    assert query_device_vlans(session_obj, logger, "sw1") == [(1, "default"), (500, "users")]
+    assert query_vlan_devices(session_obj, logger, "400") == ["sw2"]
+    assert query_vlan_device_counts(session_obj, logger) == {1: 1, 400: 1, 500: 1}
+
+
+def test_per_vlan_query_uses_index(tmp_path):
+    new_db(tmp_path)
+    with sqlite3.connect(tmp_path / "test.sqlite") as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT device_id FROM device_vlans WHERE vlan_id = 400").fetchall()
+    assert "ix_device_vlans_vlan" in str(plan)
+
+
+def test_migration_from_vlans_per_device(tmp_path):
+    filename = tmp_path / "legacy.sqlite"
+    with sqlite3.connect(filename) as conn:
+        conn.execute("CREATE TABLE vlans (id VARCHAR(10) NOT NULL, name VARCHAR(20), description VARCHAR(50), "
+                     "PRIMARY KEY (id))")
+        conn.execute("CREATE TABLE vlans_per_device (device VARCHAR(10) NOT NULL, id VARCHAR(10), name VARCHAR(20), "
+                     "description VARCHAR(50), PRIMARY KEY (device))")
+        conn.execute("INSERT INTO vlans_per_device VALUES ('sw1', '400', 'mgmt', 'change_me')")
+    session_obj = init_db(f"sqlite:///{filename}", echo=False)
+    assert query_device_vlans(session_obj, logger, "sw1") == [(400, "mgmt")]
+    with sqlite3.connect(filename) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert "vlans_per_device" not in tables
+    # Already migrated
+    init_db(f"sqlite:///{filename}", echo=False)
@@ -0,0 +1,149 @@
+import asyncio
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+
+import etc.device_ops
+from etc import poller
+from etc.db_ops import query_device_vlans, save_device_vlans, add_vlan, query_all_vlan, load_fingerprints, \
+    query_vlan_history
+from etc.db_writer import DbWriter
+from etc.fingerprint import FingerprintCache
+from etc.journal import ChangeJournal
+from etc.vlanset import VlanSet
+from test_metrics import FakeConnection
+
+logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = DbWriter(logger, f"sqlite:///{tmp_path / 'test.sqlite'}", cache_kb=8192)
+    yield writer
+    writer.stop()
+
+
+def test_pragmas(writer):
+    with writer.session_obj() as session:
+        assert session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert session.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert session.execute(text("PRAGMA cache_size")).scalar() == -8192
+
+
+def test_concurrent_writes_grouped(writer):
+    started, release = threading.Event(), threading.Event()
+
+    def block(session_obj, logger_orm):
+        started.set()
+        return release.wait(5)
+
+    blocked = writer.submit(block)
+    started.wait(5)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = list(executor.map(
+            lambda index: writer.submit(save_device_vlans, {f"sw{index}": [(10, "users"), (index + 100, "x")]}),
+            range(40)))
+        assert writer.queue_depth() == 40
+        release.set()
+        assert [future.result() for future in futures] == [2] * 40
+    assert blocked.result()
+    # The first operation alone, the 40 queued while it was running in one transaction
+    assert (writer.operations, writer.transactions) == (41, 2)
+    assert query_device_vlans(writer.session_obj, logger, "sw7") == [(10, "users"), (107, "x")]
+
+
+def test_failed_operation_does_not_lose_the_batch(writer):
+    def fail(session_obj, logger_orm):
+        session_obj().execute(text("INSERT INTO missing_table VALUES (1)"))
+
+    release = threading.Event()
+    writer.submit(lambda session_obj, logger_orm: release.wait(5))
+    first = writer.submit(add_vlan, "10", "users")
+    failed = writer.submit(fail)
+    last = writer.submit(add_vlan, "20", "voice")
+    release.set()
+    with pytest.raises(Exception):
+        failed.result()
+    first.result(), last.result()
+    assert sorted(vlan.id for vlan in query_all_vlan(writer.session_obj, logger)) == ["10", "20"]
+
+
+def fail(session_obj, logger_orm):
+    session_obj().execute(text("INSERT INTO missing_table VALUES (1)"))
+
+
+def with_failed_write(writer, function, *args, writes=1):
+    """
+    Run the function while the writer is busy, then queue a failing write in the same batch as its writes
+    """
+    release = threading.Event()
+    writer.submit(lambda session_obj, logger_orm: release.wait(5))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(function, *args)
+        while writer.queue_depth() < writes:
+            time.sleep(0.01)
+        failed = writer.submit(fail)
+        release.set()
+        future.result()
+    with pytest.raises(Exception):
+        failed.result()
+
+
+def test_replayed_batch_saves_journal_and_fingerprints(writer):
+    vlans = VlanSet.from_items([("10", "users")])
+    state = poller.PollerState(writer=writer, journal=ChangeJournal(), cache=FingerprintCache(), snapshots={"sw1": vlans})
+    state.cache.begin_cycle("db")
+    state.cache.store("sw1", "output")
+    # Device VLANs and fingerprints
+    with_failed_write(writer, poller.finish_cycle, [], [], writer.session_obj, logger, logger, state, 0, writes=2)
+    assert load_fingerprints(writer.session_obj, logger) == {"sw1": ("output", "db")}
+    assert state.cache.changed == {}
+
+    state.journal.device_changes("sw1", None, vlans)
+    with_failed_write(writer, poller.save_journal, writer.session_obj, logger, state)
+    assert [row.device for row in query_vlan_history(writer.session_obj, logger, 10)] == ["sw1"]
+    assert state.journal.pending == [] and state.journal.last_snapshot is not None
+
+
+def test_failed_cycle_writes_restore_state(writer, monkeypatch):
+    old, new = VlanSet.from_items([("10", "users")]), VlanSet.from_items([("10", "users"), ("20", "voice")])
+    state = poller.PollerState(writer=writer, journal=ChangeJournal(), cache=FingerprintCache(), snapshots={"sw1": old})
+    poller.load_db_vlans(writer.session_obj, logger, state)
+    state.cache.store("sw1", "output")
+    poller.device_changed(state, "sw1", old, new)
+    poller.device_changed(state, "sw2", None, new)
+    state.snapshots.update(sw1=new, sw2=new)
+    state.changed.update(sw1=True, sw2=True)
+    monkeypatch.setattr(poller, "save_device_vlans", fail)
+    devices = [{"name": "sw1"}, {"name": "sw2"}]
+    assert not poller.finish_cycle(devices, [], writer.session_obj, logger, logger, state, 0)
+    # VLANs before the cycle, the changes found again in the next cycle
+    assert state.snapshots == {"sw1": old}
+    assert state.journal.pending == [] and state.cache.entries == {}
+    assert query_device_vlans(writer.session_obj, logger, "sw1") == []
+
+
+def test_lock_wait(writer, tmp_path):
+    other = sqlite3.connect(tmp_path / "test.sqlite", isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.2, other.execute, ("COMMIT",)).start()
+    writer.write(add_vlan, "10", "users")
+    other.close()
+    assert writer.lock_wait >= 0.15
+
+
+def test_cycle_with_writer(writer, monkeypatch):
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", FakeConnection)
+    devices = [{"name": f"sw{i}", "host": f"10.0.0.{i}", "device_type": "cisco_ios"} for i in range(3)]
+    state = poller.PollerState(writer=writer)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    asyncio.run(poller.sync_vlans(executor, devices, writer.session_obj, logger, logger, state))
+    assert len(query_all_vlan(writer.session_obj, logger)) > 0
+    assert len(query_device_vlans(writer.session_obj, logger, "sw2")) > 0
+    # DB changes and device VLANs of the cycle
+    assert writer.operations == 2
@@ -0,0 +1,49 @@
+from etc.diff import diff_vlans, index_device_vlans, VlanOperation, TARGET_DB, TARGET_DEVICE, OP_ADD, \
+    OP_REMOVE, OP_RENAME
+
+db = {"1": "default", "100": "users", "200": "voice", "300": "mgmt"}
+
+
+def test_in_sync():
+    assert diff_vlans("sw1", db, dict(db), dict(db)) == []
+
+
+def test_first_poll_adds_both_ways_and_db_name_wins():
+    current = {"1": "default", "100": "users", "200": "VOICE", "400": "new"}
+    result = diff_vlans("sw1", db, current)
+    assert VlanOperation(TARGET_DB, "sw1", OP_ADD, "400", "new") in result
+    assert VlanOperation(TARGET_DEVICE, "sw1", OP_ADD, "300", "mgmt") in result
+    assert VlanOperation(TARGET_DEVICE, "sw1", OP_RENAME, "200", "voice") in result
+    assert len(result) == 3
+
+
+def test_removed_from_device():
+    current = {"1": "default", "100": "users", "200": "voice"}
+    result = diff_vlans("sw1", db, current, dict(db))
+    assert result == [VlanOperation(TARGET_DB, "sw1", OP_REMOVE, "300", "mgmt")]
+
+
+def test_removed_from_db():
+    previous = dict(db, **{"400": "old"})
+    current = dict(previous)
+    result = diff_vlans("sw1", db, current, previous)
+    assert result == [VlanOperation(TARGET_DEVICE, "sw1", OP_REMOVE, "400", "old")]
+
+
+def test_rename_direction():
+    current = dict(db, **{"100": "staff"})
+    assert diff_vlans("sw1", db, current, dict(db)) == \
+        [VlanOperation(TARGET_DB, "sw1", OP_RENAME, "100", "staff")]
+    renamed_db = dict(db, **{"100": "staff"})
+    assert diff_vlans("sw1", renamed_db, dict(db), dict(db)) == \
+        [VlanOperation(TARGET_DEVICE, "sw1", OP_RENAME, "100", "staff")]
+
+
+def test_reserved_vlans_ignored():
+    current = {"1": "other", "1002": "fddi-default", "100": "users", "200": "voice", "300": "mgmt"}
+    assert diff_vlans("sw1", db, current, dict(db)) == []
+
+
+def test_index_first_occurrence_wins():
+    parsed = [{"vlan_id": "100", "vlan_name": "users"}, {"vlan_id": "100", "vlan_name": "enet"}]
+    assert index_device_vlans(parsed) == {"100": "users"}
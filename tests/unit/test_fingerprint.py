@@ -0,0 +1,78 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+from etc import poller
+from etc.db_ops import init_db, add_vlan
+from etc.fingerprint import FingerprintCache, output_fingerprint
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+devices = [{"name": "sw1", "host": "10.0.0.1", "device_type": "cisco_ios"}]
+
+
+def show_vlan():
+    with open(SHOW_VLAN) as file:
+        return file.read()
+
+
+def test_fingerprint_only_vlan_section():
+    output = show_vlan()
+    fingerprint = output_fingerprint(output, "cisco_ios", "show vlan")
+    assert output_fingerprint(output.replace("100001", "100002"), "cisco_ios", "show vlan") == fingerprint
+    assert output_fingerprint(output.replace("Munro-ELAN", "Munro-LAN"), "cisco_ios", "show vlan") != fingerprint
+
+
+def test_cache_hit_miss_and_persistence(tmp_path):
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    cache = FingerprintCache.load(session_obj, logger)
+    cache.begin_cycle("db1")
+    assert not cache.unchanged("sw1", "out1")
+    cache.store("sw1", "out1")
+    assert cache.unchanged("sw1", "out1")
+    cache.save(session_obj, logger)
+    loaded = FingerprintCache.load(session_obj, logger)
+    loaded.begin_cycle("db1")
+    assert loaded.unchanged("sw1", "out1")
+    loaded.begin_cycle("db2")
+    assert not loaded.unchanged("sw1", "out1")
+    assert (loaded.hits, loaded.misses) == (1, 1)
+    loaded.invalidate("sw1")
+    loaded.save(session_obj, logger)
+    assert FingerprintCache.load(session_obj, logger).entries == {}
+
+
+def test_sync_skips_unchanged_output(tmp_path, monkeypatch):
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    output = show_vlan()
+    monkeypatch.setattr(poller, "fetch_outputs", lambda device, commands, logger_poller, pool, limiter:
+                        dict.fromkeys(commands, output))
+    parsed = []
+    get_device_vlans = poller.get_device_vlans
+
+    def counting_get_device_vlans(*args):
+        parsed.append(args)
+        return get_device_vlans(*args)
+
+    monkeypatch.setattr(poller, "get_device_vlans", counting_get_device_vlans)
+    state = poller.PollerState(cache=FingerprintCache())
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    def cycle():
+        asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+
+    cycle()
+    # First poll adds the device VLANs to the DB, so the device is not in sync yet
+    cycle()
+    cycle()
+    assert len(parsed) == 2
+    assert state.cache.hits == 1
+    # Output unchanged but no previous VLANs of the device (journal off, restarted with the fingerprints in the
+    # DB): parsed to have them
+    state.snapshots.clear()
+    cycle()
+    assert len(parsed) == 3 and "sw1" in state.snapshots
+    add_vlan(session_obj, logger, "3000", "new")
+    cycle()
+    assert len(parsed) == 4
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from etc.vlanset import VlanSet
+
+# Optional dependency
+pytest.importorskip("numpy")
+from etc.fleet_matrix import FleetMatrix, NAME_SEPARATOR  # noqa: E402
+
+
+def random_fleet(devices=300, seed=1):
+    generator = random.Random(seed)
+    vlans_db = VlanSet.from_items((vlan_id, f"v{vlan_id}") for vlan_id in generator.sample(range(1, 4095), 60))
+    fleet = {}
+    for index in range(devices):
+        items = [(vlan_id, name if generator.random() > 0.02 else "other") for vlan_id, name in vlans_db.items()
+                 if generator.random() > 0.05]
+        items.extend((vlan_id, f"local{vlan_id}") for vlan_id in generator.sample(range(1, 4095), 3))
+        fleet[f"sw{index}"] = VlanSet.from_items(items)
+    return vlans_db, fleet
+
+
+def expected_drift(vlans_db, fleet):
+    drift = []
+    for device, vlans in fleet.items():
+        row = {"device": device, "extra": (vlans - vlans_db).ids(), "missing": (vlans_db - vlans).ids(),
+               "renamed": [vlan_id for vlan_id in (vlans & vlans_db) if vlans.name(vlan_id) != vlans_db.name(vlan_id)]}
+        if row["extra"] or row["missing"] or row["renamed"]:
+            drift.append(row)
+    return drift
+
+
+def test_reports_like_vlan_sets():
+    vlans_db, fleet = random_fleet()
+    matrix = FleetMatrix.from_vlan_sets(fleet)
+    assert matrix.drift(vlans_db) == expected_drift(vlans_db, fleet)
+    names = matrix.name_mismatches(vlans_db)
+    assert sorted((row["device"], row["vlan_id"]) for row in names) == \
+        sorted((row["device"], vlan_id) for row in expected_drift(vlans_db, fleet) for vlan_id in row["renamed"])
+    assert all(row["device_name"] == "other" and row["db_name"] == f"v{row['vlan_id']}" for row in names)
+    vlan_id = vlans_db.ids()[0]
+    assert matrix.missing(vlan_id) == [device for device, vlans in fleet.items() if vlan_id not in vlans]
+    coverage = {row["vlan_id"]: row for row in matrix.coverage(vlans_db)}
+    assert list(coverage) == sorted(coverage)
+    assert coverage[vlan_id] == {"vlan_id": vlan_id, "db_name": f"v{vlan_id}",
+                                 "devices": sum(vlan_id in vlans for vlans in fleet.values())}
+
+
+def test_incremental_update_and_growth():
+    matrix = FleetMatrix(rows=2, columns=2)
+    matrix.update("sw1", VlanSet.from_items([(10, "a"), (20, "b"), (30, "c")]))
+    matrix.update("sw2", VlanSet.from_items([(10, "a")]))
+    matrix.update("sw3", VlanSet.from_items([(40, "d")]))
+    # VLANs removed from the device leave the row
+    matrix.update("sw1", VlanSet.from_items([(20, "x")]))
+    vlans_db = VlanSet.from_items([(10, "a"), (20, "b")])
+    assert matrix.drift(vlans_db) == [
+        {"device": "sw1", "extra": [], "missing": [10], "renamed": [20]},
+        {"device": "sw2", "extra": [], "missing": [20], "renamed": []},
+        {"device": "sw3", "extra": [40], "missing": [10, 20], "renamed": []}]
+    assert matrix.missing(4000) == ["sw1", "sw2", "sw3"]
+
+
+def test_save_load_and_from_db_rows(tmp_path):
+    vlans_db, fleet = random_fleet(50)
+    matrix = FleetMatrix.from_vlan_sets(fleet)
+    matrix.save(str(tmp_path / "matrix.npz"))
+    loaded = FleetMatrix.load(str(tmp_path / "matrix.npz"))
+    rows = FleetMatrix.from_db_rows((device, ",".join(map(str, vlans.ids())), NAME_SEPARATOR.join(vlans.names))
+                                    for device, vlans in fleet.items())
+    for other in (loaded, rows):
+        assert other.drift(vlans_db) == matrix.drift(vlans_db)
+        assert other.coverage(vlans_db) == matrix.coverage(vlans_db)
+    # Still updatable
+    loaded.update("sw0", vlans_db)
+    assert "sw0" not in [row["device"] for row in loaded.drift(vlans_db)]
@@ -0,0 +1,92 @@
+import http.server
+import json
+import logging
+import threading
+
+import pytest
+import yaml
+
+from etc.inventory import Inventory
+
+logger = logging.getLogger("test")
+HOSTS = 100000
+
+
+class InventoryApi(http.server.BaseHTTPRequestHandler):
+    """
+    Inventory API stand-in: one JSON body with an ETag, 304 if the client has it
+    """
+    body = b""
+    etag = '"v1"'
+    # Not 200: the API is failing
+    status = 200
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("If-None-Match"))
+        if self.status != 200:
+            self.send_error(self.status)
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    InventoryApi.body = json.dumps({"hosts": [
+        {"name": f"sw{index}", "host": f"10.{index >> 16}.{index >> 8 & 255}.{index & 255}",
+         "device_type": "cisco_ios"} for index in range(HOSTS)]}).encode()
+    InventoryApi.requests = []
+    InventoryApi.status = 200
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), InventoryApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/inventory"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sources_merged_without_duplicates(tmp_path, api):
+    inventory_file = tmp_path / "inventory.yml"
+    inventory_file.write_text(yaml.safe_dump({"hosts": [
+        {"name": "core1", "host": "10.0.0.1", "device_type": "cisco_nxos"},
+        {"name": "extra", "host": "192.168.0.1", "device_type": "cisco_ios"},
+        {"name": "invalid", "host": "192.168.0.2"},
+        # Same name as a device of the API, other host
+        {"name": "sw5", "host": "192.168.0.5", "device_type": "cisco_ios"}]}))
+    sources = {"file_list": [{"filename": str(inventory_file)}], "remote_api_urls": [{"url": api}]}
+    inventory = Inventory(sources, logger, str(tmp_path / "cache"))
+    assert len(inventory.devices) == HOSTS + 1
+    # The file is the first source, so its device wins
+    assert inventory.devices[0]["name"] == "core1"
+    assert len({device["host"] for device in inventory.devices}) == len(inventory.devices)
+    assert len({device["name"] for device in inventory.devices}) == len(inventory.devices)
+    assert [device["host"] for device in inventory.devices if device["name"] == "sw5"] == ["192.168.0.5"]
+
+
+def test_etag_cache(tmp_path, api):
+    sources = {"remote_api_urls": [{"url": api}]}
+    cache_dir = str(tmp_path / "cache")
+    first = Inventory(sources, logger, cache_dir).devices
+    second = Inventory(sources, logger, cache_dir).devices
+    assert InventoryApi.requests == [None, '"v1"']
+    assert second == first and len(second) == HOSTS
+
+    # API failing: the cached inventory
+    InventoryApi.status = 503
+    assert len(Inventory(sources, logger, cache_dir).devices) == HOSTS
+
+
+def test_unreachable_without_cache(tmp_path):
+    sources = {"remote_api_urls": [{"url": "http://127.0.0.1:9/inventory", "timeout": 1}]}
+    assert Inventory(sources, logger, str(tmp_path / "cache")).devices == []
@@ -0,0 +1,108 @@
+import asyncio
+import concurrent.futures
+import logging
+
+from sqlalchemy import text
+
+import etc.device_ops
+from etc import poller
+from etc.db_ops import SNAPSHOTS_KEPT, init_db, query_vlan_history, query_vlan_removed
+from etc.diff import OP_ADD, OP_REMOVE, OP_RENAME
+from etc.journal import ChangeJournal, vlan_set_changes
+from etc.vlanset import VlanSet
+from test_metrics import FakeConnection
+
+logger = logging.getLogger("test")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def vlans(**names):
+    return VlanSet.from_items((vlan_id[1:], name) for vlan_id, name in names.items())
+
+
+def test_vlan_set_changes():
+    assert vlan_set_changes(vlans(v10="a", v20="b", v30="c"), vlans(v10="a", v20="x", v40="d")) == [
+        (OP_ADD, 40, "d"), (OP_REMOVE, 30, "c"), (OP_RENAME, 20, "x")]
+    assert vlan_set_changes(None, vlans(v10="a")) == [(OP_ADD, 10, "a")]
+
+
+def test_restore_from_snapshot_and_journal(tmp_path):
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    clock = FakeClock()
+    journal = ChangeJournal(snapshot_interval=100, clock=clock)
+    state = {"sw1": vlans(v10="a", v950="voice"), "sw2": vlans(v20="b")}
+    for device, current in state.items():
+        journal.device_changes(device, None, current)
+    # First save: snapshot
+    assert journal.save(session_obj, logger, state) == 3
+    assert journal.rows_since_snapshot == 0
+
+    clock.now += 10
+    journal.device_changes("sw1", state["sw1"], vlans(v10="a"))
+    state["sw1"] = vlans(v10="a")
+    journal.device_changes("sw3", None, vlans(v30="c"))
+    state["sw3"] = vlans(v30="c")
+    # Not due: only journal rows
+    assert journal.save(session_obj, logger, state) == 2
+    assert journal.rows_since_snapshot == 2
+
+    restored = ChangeJournal()
+    assert restored.restore(session_obj, logger) == state
+    assert restored.rows_since_snapshot == 2
+    assert query_vlan_removed(session_obj, logger, 950, "sw1") == 1010.0
+    assert query_vlan_removed(session_obj, logger, 10, "sw1") is None
+    assert [(row.operation, row.timestamp) for row in query_vlan_history(session_obj, logger, 950, "sw1")] == [
+        (OP_ADD, 1000.0), (OP_REMOVE, 1010.0)]
+
+    # Due by time: the new snapshot has everything
+    clock.now += 100
+    journal.device_changes("sw2", state["sw2"], vlans(v20="b", v21="e"))
+    state["sw2"] = vlans(v20="b", v21="e")
+    journal.save(session_obj, logger, state)
+    assert journal.rows_since_snapshot == 0
+    assert ChangeJournal().restore(session_obj, logger) == state
+
+
+def test_snapshots_by_shard(tmp_path):
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    clock = FakeClock()
+    members = {"a": ChangeJournal(snapshot_rows=1, clock=clock, shard="a"),
+               "b": ChangeJournal(snapshot_rows=1, clock=clock, shard="b")}
+    state = {"a": {"sw1": vlans(v10="a")}, "b": {"sw2": vlans(v20="b")}}
+    for _ in range(3):
+        for shard, journal in members.items():
+            for device, current in state[shard].items():
+                new = vlans(v10=shard, v99=f"{shard}{clock.now}")
+                journal.device_changes(device, current, new)
+                state[shard][device] = new
+            journal.save(session_obj, logger, state[shard])
+            clock.now += 1
+    # The snapshots of a member are not deleted by the snapshots of the others
+    kept = session_obj().execute(text("SELECT shard, COUNT(DISTINCT journal_id) FROM journal_snapshots GROUP BY shard"))
+    assert dict(kept.fetchall()) == {"a": SNAPSHOTS_KEPT, "b": SNAPSHOTS_KEPT}
+    restored = ChangeJournal(shard="a")
+    assert restored.restore(session_obj, logger, {"sw1"}) == state["a"]
+    assert restored.last_snapshot == 1004.0
+    # sw2 moved from b to a: its VLANs from the snapshot of b
+    assert restored.restore(session_obj, logger, {"sw1", "sw2"}) == dict(state["a"], **state["b"])
+    # Without a snapshot, the whole journal
+    assert ChangeJournal(shard="c").restore(session_obj, logger) == dict(state["a"], **state["b"])
+
+
+def test_cycle_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", FakeConnection)
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    devices = [{"name": f"sw{i}", "host": f"10.0.0.{i}", "device_type": "cisco_ios"} for i in range(2)]
+    state = poller.PollerState(journal=ChangeJournal())
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+    # New VLANs seen on the devices, and added to the DB
+    assert [row.target for row in query_vlan_history(session_obj, logger, 840)] == ["device", "device", "db"]
+    assert ChangeJournal().restore(session_obj, logger) == state.snapshots
@@ -0,0 +1,68 @@
+import json
+import logging
+
+from etc.logger_svc import BufferedRotatingFileHandler, CustomLogger, PIPELINE
+
+
+class Unprintable:
+    """
+    Fails the test if it is formatted
+    """
+    def __repr__(self):
+        raise AssertionError("formatted at a disabled level")
+
+    __str__ = __repr__
+
+
+def test_level_from_config_value(tmp_path):
+    logger = CustomLogger("test_level", {"logging_level": "info", "logging_file": str(tmp_path / "level.log")})
+    assert logger.logger.level == logging.INFO
+    # Lazy formatting: the argument is not formatted below the level
+    logger.debug("VLANs %s", Unprintable())
+
+
+def test_shared_listener_and_files(tmp_path):
+    first = CustomLogger("test_first", {"logging_file": str(tmp_path / "first.log")})
+    second = CustomLogger("test_second", {"logging_file": str(tmp_path / "second.log"),
+                                          "logging_json_file": str(tmp_path / "second.jsonl")})
+    assert first.logger.handlers == second.logger.handlers == [PIPELINE.queue_handler]
+    first.info("Device %s in sync", "sw1")
+    second.error("Device %s sync failed", "sw2")
+    PIPELINE.flush()
+    assert "INFO - Device sw1 in sync" in (tmp_path / "first.log").read_text()
+    assert "sw2" not in (tmp_path / "first.log").read_text()
+    assert "ERROR - Device sw2 sync failed" in (tmp_path / "second.log").read_text()
+    record = json.loads((tmp_path / "second.jsonl").read_text().splitlines()[-1])
+    assert (record["logger"], record["level"], record["message"]) == ("test_second", "ERROR", "Device sw2 sync failed")
+
+
+def test_loggers_sharing_a_file(tmp_path):
+    config = {"logging_file": str(tmp_path / "shared.log")}
+    main = CustomLogger("test_shared_main", config)
+    orm = CustomLogger("test_shared_orm", config)
+    CustomLogger("test_shared_other", {"logging_file": str(tmp_path / "other.log")}).info("Other record")
+    main.info("Main record")
+    orm.error("ORM record")
+    PIPELINE.flush()
+    text = (tmp_path / "shared.log").read_text()
+    assert "Main record" in text and "ORM record" in text and "Other record" not in text
+
+
+def test_buffered_writes_and_rotation(tmp_path):
+    filename = tmp_path / "buffered.log"
+    handler = BufferedRotatingFileHandler(str(filename), max_bytes=200, backup_count=1, buffer_records=3)
+    logger = logging.getLogger("test_buffered")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.warning("one")
+    logger.warning("two")
+    assert not filename.exists()
+    logger.warning("three")
+    assert filename.read_text() == "one\ntwo\nthree\n"
+    logger.error("error written at once")
+    assert filename.read_text().endswith("error written at once\n")
+    for _ in range(10):
+        logger.warning("x" * 40)
+    handler.close()
+    assert (tmp_path / "buffered.log.1").exists()
+    assert len(filename.read_text()) <= 200
@@ -0,0 +1,86 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import urllib.request
+
+import etc.device_ops
+from etc import poller
+from etc.db_ops import init_db
+from etc.metrics import METRICS, Histogram, Metrics, start_metrics_server
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+
+class FakeConnection:
+    def __init__(self, **params):
+        with open(SHOW_VLAN) as file:
+            self.output = file.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send_command(self, command):
+        return self.output
+
+
+def test_histogram_quantile():
+    histogram = Histogram()
+    for value in [0.002] * 50 + [0.2] * 49 + [100]:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert 0.001 < histogram.quantile(0.5) <= 0.005
+    assert 0.1 < histogram.quantile(0.99) <= 0.25
+    assert histogram.quantile(1) == 60.0
+
+
+def test_render_prometheus_text():
+    metrics = Metrics()
+    metrics.observe("parse", 0.003, "sw1")
+    metrics.inc("errors", stage="device", reason="auth")
+    metrics.set_gauge("cycle_devices", 3)
+    text = metrics.render()
+    assert 'vlan_sync_stage_seconds_bucket{stage="parse",le="0.001"} 0' in text
+    assert 'vlan_sync_stage_seconds_bucket{stage="parse",le="0.005"} 1' in text
+    assert 'vlan_sync_stage_seconds_count{stage="parse"} 1' in text
+    assert 'vlan_sync_device_stage_seconds{device="sw1",stage="parse"} 0.003' in text
+    assert 'vlan_sync_errors_total{reason="auth",stage="device"} 1' in text
+    assert "vlan_sync_cycle_devices 3" in text
+
+
+def test_metrics_server():
+    metrics = Metrics()
+    metrics.inc("cycles")
+    server = start_metrics_server(0, metrics=metrics)
+    try:
+        host, port = server.server_address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert "vlan_sync_cycles_total 1" in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_cycle_stages_and_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", FakeConnection)
+    monkeypatch.setattr(poller, "update_vlans", lambda *args, **kwargs: [])
+    METRICS.reset()
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    devices = [{"name": f"sw{i}", "host": f"10.0.0.{i}", "device_type": "cisco_ios"} for i in range(3)]
+    config = {"poller": {"metrics_file": str(tmp_path / "metrics.json")}, "db_orm": {}}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    poller.run_cycle(config, executor, devices, session_obj, logger, logger, poller.PollerState())
+    with open(tmp_path / "metrics.json") as file:
+        summary = json.load(file)
+    for stage in ("connect", "command", "parse", "diff", "device", "db_query", "db_write"):
+        assert summary["stages"][stage]["count"] >= 1, stage
+    assert summary["stages"]["device"]["count"] == 3
+    assert METRICS.counter("db_changes", kind="upserted") > 0
+    assert METRICS.counter("diff_operations", target="db", operation="add") > 0
+    assert {"name": "devices_in_flight", "labels": {}, "value": 0} in summary["gauges"]
+    assert len(summary["slowest_devices"]) == 3
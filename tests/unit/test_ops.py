@@ -1,7 +1,15 @@
+import logging
+import os
+import pickle
+from unittest import mock
+
+import yaml
+
 import etc.ops
 
 valid_filename = "mock_data/vlan_sync_cfg.yml"
 invalid_file = "mock_data/dummy.txt"
+logger = logging.getLogger("test")
 
 
 def test_file_found():
@@ -18,3 +26,32 @@ def test_valid_yml_file():
 
 def test_invalid_yml_file():
     assert not etc.ops.load_yaml(invalid_file)
+
+
+def test_iter_hosts_same_as_safe_load(tmp_path):
+    filename = tmp_path / "inventory.yml"
+    filename.write_text("defaults: &defaults\n  device_type: cisco_ios\n"
+                        "hosts:\n  - name: sw1\n    host: 10.0.0.1\n    <<: *defaults\n"
+                        "  - {name: sw2, host: '10.0.0.2', port: 22, enabled: yes}\n"
+                        "other: [1, 2]\n")
+    with open(filename) as file:
+        assert list(etc.ops.iter_hosts(filename)) == yaml.safe_load(file)["hosts"]
+
+
+def test_hosts_cache(tmp_path):
+    filename = tmp_path / "inventory.yml"
+    filename.write_text("hosts:\n  - name: sw1\n    host: 10.0.0.1\n")
+    cache_dir = tmp_path / "cache"
+    assert etc.ops.load_hosts(filename, logger, cache_dir) == [{"name": "sw1", "host": "10.0.0.1"}]
+    assert len(os.listdir(cache_dir)) == 1
+    # Cache hit, without parsing
+    with mock.patch.object(etc.ops, "iter_hosts") as iter_hosts:
+        assert etc.ops.load_hosts(filename, logger, cache_dir) == [{"name": "sw1", "host": "10.0.0.1"}]
+        assert not iter_hosts.called
+    filename.write_text("hosts:\n  - name: sw1\n    host: 10.0.0.1\n  - name: sw2\n    host: 10.0.0.2\n")
+    assert len(etc.ops.load_hosts(filename, logger, cache_dir)) == 2
+    # A pickle in the cache file is not loaded: the file is parsed and the cache written again
+    cache_file = cache_dir / os.listdir(cache_dir)[0]
+    cache_file.write_bytes(pickle.dumps(mock.sentinel))
+    assert len(etc.ops.load_hosts(filename, logger, cache_dir)) == 2
+    assert cache_file.read_bytes() != pickle.dumps(mock.sentinel)
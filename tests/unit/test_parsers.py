@@ -0,0 +1,162 @@
+import logging
+import os
+
+from etc.device_ops import custom_parser
+from etc.parsers import get_parser, get_stream_parser, vlan_command
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+NXOS_SHOW_VLAN = """
+VLAN Name                             Status    Ports
+---- -------------------------------- --------- -------------------------------
+1    default                          active    Eth1/1, Eth1/2, Eth1/3, Eth1/4
+                                                Eth1/5, Eth1/6
+10   SERVERS                          active    Eth1/7
+20   VLAN0020                         suspend
+
+VLAN Type         Vlan-mode
+---- -----        ----------
+1    enet         CE
+10   enet         CE
+20   enet         CE
+"""
+
+EOS_SHOW_VLAN = """VLAN  Name                             Status    Ports
+----- -------------------------------- --------- -------------------------------
+1     default                          active    Et1, Et2
+30    STORAGE                          active    Cpu, Et3
+4094  MLAG-PEER                        active    Po10
+"""
+
+JUNOS_SHOW_VLANS = """
+Routing instance        VLAN name             Tag          Interfaces
+default-switch          default               1
+                                                           ge-0/0/0.0*
+                                                           ge-0/0/1.0
+default-switch          v100                  100
+                                                           ge-0/0/2.0*
+
+{master:0}
+"""
+
+
+def vlans(parsed):
+    return [(vlan["vlan_id"], vlan["vlan_name"]) for vlan in parsed]
+
+
+def test_cisco_ios_stops_before_type_table():
+    with open(SHOW_VLAN) as file:
+        parsed = custom_parser(file.read(), "show vlan", "cisco_ios", logger)
+    assert len(parsed) == 13
+    assert ("1", "default") in vlans(parsed)
+    assert ("1005", "trnet-default") in vlans(parsed)
+    assert all(vlan["vlan_name"] not in ("enet", "fddi", "tr") for vlan in parsed)
+
+
+def test_nxos():
+    parsed = get_parser("cisco_nxos", "show vlan")(NXOS_SHOW_VLAN)
+    assert vlans(parsed) == [("1", "default"), ("10", "SERVERS"), ("20", "VLAN0020")]
+
+
+def test_eos():
+    parsed = get_parser("arista_eos", "show vlan")(EOS_SHOW_VLAN)
+    assert vlans(parsed) == [("1", "default"), ("30", "STORAGE"), ("4094", "MLAG-PEER")]
+
+
+def test_junos():
+    assert vlan_command("juniper_junos") == "show vlans"
+    parsed = custom_parser(JUNOS_SHOW_VLANS, "show vlans", "juniper_junos", logger)
+    assert vlans(parsed) == [("1", "default"), ("100", "v100")]
+
+
+def test_parser_not_implemented():
+    assert custom_parser("output", "show version", "cisco_ios", logger) == []
+
+
+IOS_SHOW_INTERFACES_TRUNK = """
+Port        Mode             Encapsulation  Status        Native vlan
+Gi0/1       on               802.1q         trunking      1
+Gi0/2       on               802.1q         trunking      99
+
+Port        Vlans allowed on trunk
+Gi0/1       1-4094
+Gi0/2       101,117-119,121,138,840,999,1002,1003,1004,1005,1010,1020,1030,1040,1050,1060,1070,1080,
+            1090,2000-2010
+
+Port        Vlans allowed and active in management domain
+Gi0/1       1,101,117-119
+Gi0/2       101,117-119
+"""
+
+NXOS_SHOW_INTERFACE_TRUNK = """
+--------------------------------------------------------------------------------
+Port          Native  Status        Port
+              Vlan                  Channel
+--------------------------------------------------------------------------------
+Eth1/1        1       trunking      --
+
+---------------------------------------------------------------------------------
+Port          Vlans Allowed on Trunk
+---------------------------------------------------------------------------------
+Eth1/1        10,20
+
+---------------------------------------------------------------------------------
+Port          Vlans Err-disabled on Trunk
+---------------------------------------------------------------------------------
+Eth1/1        none
+"""
+
+EOS_SHOW_INTERFACES_TRUNK = """Port          Mode         Status          Native vlan
+Et1           trunk        trunking        1
+
+Port          Vlans allowed
+Et1           All
+
+Port          Vlans allowed and active in management domain
+Et1           1,30
+"""
+
+IOS_SHOW_IP_INTERFACE_BRIEF = """Interface              IP-Address      OK? Method Status                Protocol
+Vlan1                  unassigned      YES NVRAM  administratively down down
+Vlan101                10.1.1.1        YES NVRAM  up                    up
+GigabitEthernet0/1     unassigned      YES unset  up                    up
+"""
+
+
+def test_trunk_allowed_vlans():
+    parsed = get_parser("cisco_ios", "show interfaces trunk")(IOS_SHOW_INTERFACES_TRUNK)
+    allowed = "101,117-119,121,138,840,999,1002,1003,1004,1005,1010,1020,1030,1040,1050,1060,1070,1080,1090,2000-2010"
+    assert parsed == [{"interface": "Gi0/1", "allowed_vlans": "1-4094"},
+                      {"interface": "Gi0/2", "allowed_vlans": allowed}]
+    parsed = get_parser("cisco_nxos", "show interface trunk")(NXOS_SHOW_INTERFACE_TRUNK)
+    assert parsed == [{"interface": "Eth1/1", "allowed_vlans": "10,20"}]
+    parsed = get_parser("arista_eos", "show interfaces trunk")(EOS_SHOW_INTERFACES_TRUNK)
+    assert parsed == [{"interface": "Et1", "allowed_vlans": "All"}]
+
+
+def test_cisco_svis():
+    parsed = get_parser("cisco_ios", "show ip interface brief")(IOS_SHOW_IP_INTERFACE_BRIEF)
+    assert parsed == [{"vlan_id": "1", "interface": "Vlan1", "ip_address": "unassigned",
+                       "status": "administratively down", "protocol": "down"},
+                      {"vlan_id": "101", "interface": "Vlan101", "ip_address": "10.1.1.1", "status": "up",
+                       "protocol": "up"}]
+
+
+def test_stream_parsers_any_chunk_size():
+    with open(SHOW_VLAN) as file:
+        output = file.read()
+    cases = (("cisco_ios", "show vlan", output), ("cisco_nxos", "show vlan", NXOS_SHOW_VLAN),
+             ("juniper_junos", "show vlans", JUNOS_SHOW_VLANS))
+    for device_type, command, text in cases:
+        expected = get_parser(device_type, command)(text)
+        for size in (1, 7, 64, len(text)):
+            parser = get_stream_parser(device_type, command)()
+            for start in range(0, len(text), size):
+                if parser.feed(text[start:start + size]):
+                    break
+            assert parser.close() == expected
+    # Complete at the blank line after the table, the next tables are not needed
+    parser = get_stream_parser("cisco_ios", "show vlan")()
+    assert parser.feed(output[:output.index("VLAN Type")])
+    assert len(parser.close()) == 13
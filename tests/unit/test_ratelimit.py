@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+from netmiko import NetmikoAuthenticationException, NetmikoTimeoutException
+
+import etc.device_ops
+from etc import poller
+from etc.db_ops import init_db
+from etc.ratelimit import CircuitBreaker, LoginLimiter, TokenBucket
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTransport:
+    """
+    ConnectHandler stand-in: timeouts or authentication failures for the devices in the failing dict
+    """
+    def __init__(self):
+        self.failing = {}
+        self.logins = []
+        with open(SHOW_VLAN) as file:
+            self.output = file.read()
+
+    def __call__(self, **params):
+        host = params["host"]
+        self.logins.append(host)
+        failure = self.failing.get(host)
+        if failure == "timeout":
+            raise NetmikoTimeoutException(f"TCP connection to device failed {host}")
+        if failure == "auth":
+            raise NetmikoAuthenticationException(f"Authentication to device failed {host}")
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send_command(self, command):
+        return self.output
+
+
+def test_token_bucket_burst_and_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 3, clock)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    clock.now = 1.0
+    assert bucket.reserve() == 0.5
+
+
+def test_login_limiter_per_site():
+    clock = FakeClock()
+    limiter = LoginLimiter(rate=100, burst=100, site_rate=1, site_burst=1, clock=clock)
+    assert limiter.reserve({"site": "a"}) == 0
+    assert limiter.reserve({"site": "b"}) == 0
+    assert limiter.reserve({"site": "a"}) == 1
+    assert limiter.reserve({}) == 0
+    assert limiter.waited == 1
+
+
+def test_breaker_backoff():
+    clock = FakeClock()
+    breaker = CircuitBreaker(logger, threshold=2, backoff=10, max_backoff=25, clock=clock, seed=1)
+    assert breaker.record_failure("sw1", "timeout") == 0
+    assert breaker.allow("sw1")
+    retry_at = breaker.record_failure("sw1", "timeout")
+    assert 9 <= retry_at <= 11
+    assert not breaker.allow("sw1")
+    assert [name for name, *_ in breaker.open_devices()] == ["sw1"]
+    clock.now = retry_at
+    assert breaker.allow("sw1")
+    assert 18 <= breaker.record_failure("sw1", "timeout") - clock.now <= 22
+    clock.now += 100
+    assert breaker.record_failure("sw1", "timeout") - clock.now <= 25 * 1.1
+    breaker.record_success("sw1")
+    assert breaker.failures == {}
+
+
+def test_breaker_auth_failure_opens_at_once():
+    clock = FakeClock()
+    breaker = CircuitBreaker(logger, threshold=3, backoff=10, max_backoff=3600, auth_factor=4, clock=clock, seed=1)
+    assert 36 <= breaker.record_failure("sw1", "Authentication failed", auth=True) <= 44
+    assert not breaker.allow("sw1")
+
+
+def test_failing_devices_skipped_and_retried(tmp_path, monkeypatch):
+    transport = FakeTransport()
+    transport.failing = {"10.0.0.2": "timeout", "10.0.0.3": "auth"}
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", transport)
+    monkeypatch.setattr(poller, "update_vlans", lambda *args, **kwargs: [])
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}", echo=False)
+    devices = [{"name": f"sw{i}", "host": f"10.0.0.{i}", "device_type": "cisco_ios"} for i in (1, 2, 3)]
+    clock = FakeClock()
+    state = poller.PollerState(breaker=CircuitBreaker(logger, threshold=2, backoff=60, clock=clock))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    def cycle():
+        transport.logins.clear()
+        asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+        return sorted(transport.logins)
+
+    assert cycle() == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    # Authentication failure opened the circuit, the timeout needs one more failure
+    assert cycle() == ["10.0.0.1", "10.0.0.2"]
+    assert cycle() == ["10.0.0.1"]
+    transport.failing = {}
+    clock.now += 1000
+    assert cycle() == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    assert state.breaker.failures == {}
+    assert "sw2" in state.snapshots
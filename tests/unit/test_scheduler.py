@@ -0,0 +1,70 @@
+import logging
+
+from etc.scheduler import PollScheduler, scheduler_groups
+
+logger = logging.getLogger("test")
+groups = {"default": {"min_interval": 60, "max_interval": 600}, "core": {"min_interval": 10, "max_interval": 40}}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_scheduler(jitter=0.0):
+    clock = Clock()
+    scheduler = PollScheduler(groups, logger, jitter, clock, seed=1)
+    scheduler.add_devices([{"name": "access1"}, {"name": "core1", "group": "core"}])
+    return scheduler, clock
+
+
+def test_interval_adapts_within_group_limits():
+    scheduler, clock = new_scheduler()
+    assert {device["name"] for device in scheduler.due()} == {"access1", "core1"}
+    intervals = [scheduler.record("access1", False).interval for _ in range(10)]
+    assert intervals[:3] == [90, 135, 202.5]
+    assert intervals[-1] == 600
+    assert scheduler.record("access1", True).interval == 300
+    assert scheduler.record("core1", True).interval == 10
+    assert [scheduler.record("core1", False).interval for _ in range(5)][-1] == 40
+
+
+def test_due_in_poll_order():
+    scheduler, clock = new_scheduler()
+    for device in scheduler.due():
+        scheduler.record(device["name"], False)
+    assert scheduler.due() == []
+    assert scheduler.next_poll() == 1015
+    clock.now = 1015
+    assert [device["name"] for device in scheduler.due()] == ["core1"]
+    assert [entry[1] for entry in scheduler.schedule()] == ["access1"]
+
+
+def test_wait_time():
+    scheduler, clock = new_scheduler()
+    assert scheduler.wait_time(60) == 0
+    for device in scheduler.due():
+        scheduler.record(device["name"], False)
+    assert scheduler.wait_time(60) == 15
+    # No devices: the idle time
+    empty = PollScheduler(groups, logger, clock=clock)
+    assert empty.next_poll() is None and empty.wait_time(60) == 60
+
+
+def test_jitter_spreads_polls():
+    scheduler = PollScheduler(groups, logger, 0.2, Clock(), seed=3)
+    scheduler.add_devices([{"name": f"sw{index}"} for index in range(50)])
+    polls = [scheduler.record(f"sw{index}", False).next_poll for index in range(50)]
+    assert len(set(polls)) == 50
+    assert all(1000 + 90 * 0.8 <= poll <= 1000 + 90 * 1.2 for poll in polls)
+    assert len(scheduler.decisions()) == 50
+
+
+def test_default_group_from_sync_time():
+    assert scheduler_groups({}, 60) == {"default": {"min_interval": 60, "max_interval": 60}}
+    # -p/--polling_time replaces the configured default group, the other groups are kept
+    assert scheduler_groups({"groups": groups}, 60, 20) == {"default": {"min_interval": 20, "max_interval": 20},
+                                                            "core": groups["core"]}
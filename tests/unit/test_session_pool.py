@@ -0,0 +1,78 @@
+import logging
+
+import etc.session_pool
+from etc.session_pool import SessionPool
+
+logger = logging.getLogger("test")
+device = {"name": "sw1", "host": "10.0.0.1", "device_type": "cisco_ios", "username": "u", "password": "p"}
+
+
+class FakeConnection:
+    """
+    Netmiko connection stand-in
+    """
+    opened = 0
+
+    def __init__(self, **kwargs):
+        FakeConnection.opened += 1
+        self.params = kwargs
+        self.alive = True
+        self.fail_next = False
+
+    def is_alive(self):
+        return self.alive
+
+    def send_command(self, command):
+        if self.fail_next:
+            raise OSError("Socket is closed")
+        return f"output {command}"
+
+    def disconnect(self):
+        self.alive = False
+
+
+def new_pool(monkeypatch, **kwargs):
+    FakeConnection.opened = 0
+    monkeypatch.setattr(etc.session_pool, "ConnectHandler", FakeConnection)
+    return SessionPool(logger, **kwargs)
+
+
+def test_session_reused(monkeypatch):
+    pool = new_pool(monkeypatch)
+    pool.send_command(device, "show vlan")
+    pool.send_command(device, "show vlan")
+    assert FakeConnection.opened == 1
+    assert "name" not in pool.get(device).params
+    assert "name" in device
+
+
+def test_reconnect_when_not_alive(monkeypatch):
+    pool = new_pool(monkeypatch)
+    pool.get(device).alive = False
+    assert pool.send_command(device, "show vlan") == "output show vlan"
+    assert FakeConnection.opened == 2
+
+
+def test_reconnect_when_session_drops(monkeypatch):
+    pool = new_pool(monkeypatch)
+    pool.get(device).fail_next = True
+    assert pool.send_command(device, "show vlan") == "output show vlan"
+    assert FakeConnection.opened == 2
+
+
+def test_evict_idle(monkeypatch):
+    pool = new_pool(monkeypatch, idle_timeout=-1)
+    conn = pool.get(device)
+    assert pool.evict_idle() == 1
+    assert not conn.alive
+    assert pool.sessions == {}
+
+
+def test_send_commands_one_session(monkeypatch):
+    pool = new_pool(monkeypatch)
+    assert pool.send_commands(device, ("show vlan", "show interfaces trunk")) == {
+        "show vlan": "output show vlan", "show interfaces trunk": "output show interfaces trunk"}
+    pool.get(device).fail_next = True
+    assert list(pool.send_commands(device, ("show vlan", "show interfaces trunk"))) == [
+        "show vlan", "show interfaces trunk"]
+    assert FakeConnection.opened == 2
@@ -0,0 +1,132 @@
+import collections
+import logging
+import os
+
+from etc.db_ops import query_all_vlan, query_vlan_device_counts
+from etc.db_writer import DbWriter
+from etc.journal import ChangeJournal
+from etc.poller import PollerState
+from etc.sharding import HashRing, ShardCoordinator, shard_config
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+
+
+def fake_devices(output):
+    """
+    Shard process initializer: every device answers with the output
+    """
+    from etc import poller
+    poller.fetch_outputs = lambda device, commands, logger_poller, pool, limiter: dict.fromkeys(commands, output)
+
+
+def crashing_shard(output, shard):
+    """
+    Shard process initializer: the process of the shard exits in its first poll
+    """
+    import multiprocessing
+    from etc import poller
+
+    def fetch_outputs(device, commands, logger_poller, pool, limiter):
+        if multiprocessing.current_process().name == shard:
+            os._exit(1)
+        return dict.fromkeys(commands, output)
+    poller.fetch_outputs = fetch_outputs
+
+
+def test_ring_even_and_minimal_moves():
+    names = [f"sw{index}" for index in range(20000)]
+    ring = HashRing(["a", "b", "c", "d"])
+    before = {name: ring.shard_of(name) for name in names}
+    counts = collections.Counter(before.values())
+    assert min(counts.values()) > len(names) / 4 * 0.8 and max(counts.values()) < len(names) / 4 * 1.2
+
+    # Joining: only devices to the new shard, about 1/5 of them
+    ring.add("e")
+    moved = {name for name in names if ring.shard_of(name) != before[name]}
+    assert {ring.shard_of(name) for name in moved} == {"e"}
+    assert 0.15 < len(moved) / len(names) < 0.25
+
+    # Leaving: only the devices of the shard move
+    after = {name: ring.shard_of(name) for name in names}
+    ring.remove("b")
+    assert all(ring.shard_of(name) == shard for name, shard in after.items() if shard != "b")
+    # Same ring, same assignment, in any process or host
+    assert HashRing(["e", "d", "c", "a"]).assign([{"name": name} for name in names[:100]]) == \
+        ring.assign([{"name": name} for name in names[:100]])
+
+
+def test_shard_config_splits_rates():
+    config = {"poller": {"logging_file": "logs/poller.log", "login_rate": 10, "site_login_rate": 0}}
+    poller = shard_config(config, "shard1", 4)["poller"]
+    assert poller == {"logging_file": "logs/poller.shard1.log", "login_rate": 2.5, "site_login_rate": 0}
+    assert config["poller"]["login_rate"] == 10
+
+
+def test_coordinator_processes_and_rebalance(tmp_path):
+    with open(SHOW_VLAN) as file:
+        output = file.read()
+    logging_config = {"logging_level": "ERROR", "logging_file": str(tmp_path / "poller.log")}
+    config = {"poller": dict(logging_config, push_mode="off", workers=2,
+                             collection_plan={"cisco_ios": ["show interfaces trunk"]}),
+              "db_orm": {}, "sharding": {"processes": 3, "timeout": 60}}
+    writer = DbWriter(logger, f"sqlite:///{tmp_path / 'test.sqlite'}")
+    state = PollerState(writer=writer, journal=ChangeJournal())
+    devices = [{"name": f"sw{index}", "host": f"10.0.0.{index}", "device_type": "cisco_ios"} for index in range(30)]
+    coordinator = ShardCoordinator(config, writer.session_obj, logger, logger, state, initializer=fake_devices,
+                                   initargs=(output,))
+    try:
+        coordinator.start(3)
+        coordinator.run_cycle(devices)
+        vlans = query_all_vlan(writer.session_obj, logger)
+        assert len(vlans) > 0
+        counts = query_vlan_device_counts(writer.session_obj, logger)
+        assert set(counts.values()) == {len(devices)}
+        assert set(state.snapshots) == {device["name"] for device in devices}
+        # Collection plan records of the shards, kept by the coordinator
+        assert set(state.records) == {device["name"] for device in devices}
+        assert sum(len(names) for names in coordinator.assigned.values()) == len(devices)
+
+        # A shard dies: a new shard takes its place, and its devices go to the shards with their previous VLANs,
+        # so nothing changes
+        process = coordinator.processes["shard1"][0]
+        process.terminate()
+        process.join()
+        state.changed.clear()
+        coordinator.run_cycle(devices)
+        assert sorted(coordinator.processes) == ["shard0", "shard2", "shard3"]
+        assert sorted(set.union(*coordinator.assigned.values())) == sorted(device["name"] for device in devices)
+        assert state.changed == {}
+
+        # A shard joins: it takes only its devices, the old shards drop them
+        shard = coordinator.add_shard()
+        taken = coordinator.ring.devices_of(shard, devices)
+        assert sum(len(names) for names in coordinator.dropped.values()) == len(taken)
+        coordinator.run_cycle(devices)
+        assert coordinator.assigned[shard] == {device["name"] for device in taken}
+        assert state.changed == {}
+        assert len(query_all_vlan(writer.session_obj, logger)) == len(vlans)
+    finally:
+        coordinator.stop()
+        writer.stop()
+
+
+def test_shard_dies_during_cycle(tmp_path):
+    with open(SHOW_VLAN) as file:
+        output = file.read()
+    config = {"poller": {"logging_level": "ERROR", "logging_file": str(tmp_path / "poller.log"), "push_mode": "off"},
+              "db_orm": {}, "sharding": {"processes": 2}}
+    writer = DbWriter(logger, f"sqlite:///{tmp_path / 'test.sqlite'}")
+    state = PollerState(writer=writer)
+    devices = [{"name": f"sw{index}", "host": f"10.0.0.{index}", "device_type": "cisco_ios"} for index in range(20)]
+    coordinator = ShardCoordinator(config, writer.session_obj, logger, logger, state, initializer=crashing_shard,
+                                   initargs=(output, "shard0"))
+    try:
+        coordinator.start(2)
+        coordinator.run_cycle(devices)
+        # Replaced in the same cycle, the devices of the dead shard polled by the others
+        assert sorted(coordinator.processes) == ["shard1", "shard2"]
+        assert set(query_vlan_device_counts(writer.session_obj, logger).values()) == {len(devices)}
+    finally:
+        coordinator.stop()
+        writer.stop()
@@ -0,0 +1,142 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+import pytest
+
+import etc.device_ops
+import etc.session_pool
+from etc import poller
+from etc.db_ops import init_db
+from etc.device_ops import DeviceError, custom_parser, stream_outputs
+from etc.fingerprint import FingerprintCache
+from etc.session_pool import SessionPool
+
+SHOW_VLAN = os.path.join(os.path.dirname(__file__), "mock_data", "show_vlan_cisco_ios.txt")
+logger = logging.getLogger("test")
+device = {"name": "sw1", "host": "10.0.0.1", "device_type": "cisco_ios"}
+
+
+class StreamingDevice:
+    """
+    ConnectHandler stand-in with a channel: the command echo, then the output in chunks, then the prompt
+    """
+    def __init__(self, chunk_size=64, prompt=True):
+        with open(SHOW_VLAN) as file:
+            self.output = file.read().replace("\n", "\r\n")
+        self.chunk_size = chunk_size
+        self.prompt = prompt
+        self.logins = 0
+        self.sessions = []
+
+    def __call__(self, **params):
+        self.logins += 1
+        session = StreamingSession(self)
+        self.sessions.append(session)
+        return session
+
+
+class StreamingSession:
+    timeout = 0.2
+
+    def __init__(self, device_):
+        self.device = device_
+        self.pending = []
+        self.reads = 0
+        self.chunks = 0
+        self.connected = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+
+    def find_prompt(self):
+        return "sw1#"
+
+    def clear_buffer(self):
+        pass
+
+    def normalize_cmd(self, command):
+        return f"{command}\n"
+
+    def normalize_linefeeds(self, data):
+        return data.replace("\r\n", "\n")
+
+    def write_channel(self, data):
+        output = self.device.output
+        size = self.device.chunk_size
+        self.pending = [output[start:start + size] for start in range(0, len(output), size)]
+        self.chunks = len(self.pending)
+        if self.device.prompt:
+            self.pending.append("\r\nsw1#")
+        self.command = data.strip()
+
+    def read_until_pattern(self, pattern):
+        return f"sw1#{self.command}\r\n"
+
+    def read_channel(self):
+        self.reads += 1
+        return self.pending.pop(0) if self.pending else ""
+
+    def send_command(self, command):
+        return f"output {command}"
+
+    def is_alive(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+
+def expected_vlans():
+    with open(SHOW_VLAN) as file:
+        return custom_parser(file.read(), "show vlan", "cisco_ios", logger)
+
+
+def test_new_session_closed_after_table(monkeypatch):
+    fake = StreamingDevice()
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", fake)
+    parsed, outputs = stream_outputs(device, ("show vlan", "show interfaces trunk"), logger)
+    assert parsed == expected_vlans()
+    assert outputs == {"show interfaces trunk": "output show interfaces trunk"}
+    session = fake.sessions[0]
+    # The "VLAN Type" table and the rest were never read
+    assert session.reads < session.chunks and session.pending
+    assert not session.connected
+
+
+def test_pooled_session_reads_up_to_prompt(monkeypatch):
+    fake = StreamingDevice(chunk_size=7)
+    monkeypatch.setattr(etc.session_pool, "ConnectHandler", fake)
+    pool = SessionPool(logger)
+    for _ in range(2):
+        parsed, _ = stream_outputs(device, ("show vlan",), logger, pool)
+        assert parsed == expected_vlans()
+        assert fake.sessions[0].pending == [] and fake.sessions[0].connected
+    assert fake.logins == 1
+
+
+def test_no_prompt_times_out(monkeypatch):
+    fake = StreamingDevice(prompt=False)
+    fake.output = fake.output[:fake.output.index("\r\n\r\nVLAN Type")]
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", fake)
+    with pytest.raises(DeviceError):
+        stream_outputs(device, ("show vlan",), logger)
+
+
+def test_poller_streaming_and_cache(tmp_path, monkeypatch):
+    fake = StreamingDevice()
+    monkeypatch.setattr(etc.device_ops, "ConnectHandler", fake)
+    session_obj = init_db(f"sqlite:///{tmp_path / 'test.sqlite'}")
+    devices = [{"name": f"sw{index}", "host": f"10.0.0.{index}", "device_type": "cisco_ios"} for index in range(3)]
+    state = poller.PollerState(cache=FingerprintCache(), stream=True)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    for _ in range(3):
+        asyncio.run(poller.sync_vlans(executor, devices, session_obj, logger, logger, state))
+    assert all(len(state.snapshots[device_["name"]]) == 13 for device_ in devices)
+    assert all(not session.connected and session.pending for session in fake.sessions)
+    # Same VLANs, found in sync in the second cycle: the third one only reads them
+    assert state.cache.hits == len(devices)
@@ -0,0 +1,93 @@
+import concurrent.futures
+import logging
+
+import etc.updater
+from etc.diff import VlanOperation, TARGET_DEVICE, OP_ADD, OP_REMOVE, OP_RENAME
+from etc.updater import render_config_set, push_device, update_vlans
+
+logger = logging.getLogger("test")
+DEVICE = {"name": "sw1", "host": "10.0.0.1", "device_type": "cisco_ios"}
+HEADER = ("VLAN Name                             Status    Ports\n"
+          "---- -------------------------------- --------- -------------------------------\n")
+
+
+class FakeSwitch:
+    """
+    ConnectHandler stand-in with a VLAN table: applies the config sets and renders "show vlan"
+    """
+    def __init__(self, ignored=()):
+        self.vlans = {1: "default", 10: "old", 20: "users"}
+        # VLAN ids the config set does not change (e.g. rejected by the device)
+        self.ignored = set(ignored)
+        self.sessions = 0
+        self.config_sets = []
+
+    def __call__(self, **params):
+        self.sessions += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send_config_set(self, commands):
+        self.config_sets.append(commands)
+        vlan_id = None
+        for command in commands:
+            words = command.split()
+            if words[:2] == ["no", "vlan"] and int(words[2]) not in self.ignored:
+                self.vlans.pop(int(words[2]), None)
+            elif words[0] == "vlan":
+                vlan_id = int(words[1])
+            elif words[0] == "name" and vlan_id not in self.ignored:
+                self.vlans[vlan_id] = words[1]
+        return ""
+
+    def send_command(self, command):
+        rows = "".join(f"{vlan_id:<4} {name:<32} active\n" for vlan_id, name in sorted(self.vlans.items()))
+        return HEADER + rows
+
+
+def operations(*changes):
+    return [VlanOperation(TARGET_DEVICE, "sw1", operation_type, vlan_id, name)
+            for operation_type, vlan_id, name in changes]
+
+
+def test_render_config_set():
+    changes = operations((OP_ADD, "30", "voice"), (OP_REMOVE, "20", "users"), (OP_RENAME, "10", "servers"),
+                         (OP_ADD, "10", "servers2"))
+    assert render_config_set("cisco_ios", changes) == ["vlan 10", "name servers2", "exit", "no vlan 20",
+                                                       "vlan 30", "name voice", "exit"]
+    assert render_config_set("unknown", changes) is None
+
+
+def test_dry_run_does_not_connect(monkeypatch):
+    switch = FakeSwitch()
+    monkeypatch.setattr(etc.updater, "ConnectHandler", switch)
+    result = push_device(DEVICE, operations((OP_ADD, "30", "voice")), logger, dry_run=True)
+    assert result.commands == ["vlan 30", "name voice", "exit"]
+    assert not result.applied
+    assert switch.sessions == 0
+
+
+def test_one_session_and_config_set_per_device(monkeypatch):
+    switch = FakeSwitch()
+    monkeypatch.setattr(etc.updater, "ConnectHandler", switch)
+    result = push_device(DEVICE, operations((OP_ADD, "30", "voice"), (OP_REMOVE, "20", "users"),
+                                            (OP_ADD, "40", "printers")), logger)
+    assert result.applied and result.mismatches == []
+    assert switch.sessions == 1
+    assert len(switch.config_sets) == 1
+    assert result.vlans.ids() == [1, 10, 30, 40]
+
+
+def test_verification_mismatch(monkeypatch):
+    switch = FakeSwitch(ignored={40})
+    monkeypatch.setattr(etc.updater, "ConnectHandler", switch)
+    pushes = {"sw1": operations((OP_ADD, "30", "voice"), (OP_ADD, "40", "printers"))}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    [result] = update_vlans(executor, [DEVICE], pushes, logger)
+    assert [operation.vlan_id for operation in result.mismatches] == ["40"]
+    assert 30 in result.vlans and 40 not in result.vlans
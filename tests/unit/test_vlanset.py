@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from etc.diff import diff_vlans, diff_vlan_sets
+from etc.vlanset import VlanSet, VlanRecord, bit_ids, select_bit
+
+
+def vlan_set(index):
+    return VlanSet.from_items(index.items())
+
+
+def test_set_algebra():
+    a = vlan_set({"10": "a", "20": "b", "30": "c"})
+    b = vlan_set({"20": "x", "40": "d"})
+    assert list(a | b) == [10, 20, 30, 40]
+    assert (a | b).name(20) == "b"
+    assert (a - b).to_index() == {"10": "a", "30": "c"}
+    assert (a & b).to_index() == {"20": "b"}
+    assert (a ^ b).to_index() == {"10": "a", "30": "c", "40": "d"}
+    assert len(a) == 3 and 30 in a and 40 not in a
+    assert a.name(40) is None
+
+
+def test_project():
+    a = VlanSet.from_items((vlan_id, f"v{vlan_id}") for vlan_id in range(1, 200))
+    assert a.project(a.bits) is a.names
+    assert a.project(a.bits & ~(1 << 5)) == tuple(f"v{vlan_id}" for vlan_id in range(1, 200) if vlan_id != 5)
+    odd = VlanSet.from_ids(range(1, 200, 2)).bits
+    assert a.project(odd) == tuple(f"v{vlan_id}" for vlan_id in range(1, 200, 2))
+
+
+def test_select_bit():
+    bits = VlanSet.from_ids([0, 7, 100, 4095]).bits
+    assert [select_bit(bits, position) for position in range(4)] == bit_ids(bits) == [0, 7, 100, 4095]
+
+
+def test_first_occurrence_wins_and_names_interned():
+    a = VlanSet.from_parsed([{"vlan_id": "10", "vlan_name": "users"}, {"vlan_id": "10", "vlan_name": "enet"}])
+    b = VlanSet.from_parsed([{"vlan_id": "10", "vlan_name": "".join(["us", "ers"])}])
+    assert a.name(10) == "users"
+    assert a.name(10) is b.name(10)
+    assert a.records() == [VlanRecord(10, "users")]
+
+
+def test_out_of_range():
+    with pytest.raises(ValueError):
+        VlanSet.from_items([(4096, "bad")])
+
+
+def test_same_operations_as_dict_diff():
+    rnd = random.Random(7)
+    for _ in range(50):
+        db, current, previous = ({str(v): rnd.choice("abc") for v in rnd.sample(range(1, 60), 30)}
+                                 for _ in range(3))
+        for prev in (previous, None):
+            expected = diff_vlans("sw1", db, current, prev)
+            result = diff_vlan_sets("sw1", vlan_set(db), vlan_set(current), None if prev is None else vlan_set(prev))
+            assert sorted(result) == sorted(expected)
+
+
+def test_bytes_round_trip():
+    vlans = vlan_set({"1": "default", "10": "", "4095": "lastñ"})
+    assert VlanSet.from_bytes(vlans.to_bytes()) == vlans
+    assert VlanSet.from_bytes(VlanSet().to_bytes()) == VlanSet()
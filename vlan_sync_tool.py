@@ -1,151 +1,385 @@
 #!/usr/bin/env python
-
+"""
+Multi-vendor VLAN sync tool. Commands:
+  poll       poll the devices and sync DB and devices (the default command, -d for daemon mode)
+  diff-only  poll the devices and print the changes to sync, without saving or pushing them
+  push       poll the devices and push the device changes (--dry-run only prints the config sets), without DB writes
+  db-report  VLANs in the DB and their devices, without connecting to the devices
+  report     fleet reports as CSV or JSON (drift with the DB, VLAN coverage, name mismatches, devices missing a VLAN,
+             VLANs not allowed on any trunk)
+Each command imports only what it uses: Netmiko and Paramiko only to poll, SQLAlchemy only for the DB (etc/poller.py)
+"""
 import argparse
-import asyncio
-import logging
-import concurrent.futures
+import sys
 
 from etc.config import get_config
-from etc.inventory import Inventory
-from etc.db_ops import init_db, query_all_vlan
-from etc.device_ops import run_cmd
-from etc.logger_svc import CustomLogger
-from etc.updater import update_vlans
 
 DEFAULT_CONFIG_FILE = "vlan_sync_cfg.yml"
 DEFAULT_INVENTORY_FILE = "inventory.yml"
+COMMANDS = ("poll", "diff-only", "push", "db-report", "report")
+
+
+def loggers(config):
+    """
+    :return: poller and ORM loggers
+    """
+    import logging
+    from etc.logger_svc import CustomLogger
+    # Libraries (Netmiko, Paramiko) only log warnings. The tool loggers have their own level (logging_level)
+    logging.basicConfig(level=logging.WARNING)
+    return CustomLogger("main", config["poller"]), CustomLogger("sqlalchemy", config["db_orm"])
+
+
+def load_devices(config, logger_poller, shard=None) -> list:
+    """
+    :param shard: only the devices of this member of sharding.members (consistent hashing of the device names)
+    """
+    from etc.inventory import Inventory, DEFAULT_CACHE_DIR
+    devices = Inventory(config.get('inventory_sources', ''), logger_poller,
+                        config["poller"].get("inventory_cache_dir", DEFAULT_CACHE_DIR)).devices
+    if shard is None:
+        return devices
+    from etc.sharding import HashRing, DEFAULT_REPLICAS
+    sharding = config.get("sharding") or {}
+    if shard not in (sharding.get("members") or []):
+        print(f"Shard {shard} is not in sharding.members")
+        sys.exit(1)
+    devices = HashRing(sharding["members"], sharding.get("replicas", DEFAULT_REPLICAS)).devices_of(shard, devices)
+    logger_poller.info("Shard %s: %s devices", shard, len(devices))
+    return devices
+
+
+def poll(config, args):
+    """
+    Tool to sync VLAN between between devices and DB (ORM)
+    :param args: optional: polling time, inventory, daemon, dry run (check vlan_sync_cfg.yml)
+    """
+    import concurrent.futures
+    import time
+    from etc.db_ops import DEFAULT_DB_URL
+    from etc.collection import CollectionPlan
+    from etc.db_writer import DbWriter, DEFAULT_CACHE_KB, DEFAULT_WRITE_BATCH
+    from etc.fingerprint import FingerprintCache
+    from etc.journal import ChangeJournal, DEFAULT_SNAPSHOT_INTERVAL, DEFAULT_SNAPSHOT_ROWS
+    from etc.metrics import METRICS, start_metrics_server
+    from etc.poller import PollerState, login_limiter, run_cycle
+    from etc.ratelimit import CircuitBreaker
+    from etc.scheduler import PollScheduler, scheduler_groups
+    from etc.session_pool import SessionPool
+    from etc.sharding import ShardCoordinator
+    from etc.updater import PUSH_DRY_RUN
+
+    if args.dry_run:
+        config["poller"]["push_mode"] = PUSH_DRY_RUN
+    logger_poller, logger_orm = loggers(config)
+    devices = load_devices(config, logger_poller, args.shard)
+    processes = (config.get("sharding") or {}).get("processes", 0)
+    writer = DbWriter(logger_orm, config["db_orm"].get("db_url", DEFAULT_DB_URL),
+                      cache_kb=config["db_orm"].get("cache_size_kb", DEFAULT_CACHE_KB),
+                      batch_size=config["db_orm"].get("write_batch", DEFAULT_WRITE_BATCH))
+    # Reads with their own connections, writes with the writer thread
+    session_obj = writer.session_obj
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=config["poller"].get("workers", 4))
+    # Will have asyncio ready for other tasks, but the polling is with thread workers for 2 reasons:
+    # - Netmiko and SQLAlchemy are NOT Asyncio ready
+    # - Polling too many devices could DoS authentication systems, overload the network or this same PC
+    # Later could use asyncio semaphore to limit the polled devices if changing library to "netdev",
+    # which is a port of asyncio version of Netmiko. But currently does not have all the extensions.
+    # Scrapli is another good option, but I had problems in my Lab device which doesn't make any sense to work on now.
+    # Transport "asyncio" (asyncssh) is the semaphore option.
+    state = PollerState(limiter=login_limiter(config["poller"]),
+                        breaker=CircuitBreaker(logger_poller, config["poller"].get("breaker_failures", 3),
+                                               config["poller"].get("backoff_base", 60),
+                                               config["poller"].get("backoff_max", 3600)),
+                        writer=writer, plan=CollectionPlan.from_config(config["poller"]),
+                        stream=config["poller"].get("stream_parse", False))
+    if config["db_orm"].get("journal", True):
+        state.journal = ChangeJournal(config["db_orm"].get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL),
+                                      config["db_orm"].get("snapshot_rows", DEFAULT_SNAPSHOT_ROWS),
+                                      shard=args.shard or "")
+        # VLANs of every device in the last poll of the previous run. With --shard, only the devices of the shard
+        state.snapshots = state.journal.restore(session_obj, logger_orm,
+                                                {device["name"] for device in devices} if args.shard else None)
+    matrix_file = config["poller"].get("matrix_file")
+    if matrix_file:
+        # NumPy only with the fleet matrix
+        from etc.fleet_matrix import FleetMatrix, numpy
+        if numpy is None:
+            logger_poller.error("No fleet matrix file, it needs NumPy: pip install numpy")
+        else:
+            state.matrix = FleetMatrix.from_vlan_sets(state.snapshots)
+    coordinator = None
+    if processes > 1:
+        # The shard processes poll, this process merges their results in the DB
+        coordinator = ShardCoordinator(config, session_obj, logger_poller, logger_orm, state, keep_sessions=args.daemon)
+        coordinator.start(processes)
+    elif config["poller"].get("change_cache", True):
+        state.cache = FingerprintCache.load(session_obj, logger_orm)
+
+    def cycle(cycle_devices):
+        if coordinator is not None:
+            duration = coordinator.run_cycle(cycle_devices)
+        else:
+            duration = run_cycle(config, executor, cycle_devices, session_obj, logger_poller, logger_orm, state)
+        if state.matrix is not None:
+            # For the report command
+            state.matrix.save(matrix_file)
+        return duration
+
+    if not args.daemon:
+        try:
+            cycle(devices)
+        finally:
+            if coordinator is not None:
+                coordinator.stop()
+            writer.stop()
+        return
+
+    # Daemon mode: poll each device when the scheduler says so, keeping the device sessions open between cycles
+    sync_time = int(args.polling_time or config["poller"].get("sync_time", 60))
+    if coordinator is None:
+        state.pool = SessionPool(logger_poller, config["poller"].get("session_keepalive", 30),
+                                 config["poller"].get("session_idle_timeout", 300), state.limiter)
+    scheduler_config = config.get("scheduler") or {}
+    polling_time = int(args.polling_time) if args.polling_time else None
+    scheduler = PollScheduler(scheduler_groups(scheduler_config, sync_time, polling_time), logger_poller,
+                              scheduler_config.get("jitter", 0.1))
+    scheduler.add_devices(devices)
+    logger_poller.info("Daemon mode, %s", scheduler)
+    # Only the daemon: a one-shot run next to it would fail to bind the same port
+    metrics_port = config["poller"].get("metrics_port", 0)
+    if metrics_port:
+        metrics_host = config["poller"].get("metrics_host", "127.0.0.1")
+        try:
+            start_metrics_server(metrics_port, metrics_host)
+            logger_poller.info("Metrics on http://%s:%s/metrics", metrics_host, metrics_port)
+        except OSError as e:
+            logger_poller.error("No metrics endpoint on %s:%s %r", metrics_host, metrics_port, e)
+    try:
+        while True:
+            due = scheduler.due()
+            if due:
+                try:
+                    duration = cycle(due)
+                    logger_poller.info("Cycle of %s devices finished in %.1f seconds", len(due), duration)
+                except Exception as e:
+                    # The devices are polled again when due, the daemon keeps running
+                    logger_poller.error("Cycle of %s devices failed %r", len(due), e)
+                    METRICS.inc("errors", stage="cycle", reason=type(e).__name__)
+                for device in due:
+                    scheduler.record(device["name"], state.changed.pop(device["name"], False))
+                if state.pool is not None:
+                    state.pool.evict_idle()
+            time.sleep(scheduler.wait_time(sync_time))
+    except KeyboardInterrupt:
+        logger_poller.info("Daemon stopped")
+    finally:
+        if coordinator is not None:
+            coordinator.stop()
+        else:
+            state.pool.close_all()
+        writer.stop()
+
+
+def poll_diff(config, args):
+    """
+    Poll the devices and compare them with the DB and their VLANs in the last poll (journal). Nothing is saved
+    :return: changes {device name: VlanOperation list}, executor, devices, poller logger and PollerState
+    """
+    import concurrent.futures
+    from etc.db_ops import DEFAULT_DB_URL, init_db
+    from etc.journal import ChangeJournal
+    from etc.poller import PollerState, diff_devices, login_limiter
+
+    logger_poller, logger_orm = loggers(config)
+    devices = load_devices(config, logger_poller, args.shard)
+    session_obj = init_db(config["db_orm"].get("db_url", DEFAULT_DB_URL), logger_orm=logger_orm)
+    state = PollerState(limiter=login_limiter(config["poller"]), stream=config["poller"].get("stream_parse", False))
+    if config["db_orm"].get("journal", True):
+        state.snapshots = ChangeJournal().restore(session_obj, logger_orm)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=config["poller"].get("workers", 4))
+    changes = diff_devices(executor, devices, session_obj, logger_poller, logger_orm, state)
+    return changes, executor, devices, logger_poller, state
+
+
+def diff_only(config, args):
+    """
+    Print the changes to sync, one per line: device, target (db or device), operation, VLAN id and name
+    """
+    changes = poll_diff(config, args)[0]
+    for device in sorted(changes):
+        for operation in changes[device]:
+            print(f"{device} {operation.target} {operation.operation_type} {operation.vlan_id} "
+                  f"{operation.vlan_name}")
+    print(f"{len(changes)} devices not in sync", file=sys.stderr)
 
 
-def get_device_vlans(device, command, logger_poller):
-    """
-    Get device VLANs
-    """
-    vlans_device = run_cmd(device, command, logger_poller)
-
-    """
-    testing data
-    vlans_device = [{'vlan_id': '1', 'vlan_name': 'default'}, {'vlan_id': '110', 'vlan_name': 'vlan'},
-                    {'vlan_id': '200', 'vlan_name': 'INET_DTV'}, {'vlan_id': '201', 'vlan_name': 'para_borrar'},
-                    {'vlan_id': '202', 'vlan_name': 'Internet_Broadband'},
-                    {'vlan_id': '251', 'vlan_name': 'InsideFW_REGION(172.21.0.160/29)'},
-                    {'vlan_id': '280', 'vlan_name': 'INSIDE_CONC_VPN(172.21.1.0/28)'},
-                    {'vlan_id': '302', 'vlan_name': 'MPLS-IN'}, {'vlan_id': '303', 'vlan_name': 'descri'},
-                    {'vlan_id': '304', 'vlan_name': 'OutLevel3(201.234.41.80/28)'},
-                    {'vlan_id': '308', 'vlan_name': 'WIFI-PROV-OUT'},
-                    {'vlan_id': '400', 'vlan_name': 'MGMT(172.21.31.32/29)'},
-                    {'vlan_id': '401', 'vlan_name': 'WLC-MGMT(172.21.31.0/29)'},
-                    {'vlan_id': '402', 'vlan_name': 'ARG2FW(172.21.31.16/29)'},
-                    {'vlan_id': '404', 'vlan_name': 'WLC-corp(172.21.92.0/22)'},
-                    {'vlan_id': '405', 'vlan_name': 'WLC-Guest'}, {'vlan_id': '406', 'vlan_name': 'WIFI-Prov'},
-                    {'vlan_id': '407', 'vlan_name': 'ISE(172.21.31.40/29)'}, {'vlan_id': '408', 'vlan_name': 'WLC-HA'},
-                    {'vlan_id': '440', 'vlan_name': 'Failover-FW-AR-MTZ-FW-01-Guest'},
-                    {'vlan_id': '441', 'vlan_name': 'Failover-FW-AR-MTZ-VC-01'},
-                    {'vlan_id': '442', 'vlan_name': 'Failover-FW-AR-MTZ-CO-01'},
-                    {'vlan_id': '443', 'vlan_name': 'Failover-FW-AR-MTZ-FW-01-Prov'},
-                    {'vlan_id': '445', 'vlan_name': 'Failover-Fw-DTV-FW-DC-C-1'},
-                    {'vlan_id': '950', 'vlan_name': 'BC-AFM(172.21.1.16/28)'},
-                    {'vlan_id': '999', 'vlan_name': 'dump-vlan'},
-                    {'vlan_id': '1002', 'vlan_name': 'fddi-default'},
-                    {'vlan_id': '1003', 'vlan_name': 'token-ring-default'},
-                    {'vlan_id': '1004', 'vlan_name': 'fddinet-default'},
-                    {'vlan_id': '1005', 'vlan_name': 'trnet-default'},
-                    {'vlan_id': '1', 'vlan_name': 'enet'}, {'vlan_id': '110', 'vlan_name': 'enet'},
-                    {'vlan_id': '200', 'vlan_name': 'enet'}, {'vlan_id': '201', 'vlan_name': 'enet'},
-                    {'vlan_id': '202', 'vlan_name': 'enet'}, {'vlan_id': '251', 'vlan_name': 'enet'},
-                    {'vlan_id': '280', 'vlan_name': 'enet'}, {'vlan_id': '302', 'vlan_name': 'enet'},
-                    {'vlan_id': '303', 'vlan_name': 'enet'}, {'vlan_id': '304', 'vlan_name': 'enet'},
-                    {'vlan_id': '308', 'vlan_name': 'enet'}, {'vlan_id': '400', 'vlan_name': 'enet'},
-                    {'vlan_id': '401', 'vlan_name': 'enet'}, {'vlan_id': '402', 'vlan_name': 'enet'},
-                    {'vlan_id': '404', 'vlan_name': 'enet'}, {'vlan_id': '405', 'vlan_name': 'enet'},
-                    {'vlan_id': '406', 'vlan_name': 'enet'}, {'vlan_id': '407', 'vlan_name': 'enet'},
-                    {'vlan_id': '408', 'vlan_name': 'enet'}, {'vlan_id': '440', 'vlan_name': 'enet'},
-                    {'vlan_id': '441', 'vlan_name': 'enet'}, {'vlan_id': '442', 'vlan_name': 'enet'},
-                    {'vlan_id': '443', 'vlan_name': 'enet'}, {'vlan_id': '445', 'vlan_name': 'enet'},
-                    {'vlan_id': '950', 'vlan_name': 'enet'}, {'vlan_id': '999', 'vlan_name': 'enet'},
-                    {'vlan_id': '1002', 'vlan_name': 'fddi'}, {'vlan_id': '1003', 'vlan_name': 'tr'},
-                    {'vlan_id': '1004', 'vlan_name': 'fdnet'}, {'vlan_id': '1005', 'vlan_name': 'trnet'}]
-    """
-
-    if len(vlans_device) == 0:
-        logger_poller.info(f"Vlan list is empty. Check host {device.name}or db.\n"
-                           f"Host {device.name}\n")
+def push(config, args):
+    """
+    Push the device changes, one config set per device and without DB writes. With --dry-run print the config sets
+    """
+    from etc.poller import push_changes
+    from etc.updater import PUSH_APPLY, PUSH_DRY_RUN
+
+    changes, executor, devices, logger_poller, state = poll_diff(config, args)
+    config["poller"]["push_mode"] = PUSH_DRY_RUN if args.dry_run else PUSH_APPLY
+    results = push_changes(config, executor, devices, logger_poller, state)
+    for result in sorted(results, key=lambda result: result.device):
+        if result.error:
+            status = f"failed: {result.error}"
+        elif not result.applied:
+            status = "dry run"
+        else:
+            status = f"{len(result.mismatches)} changes not verified" if result.mismatches else "verified"
+        print(f"{result.device} {status}")
+        for command in result.commands:
+            print(f"  {command}")
+
+
+def db_report(config, args):
+    """
+    VLANs in the DB with their number of devices, or the devices and the history of one VLAN
+    """
+    from etc.db_ops import DEFAULT_DB_URL, init_db, query_all_vlan, query_vlan_device_counts, query_vlan_devices, \
+        query_vlan_history
+    from etc.logger_svc import CustomLogger
+
+    logger_orm = CustomLogger("sqlalchemy", config["db_orm"])
+    session_obj = init_db(config["db_orm"].get("db_url", DEFAULT_DB_URL), logger_orm=logger_orm)
+    if args.vlan is None:
+        counts = query_vlan_device_counts(session_obj, logger_orm)
+        print(f"{'VLAN':>4} {'Name':<20} {'Devices':>7}")
+        for vlan in sorted(query_all_vlan(session_obj, logger_orm), key=lambda vlan: int(vlan.id)):
+            print(f"{vlan.id:>4} {vlan.name or '':<20} {counts.get(int(vlan.id), 0):>7}")
         return
-    vlans_device_to_list = [[k, v] for x in vlans_device for k, v in x.items()]
-    return vlans_device_to_list
+    print(f"VLAN {args.vlan} devices: {' '.join(query_vlan_devices(session_obj, logger_orm, args.vlan))}")
+    for row in query_vlan_history(session_obj, logger_orm, args.vlan):
+        print(f"{row.timestamp:.0f} {row.target} {row.device} {row.operation} {row.name}")
 
 
-def vlans_difference(vlans_db, vlans_device, logger_poller):
+def report(config, args):
     """
-    Check differences and return a dict with them
+    Fleet report from the fleet matrix saved by the poller (poller.matrix_file), or from the DB device VLANs
     """
-    # TODO check for differences.
-    difference = [{"device": True, "dev_name": "xxx",
-                   "operation_type": "add/remove/update",
-                   "vlan_id": "1", "vlan_name": "name"},
-                  {"device": False, "dev_name": "database",
-                   "operation_type": "add/remove/update",
-                   "vlan_id": "1", "vlan_name": "name",
-                   "vlan_description": "change_me"}]
-    logger_poller.debug(f"VLANs to sync {difference}")
-    return difference
+    import os
+    from etc.db_ops import DEFAULT_DB_URL, init_db, query_all_vlan, query_fleet_vlans
+    from etc.collection import REPORT_TRUNKS
+    from etc.logger_svc import CustomLogger
+    from etc.vlanset import VlanSet
+
+    if args.kind == REPORT_TRUNKS:
+        write_rows(trunks_report(config), args)
+        return
+    from etc.fleet_matrix import FleetMatrix, NAME_SEPARATOR, REPORT_MISSING, numpy
+    if numpy is None:
+        print("The report command needs NumPy: pip install numpy")
+        sys.exit(1)
+    if args.kind == REPORT_MISSING and args.vlan is None:
+        print(f"The {REPORT_MISSING} report needs --vlan")
+        sys.exit(1)
+    logger_orm = CustomLogger("sqlalchemy", config["db_orm"])
+    session_obj = init_db(config["db_orm"].get("db_url", DEFAULT_DB_URL), logger_orm=logger_orm)
+    matrix_file = config["poller"].get("matrix_file")
+    if matrix_file and os.path.exists(matrix_file) and not args.from_db:
+        matrix = FleetMatrix.load(matrix_file)
+    else:
+        matrix = FleetMatrix.from_db_rows(query_fleet_vlans(session_obj, logger_orm, NAME_SEPARATOR))
+    write_rows(matrix.report(args.kind, VlanSet.from_db(query_all_vlan(session_obj, logger_orm)), args.vlan), args)
 
 
-def sync_device(vlans_db, device, command, logger_poller, logger_orm):
+def trunks_report(config) -> list:
     """
-    Get device VLANs and check if they are the same
+    Device VLANs not allowed on any trunk, from the trunk records of the collection plan (poller.collection_plan)
+    and the DB device VLANs. Without NumPy
     """
-    vlans_device = get_device_vlans(device, command, logger_poller)
-    vlans_difference_result = vlans_difference(vlans_db, vlans_device, logger_poller)
-    if len(vlans_difference_result) != 0:
-        update_vlans(vlans_difference_result, logger_poller, logger_orm)
-        logger_poller.info(f"Device {device} updated")
+    import json
+    from etc.collection import TRUNK_COMMANDS, trunk_report
+    from etc.db_ops import DEFAULT_DB_URL, init_db, query_device_records, query_device_vlans
+    from etc.logger_svc import CustomLogger
+
+    logger_orm = CustomLogger("sqlalchemy", config["db_orm"])
+    session_obj = init_db(config["db_orm"].get("db_url", DEFAULT_DB_URL), logger_orm=logger_orm)
+    records = query_device_records(session_obj, logger_orm, TRUNK_COMMANDS)
+    if not records:
+        print("No trunk records, add the trunk command to poller.collection_plan", file=sys.stderr)
+    return trunk_report([(record.device, json.loads(record.data)) for record in records],
+                        lambda device: query_device_vlans(session_obj, logger_orm, device))
+
+
+def write_rows(rows, args):
+    if args.output:
+        with open(args.output, "w", newline="") as file:
+            write_report(rows, args.format, file)
     else:
-        logger_poller.info(f"Device {device} in sync")
+        write_report(rows, args.format, sys.stdout)
 
 
-async def sync_vlans(executor, inventory, session_obj, logger_poller, logger_orm):
+def write_report(rows, report_format, file):
     """
-    Get VLANs from DB and pool devices with threads
+    :param rows: report rows, dicts with the same keys. In CSV the lists are space separated
     """
-    loop = asyncio.get_event_loop()
-    command = "show vlan"
-    tasks = []
-    logger_orm.info("Getting VLANs from DB")
-    vlans_db = query_all_vlan(session_obj, logger_orm)
-    logger_poller.info("Staring the poller")
-    for device in inventory:
-        tasks.append(loop.run_in_executor(executor, sync_device, vlans_db, device, command, logger_poller, logger_orm))
-    completed, pending = await asyncio.wait(tasks)
-    # results = [t.result() for t in completed]
-    logger_poller.info(f"Sync finished")
+    if report_format == "json":
+        import json
+        json.dump(rows, file)
+        file.write("\n")
+        return
+    import csv
+    if not rows:
+        return
+    writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows({key: " ".join(map(str, value)) if isinstance(value, list) else value
+                      for key, value in row.items()} for row in rows)
+
 
+def parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-f", "--file", help="Main tool configuration filename (for testing purposes")
+    polling = argparse.ArgumentParser(add_help=False)
+    polling.add_argument("-s", "--shard", help="Only poll the devices of this member of sharding.members")
+    main_parser = argparse.ArgumentParser(description="Multi-vendor VLAN sync tool")
+    commands = main_parser.add_subparsers(dest="command")
+    command = commands.add_parser("poll", parents=[common, polling], help="Poll the devices and sync DB and devices")
+    command.add_argument("-p", "--polling_time", help="Seconds between polls of the default scheduler group in "
+                                                      "daemon mode (default scheduler.groups.default)")
+    command.add_argument("-d", "--daemon", action="store_true", help="Run forever, polling every polling_time seconds")
+    command.add_argument("-i", "--inventory", help="Fixed inventory file name (for testing purposes)")
+    command.add_argument("-n", "--dry_run", "--dry-run", action="store_true",
+                         help="Only log the config sets to push to devices")
+    command.set_defaults(function=poll)
+    command = commands.add_parser("diff-only", parents=[common, polling],
+                                  help="Print the changes to sync, without syncing")
+    command.set_defaults(function=diff_only)
+    command = commands.add_parser("push", parents=[common, polling], help="Push the device changes, without DB writes")
+    command.add_argument("-n", "--dry_run", "--dry-run", action="store_true", help="Only print the config sets")
+    command.set_defaults(function=push)
+    command = commands.add_parser("db-report", parents=[common], help="VLANs in the DB and their devices")
+    command.add_argument("-v", "--vlan", type=int, help="Devices and history of this VLAN")
+    command.set_defaults(function=db_report)
+    command = commands.add_parser("report", parents=[common], help="Fleet reports as CSV or JSON")
+    command.add_argument("kind", choices=("drift", "coverage", "names", "missing", "trunks"),
+                         help="drift: devices not in sync with the DB, coverage: devices per VLAN, names: VLAN names "
+                              "not like the DB, missing: devices without --vlan, trunks: device VLANs not allowed on "
+                              "any trunk (collection plan trunk command)")
+    command.add_argument("-v", "--vlan", type=int, help="VLAN of the missing report")
+    command.add_argument("--format", choices=("csv", "json"), default="csv")
+    command.add_argument("-o", "--output", help="Output file, default stdout")
+    command.add_argument("--from-db", action="store_true", help="From the DB device VLANs, not poller.matrix_file")
+    command.set_defaults(function=report)
+    return main_parser
 
-def main(args):
+
+def main(argv=None):
     """
-    Tool to sync VLAN between between devices and DB (ORM)
-    :param args: optional: file, polling time, inventory (check vlan_sync_cfg.yml)
+    :param argv: command line arguments, sys.argv if None. Without a command it is poll, like before the commands
     """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv.insert(0, "poll")
+    args = parser().parse_args(argv)
     config = get_config(args.file) if args.file else get_config(DEFAULT_CONFIG_FILE)
-    logging.basicConfig(level=logging.DEBUG)
-    logger_poller = CustomLogger("main", config["poller"])
-    logger_orm = CustomLogger("sqlalchemy", config["db_orm"])
-    inventory = Inventory(config.get('inventory_sources', ''), logger_poller)
-    session_obj = init_db()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=config["poller"].get("workers", 4))
-    # Will have asyncio ready for other tasks, but the polling is with thread workers for 2 reasons:
-    # - Netmiko and SQLAlchemy are NOT Asyncio ready
-    # - Polling too many devices could DoS authentication systems, overload the network or this same PC
-    # Later could use asyncio semaphore to limit the polled devices if changing library to "netdev",
-    # which is a port of asyncio version of Netmiko. But currently does not have all the extensions.
-    # Scrapli is another good option, but I had problems in my Lab device which doesn't make any sense to work on now.
-    event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(sync_vlans(executor, inventory.devices, session_obj, logger_poller, logger_orm))
+    args.function(config, args)
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Multi-vendor VLAN sync tool")
-    parser.add_argument("-f", "--file", help="Main tool configuration filename (for testing purposes")
-    parser.add_argument("-p", "--polling_time", help="Main tool configuration filename (for testing purposes)")
-    parser.add_argument("-i", "--inventory", help="Fixed inventory file name (for testing purposes)")
-    options = parser.parse_args()
-    main(options)
+    main()